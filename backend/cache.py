@@ -0,0 +1,302 @@
+"""Small caching primitives shared by the backend.
+
+- LRUCache: bounded, thread-safe LRU with optional per-entry TTL and hit stats
+- SingleFlight: coalesces concurrent calls for the same key into one
+- AsyncSingleFlight: the same for coroutines on one event loop
+- ResponseCache: generated replies keyed by model, prompt and sampling
+  params, with an optional on-disk tier that survives restarts
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# directory for the on-disk tier; unset keeps the cache in memory only
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR") or None
+RESPONSE_CACHE_DISK_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_DISK_MAX_ENTRIES", "10000"))
+# sampled replies are meant to vary, so by default only greedy decoding is cached;
+# raise this to also cache sampling at or below the given temperature
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "0"))
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded LRU mapping with optional expiry; safe to share between threads."""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return `(result, shared)`; `shared` is True when another caller did the work."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """Run at most one coroutine per key at a time; concurrent awaiters share its result.
+
+    The shared call runs as its own task, so cancelling one awaiter (e.g.
+    the request that started it was disconnected) does not cancel it for
+    the others; it is only cancelled once nobody is waiting for it.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, list] = {}  # key -> [task, number of awaiters]
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Await `fn()` once per key; returns `(result, shared)` like `SingleFlight.do`."""
+        call = self._calls.get(key)
+        shared = call is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            call = self._calls[key] = [task, 0]
+
+            def _done(_, call=call):
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+            task.add_done_callback(_done)
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task), shared
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                task.cancel()
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+
+class ResponseCache:
+    """Cache of generated replies in front of `ModelWrapper.generate_response`.
+
+    Identical requests (same model, prompt and sampling params) are served
+    from a bounded in-memory LRU, then from the optional disk tier. A burst
+    of identical requests runs a single generation that all of them share.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL, disk_dir: Optional[str] = RESPONSE_CACHE_DIR, disk_max_entries: int = RESPONSE_CACHE_DISK_MAX_ENTRIES, enabled: bool = RESPONSE_CACHE_ENABLED, max_temperature: float = RESPONSE_CACHE_MAX_TEMPERATURE):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.flight = SingleFlight()
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_entries = disk_max_entries
+        self.disk_hits = 0
+        self._disk_writes = 0
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, **params) -> str:
+        payload = json.dumps({"model": model_name, "prompt": prompt, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def should_use(self, use_cache: Optional[bool], do_sample: bool, temperature: float) -> bool:
+        """Per-request switch: explicit `use_cache` wins, otherwise skip sampling above `max_temperature`."""
+        if not self.enabled or use_cache is False:
+            return False
+        if use_cache:
+            return True
+        return not do_sample or temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None and self.disk_dir is not None:
+            value = self._disk_get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.disk_dir is not None:
+            self._disk_set(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Tuple[str, bool]]) -> str:
+        """Return the cached reply for `key` or compute it once for all concurrent callers.
+
+        `compute` returns `(reply, cacheable)`; replies of aborted generations
+        are passed back to their caller but neither stored nor shared.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        def _leader():
+            value, cacheable = compute()
+            if cacheable:
+                self.set(key, value)
+            return value, cacheable
+
+        (value, cacheable), shared = self.flight.do(key, _leader)
+        if shared and not cacheable:
+            value, _ = compute()
+        return value
+
+    # ---- disk tier ----
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at") and entry["expires_at"] <= time.time():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return entry.get("value")
+
+    def _disk_set(self, key: str, value: str) -> None:
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            path = self._disk_path(key)
+            tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"value": value, "expires_at": time.time() + self.ttl if self.ttl else None}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Response cache disk write failed: {e}")
+            return
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        try:
+            files = sorted(self.disk_dir.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        except OSError:
+            return
+        for path in files[:max(0, len(files) - self.disk_max_entries)]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.memory.stats()
+        stats.update(
+            enabled=self.enabled,
+            disk_enabled=self.disk_dir is not None,
+            disk_hits=self.disk_hits,
+            coalesced=self.flight.coalesced,
+        )
+        return stats
+
+
+# Global response cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,163 @@
+"""Model cascade for /predict: fall back to a second model when the first reply is short.
+
+The primary model's reply is kept once it reaches `min_chars`; a reply that
+ends shorter is replaced by the fallback model's reply (if that one is
+longer). How the fallback is scheduled is set by CASCADE_MODE:
+
+- "sequential" (default): run the fallback only after the primary
+  finished short (worst case: two full generations back to back, but no
+  extra compute when the primary's reply is long enough)
+- "concurrent": start both models at once and cancel the fallback as soon
+  as the primary's stream reaches `min_chars`
+- "hedge": start the fallback once the primary has either ended short or
+  not reached `min_chars` within CASCADE_HEDGE_DELAY seconds. Set the delay
+  above the time the primary normally takes to produce `min_chars` (on CPU
+  that is several seconds), or nearly every request runs both models.
+
+Both generations are streamed on the inference executor so progress can be
+watched; the loser is cancelled through its `stop_event`.
+"""
+
+import asyncio
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+try:
+    from .executor import inference_executor, watch_disconnect
+except Exception:
+    from executor import inference_executor, watch_disconnect
+
+CASCADE_MODE = os.getenv("CASCADE_MODE", "sequential").lower()
+CASCADE_MIN_CHARS = int(os.getenv("CASCADE_MIN_CHARS", "200"))
+CASCADE_HEDGE_DELAY = float(os.getenv("CASCADE_HEDGE_DELAY", "1.0"))
+
+
+@dataclass
+class CascadeResult:
+    reply: str
+    winner: str
+    reason: str
+    mode: str
+    cancelled: List[str] = field(default_factory=list)
+
+    def info(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "winner": self.winner, "reason": self.reason, "cancelled": self.cancelled}
+
+
+class _Run:
+    """One streamed generation whose text and progress can be awaited."""
+
+    def __init__(self, name: str, model, prompt: str, min_chars: int, gen_kwargs: Dict[str, Any]):
+        self.name = name
+        self.stop_event = threading.Event()
+        self.long_enough = asyncio.Event()
+        self.min_chars = min_chars
+        self.chunks: List[str] = []
+        self.length = 0
+        self.error: Optional[BaseException] = None
+        self.task = asyncio.create_task(self._consume(model.stream_response(prompt, stop_event=self.stop_event, **gen_kwargs)))
+
+    async def _consume(self, chunks):
+        try:
+            async for chunk in inference_executor.iterate(chunks, self.stop_event):
+                self.chunks.append(chunk)
+                self.length += len(chunk)
+                if self.length >= self.min_chars:
+                    self.long_enough.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.long_enough.set()  # also wakes waiters when the stream ends short
+
+    @property
+    def reply(self) -> str:
+        return "".join(self.chunks).strip()
+
+    def cancel(self):
+        self.stop_event.set()
+
+    async def wait(self) -> str:
+        await self.task
+        return self.reply
+
+
+async def run_cascade(request, primary, fallback, min_chars: int = CASCADE_MIN_CHARS, mode: str = CASCADE_MODE, hedge_delay: float = CASCADE_HEDGE_DELAY, **gen_kwargs) -> CascadeResult:
+    """Generate with `primary`, falling back to `fallback` for short replies.
+
+    `primary` and `fallback` are `(name, model, prompt)` tuples, optionally
+    with a fourth item of per-model keyword arguments (e.g. its stop
+    sequences); `fallback` may be None. It may also be an async function
+    returning the tuple, called only once the primary's reply turned out
+    short (e.g. to load a model that is not resident); such a fallback
+    always runs sequentially, whatever `mode` says. `gen_kwargs` go to each
+    model's `stream_response`. Both generations stop when the HTTP client
+    of `request` disconnects.
+    """
+    if callable(fallback):
+        mode = "sequential"
+    runs: List[_Run] = []
+    disconnected = threading.Event()
+
+    async def _watch():
+        await watch_disconnect(request, disconnected)
+        for run in runs:
+            run.cancel()
+
+    watcher = asyncio.create_task(_watch())
+
+    async def _start(candidate) -> _Run:
+        if callable(candidate):
+            candidate = await candidate()
+        name, model, prompt, *extra = candidate
+        run = _Run(name, model, prompt, min_chars, {**gen_kwargs, **(extra[0] if extra else {})})
+        runs.append(run)
+        return run
+
+    try:
+        first = await _start(primary)
+        second = await _start(fallback) if fallback is not None and mode == "concurrent" else None
+
+        if second is None and fallback is not None and mode == "hedge":
+            try:
+                await asyncio.wait_for(asyncio.shield(first.long_enough.wait()), hedge_delay)
+            except asyncio.TimeoutError:
+                second = await _start(fallback)
+
+        await first.long_enough.wait()
+        if first.length >= min_chars and first.error is None:
+            cancelled = []
+            if second is not None:
+                second.cancel()
+                cancelled.append(second.name)
+            return CascadeResult(await first.wait(), first.name, "primary_long_enough", mode, cancelled)
+
+        primary_reply = await first.wait()
+        if fallback is None:
+            if first.error is not None:
+                raise first.error
+            return CascadeResult(primary_reply, first.name, "no_fallback", mode)
+        if second is None:
+            try:
+                second = await _start(fallback)
+            except Exception as e:
+                print(f"Cascade fallback unavailable: {e}")
+                if first.error is not None:
+                    raise first.error
+                return CascadeResult(primary_reply, first.name, "fallback_unavailable", mode)
+        fallback_reply = await second.wait()
+        if second.error is not None:
+            if first.error is not None:
+                raise first.error
+            return CascadeResult(primary_reply, first.name, "fallback_failed", mode)
+        if first.error is not None:
+            return CascadeResult(fallback_reply, second.name, "primary_failed", mode)
+        if len(fallback_reply) > len(primary_reply):
+            return CascadeResult(fallback_reply, second.name, "primary_short", mode)
+        return CascadeResult(primary_reply, first.name, "fallback_not_longer", mode)
+    finally:
+        watcher.cancel()
+        for run in runs:
+            if not run.task.done():
+                run.cancel()
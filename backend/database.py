@@ -1,40 +1,589 @@
+import asyncio
+import atexit
 import json
 import os
+import sqlite3
+import threading
 from pathlib import Path
 from datetime import datetime
 import hashlib
 import re
+from typing import Dict, Optional, Tuple
 
 # Database file path
 DB_DIR = Path(__file__).parent / "data"
-DB_DIR.mkdir(exist_ok=True)
 DB_FILE = DB_DIR / "users.json"
+# storage engine: "sqlite" (WAL mode, row-level updates) or "json" (the whole file is rewritten on every write)
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlite").lower()
+DB_SQLITE_FILE = Path(os.getenv("DB_SQLITE_FILE", str(DB_DIR / "users.db")))
+# how long a writer waits for another process's write lock before failing
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# bookkeeping writes such as last_login are buffered and flushed every this many seconds (0 = write at once)
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "5"))
+# messages / conversation summaries per page when the client does not ask for a size, and the cap
+CONVERSATION_PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "50"))
+CONVERSATION_MAX_PAGE_SIZE = int(os.getenv("CONVERSATION_MAX_PAGE_SIZE", "200"))
+MESSAGE_ROLES = ("user", "assistant", "system")
+_PREVIEW_CHARS = 80
 
-class Database:
-    """Simple JSON-based user database for authentication"""
-    
-    def __init__(self):
-        self.db_file = DB_FILE
+
+def _page_size(limit: Optional[int]) -> int:
+    return max(1, min(limit or CONVERSATION_PAGE_SIZE, CONVERSATION_MAX_PAGE_SIZE))
+
+
+def _message_from_client(message: dict, seq: int) -> dict:
+    """Stored form of a message; the frontend's `text` is accepted for `content`, other keys go to `meta`"""
+    meta = {k: v for k, v in message.items() if k not in ("seq", "role", "content", "text", "created_at", "meta")}
+    meta.update(message.get("meta") or {})
+    return {
+        "seq": seq,
+        "role": message.get("role", "user"),
+        "content": message.get("content", message.get("text", "")),
+        "created_at": message.get("created_at") or datetime.now().isoformat(),
+        "meta": meta,
+    }
+
+
+def _summary_cursor(summary: dict) -> str:
+    return f"{summary['updated_at']}|{summary['id']}"
+
+
+def _parse_cursor(cursor: str) -> Tuple[str, str]:
+    """(updated_at, id) of a summary cursor; timestamps never contain "|", ids may"""
+    updated_at, _, conversation_id = cursor.partition("|")
+    return updated_at, conversation_id
+
+
+class JsonUserStore:
+    """All users in one JSON file, rewritten on every write (single process only)"""
+
+    def __init__(self, path: Path = DB_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
         self._load_database()
-    
+
     def _load_database(self):
         """Load users from JSON file"""
-        if self.db_file.exists():
+        if self.path.exists():
             try:
-                with open(self.db_file, 'r', encoding='utf-8') as f:
+                with open(self.path, 'r', encoding='utf-8') as f:
                     self.data = json.load(f)
             except (json.JSONDecodeError, IOError):
                 self.data = {"users": {}}
         else:
             self.data = {"users": {}}
-    
+
     def _save_database(self):
         """Save users to JSON file"""
         try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
+            # created on first write so importing this module has no side effects on disk
+            self.path.parent.mkdir(exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
                 json.dump(self.data, f, indent=2, ensure_ascii=False)
         except IOError as e:
             raise Exception(f"Error saving database: {str(e)}")
+
+    def exists(self, email: str) -> bool:
+        return email in self.data.get("users", {})
+
+    def get(self, email: str) -> Optional[dict]:
+        return self.data.get("users", {}).get(email)
+
+    def insert(self, user: dict) -> bool:
+        """Add a user; False if the email is taken"""
+        with self._lock:
+            users = self.data.setdefault("users", {})
+            if user["email"] in users:
+                return False
+            users[user["email"]] = user
+            self._save_database()
+        return True
+
+    def update(self, email: str, **fields) -> bool:
+        with self._lock:
+            user = self.get(email)
+            if user is None:
+                return False
+            user.update(fields)
+            self._save_database()
+        return True
+
+    def update_many(self, updates: Dict[str, dict]) -> None:
+        """Apply field updates for several users with one file write"""
+        with self._lock:
+            for email, fields in updates.items():
+                user = self.get(email)
+                if user is not None:
+                    user.update(fields)
+            self._save_database()
+
+    def all_users(self):
+        return list(self.data.get("users", {}).values())
+
+    # conversations live inside the user record, so every write still rewrites the file
+
+    def _conversation(self, email: str, conversation_id: str) -> Optional[dict]:
+        user = self.get(email)
+        if user is None:
+            return None
+        return next((c for c in user.get("conversations", []) if str(c.get("id")) == conversation_id), None)
+
+    def _messages(self, conversation: dict) -> list:
+        # messages saved by the old whole-list API have no seq; their position is it
+        return [_message_from_client(m, m.get("seq") or i + 1) for i, m in enumerate(conversation.get("messages", []))]
+
+    def _summary(self, conversation: dict) -> dict:
+        messages = conversation.get("messages", [])
+        created_at = conversation.get("created_at") or conversation.get("createdAt")
+        last = messages[-1] if messages else {}
+        return {
+            "id": str(conversation.get("id")),
+            "title": conversation.get("title"),
+            "created_at": created_at,
+            "updated_at": conversation.get("updated_at") or created_at or "",
+            "message_count": len(messages),
+            "preview": (last.get("content", last.get("text")) or "")[:_PREVIEW_CHARS],
+        }
+
+    def append_message(self, email: str, conversation_id: str, message: dict, title: Optional[str] = None) -> Optional[dict]:
+        with self._lock:
+            user = self.get(email)
+            if user is None:
+                return None
+            conversation = self._conversation(email, conversation_id)
+            now = datetime.now().isoformat()
+            if conversation is None:
+                conversation = {"id": conversation_id, "title": title, "messages": [], "created_at": now}
+                user.setdefault("conversations", []).insert(0, conversation)
+            elif title:
+                conversation["title"] = title
+            stored = _message_from_client(message, len(conversation["messages"]) + 1)
+            conversation["messages"].append(stored)
+            conversation["updated_at"] = now
+            self._save_database()
+        return {"conversation_id": conversation_id, "seq": stored["seq"], "message_count": stored["seq"]}
+
+    def replace_messages(self, email: str, conversation_id: str, messages: list, title: Optional[str] = None) -> Optional[dict]:
+        with self._lock:
+            user = self.get(email)
+            if user is None:
+                return None
+            conversation = self._conversation(email, conversation_id)
+            now = datetime.now().isoformat()
+            if conversation is None:
+                conversation = {"id": conversation_id, "title": title, "created_at": now}
+                user.setdefault("conversations", []).insert(0, conversation)
+            elif title:
+                conversation["title"] = title
+            conversation["messages"] = [_message_from_client(m, i + 1) for i, m in enumerate(messages)]
+            conversation["updated_at"] = now
+            self._save_database()
+        return {"conversation_id": conversation_id, "message_count": len(messages)}
+
+    def get_messages(self, email: str, conversation_id: str, before: Optional[int] = None, after: Optional[int] = None, limit: int = CONVERSATION_PAGE_SIZE) -> Optional[Tuple[list, int]]:
+        conversation = self._conversation(email, conversation_id)
+        if conversation is None:
+            return None
+        messages = self._messages(conversation)
+        if after is not None:
+            page = [m for m in messages if m["seq"] > after][:limit]
+        else:
+            page = [m for m in messages if before is None or m["seq"] < before][-limit:]
+        return page, len(messages)
+
+    def list_conversations(self, email: str, before: Optional[str] = None, limit: int = CONVERSATION_PAGE_SIZE) -> list:
+        user = self.get(email)
+        summaries = sorted((self._summary(c) for c in (user or {}).get("conversations", [])), key=lambda c: (c["updated_at"], c["id"]), reverse=True)
+        if before is not None:
+            summaries = [c for c in summaries if (c["updated_at"], c["id"]) < _parse_cursor(before)]
+        return summaries[:limit]
+
+    def delete_conversation(self, email: str, conversation_id: str) -> bool:
+        with self._lock:
+            user = self.get(email)
+            conversation = self._conversation(email, conversation_id)
+            if conversation is None:
+                return False
+            user["conversations"].remove(conversation)
+            self._save_database()
+        return True
+
+    def conversations(self, email: str) -> list:
+        user = self.get(email)
+        return user.get("conversations", []) if user else []
+
+    def close(self):
+        pass
+
+
+class SqliteUserStore:
+    """Users in SQLite (WAL mode): indexed lookup by email, one row written per update.
+
+    WAL lets readers run while another connection writes, so several
+    workers can share the file. Each thread gets its own connection.
+    A new database imports an existing users.json once.
+
+    Conversations have their own tables: appending a message inserts one
+    row and bumps its conversation's counter, and pages are read by
+    (conversation, seq) range, so the cost does not grow with the history.
+    """
+
+    _COLUMNS = ("email", "username", "password_hash", "gender", "created_at", "last_login", "conversations")
+
+    def __init__(self, path: Path = DB_SQLITE_FILE, import_from: Optional[Path] = DB_FILE):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # created on first use so importing this module has no side effects on disk
+        self._ready = False
+        self._import_from = import_from
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        with self._lock:
+            if not self._ready:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                is_new = not self.path.exists()
+            conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # with WAL, NORMAL only syncs at checkpoints; a crash can lose the last commits but not corrupt the file
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._connections.append(conn)
+            self._local.conn = conn
+            if not self._ready:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS users ("
+                    " email TEXT PRIMARY KEY,"
+                    " username TEXT NOT NULL,"
+                    " password_hash TEXT NOT NULL,"
+                    " gender TEXT,"
+                    " created_at TEXT,"
+                    " last_login TEXT,"
+                    " conversations TEXT NOT NULL DEFAULT '[]'"  # unused; conversations have their own tables
+                    ") WITHOUT ROWID"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS conversations ("
+                    " email TEXT NOT NULL,"
+                    " id TEXT NOT NULL,"
+                    " title TEXT,"
+                    " created_at TEXT,"
+                    " updated_at TEXT NOT NULL,"
+                    " message_count INTEGER NOT NULL DEFAULT 0,"
+                    " PRIMARY KEY (email, id)"
+                    ") WITHOUT ROWID"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS conversations_recent ON conversations (email, updated_at, id)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS messages ("
+                    " email TEXT NOT NULL,"
+                    " conversation_id TEXT NOT NULL,"
+                    " seq INTEGER NOT NULL,"
+                    " role TEXT NOT NULL,"
+                    " content TEXT NOT NULL,"
+                    " created_at TEXT,"
+                    " meta TEXT,"
+                    " PRIMARY KEY (email, conversation_id, seq)"
+                    ") WITHOUT ROWID"
+                )
+                # databases created before the conversation tables kept the whole list in the user row
+                with conn:
+                    for row in conn.execute("SELECT email, conversations FROM users WHERE conversations != '[]'").fetchall():
+                        self._replace_conversations(conn, row["email"], json.loads(row["conversations"]))
+                conn.commit()
+                self._ready = True
+                if is_new and self._import_from is not None and Path(self._import_from).exists():
+                    count = migrate_json_to_sqlite(self._import_from, store=self)
+                    print(f"Imported {count} users from {self._import_from} into {self.path}")
+        return conn
+
+    @classmethod
+    def _row_to_user(cls, row) -> Optional[dict]:
+        """The user without conversations (see `conversations`)"""
+        if row is None:
+            return None
+        user = dict(row)
+        user.pop("conversations", None)
+        return user
+
+    @staticmethod
+    def _user_values(user: dict) -> list:
+        return [user.get(field) if field != "conversations" else "[]" for field in SqliteUserStore._COLUMNS]
+
+    def exists(self, email: str) -> bool:
+        return self._connect().execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone() is not None
+
+    def get(self, email: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+        return self._row_to_user(row)
+
+    def insert(self, user: dict) -> bool:
+        """Add a user; False if the email is taken"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f"INSERT INTO users ({', '.join(self._COLUMNS)}) VALUES ({', '.join('?' * len(self._COLUMNS))})", self._user_values(user))
+                self._replace_conversations(conn, user["email"], user.get("conversations") or [])
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def insert_many(self, users) -> int:
+        """Add users in one transaction, skipping emails that exist; returns how many were added"""
+        conn = self._connect()
+        added = 0
+        with conn:
+            for user in users:
+                cursor = conn.execute(f"INSERT OR IGNORE INTO users ({', '.join(self._COLUMNS)}) VALUES ({', '.join('?' * len(self._COLUMNS))})", self._user_values(user))
+                if cursor.rowcount > 0:
+                    self._replace_conversations(conn, user["email"], user.get("conversations") or [])
+                    added += 1
+        return added
+
+    def update(self, email: str, **fields) -> bool:
+        conversations = fields.pop("conversations", None)
+        unknown = set(fields) - set(self._COLUMNS[1:-1])
+        if unknown:
+            raise ValueError(f"Unknown user fields: {sorted(unknown)}")
+        conn = self._connect()
+        with conn:
+            if fields:
+                cursor = conn.execute(
+                    f"UPDATE users SET {', '.join(f'{field} = ?' for field in fields)} WHERE email = ?",
+                    list(fields.values()) + [email],
+                )
+                if cursor.rowcount == 0:
+                    return False
+            elif conn.execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone() is None:
+                return False
+            if conversations is not None:
+                self._replace_conversations(conn, email, conversations)
+        return True
+
+    def update_many(self, updates: Dict[str, dict]) -> None:
+        """Apply field updates for several users in one transaction"""
+        conn = self._connect()
+        with conn:
+            for email, fields in updates.items():
+                unknown = set(fields) - set(self._COLUMNS[1:-1])
+                if unknown:
+                    raise ValueError(f"Unknown user fields: {sorted(unknown)}")
+                conn.execute(f"UPDATE users SET {', '.join(f'{field} = ?' for field in fields)} WHERE email = ?", list(fields.values()) + [email])
+
+    def all_users(self):
+        return [self._row_to_user(row) for row in self._connect().execute("SELECT * FROM users ORDER BY created_at")]
+
+    # ---- conversations ----
+
+    @staticmethod
+    def _insert_message(conn: sqlite3.Connection, email: str, conversation_id: str, message: dict) -> None:
+        conn.execute(
+            "INSERT INTO messages (email, conversation_id, seq, role, content, created_at, meta) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (email, conversation_id, message["seq"], message["role"], message["content"], message["created_at"],
+             json.dumps(message["meta"], ensure_ascii=False) if message["meta"] else None),
+        )
+
+    def _replace_conversations(self, conn: sqlite3.Connection, email: str, conversations: list) -> None:
+        """Store a whole conversation list (old API / imports) in the conversation tables"""
+        conn.execute("DELETE FROM messages WHERE email = ?", (email,))
+        conn.execute("DELETE FROM conversations WHERE email = ?", (email,))
+        for conversation in conversations:
+            conversation_id = str(conversation.get("id"))
+            messages = [_message_from_client(m, i + 1) for i, m in enumerate(conversation.get("messages", []))]
+            created_at = conversation.get("created_at") or conversation.get("createdAt") or datetime.now().isoformat()
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations (email, id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?, ?)",
+                (email, conversation_id, conversation.get("title"), created_at, conversation.get("updated_at") or created_at, len(messages)),
+            )
+            for message in messages:
+                self._insert_message(conn, email, conversation_id, message)
+        conn.execute("UPDATE users SET conversations = '[]' WHERE email = ?", (email,))
+
+    def append_message(self, email: str, conversation_id: str, message: dict, title: Optional[str] = None) -> Optional[dict]:
+        """Append one message, creating the conversation on its first message; None for an unknown user"""
+        conn = self._connect()
+        now = datetime.now().isoformat()
+        with conn:
+            # the first write takes the database write lock, so concurrent appends get distinct seqs
+            cursor = conn.execute(
+                "UPDATE conversations SET message_count = message_count + 1, updated_at = ?, title = COALESCE(?, title) WHERE email = ? AND id = ?",
+                (now, title, email, conversation_id),
+            )
+            if cursor.rowcount == 0:
+                if conn.execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone() is None:
+                    return None
+                conn.execute(
+                    "INSERT INTO conversations (email, id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?, 1)",
+                    (email, conversation_id, title, now, now),
+                )
+            seq = conn.execute("SELECT message_count FROM conversations WHERE email = ? AND id = ?", (email, conversation_id)).fetchone()[0]
+            self._insert_message(conn, email, conversation_id, _message_from_client(message, seq))
+        return {"conversation_id": conversation_id, "seq": seq, "message_count": seq}
+
+    def replace_messages(self, email: str, conversation_id: str, messages: list, title: Optional[str] = None) -> Optional[dict]:
+        """Replace a conversation's messages (after an edit or delete), renumbered from 1; None for an unknown user"""
+        conn = self._connect()
+        now = datetime.now().isoformat()
+        with conn:
+            if conn.execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone() is None:
+                return None
+            conn.execute("DELETE FROM messages WHERE email = ? AND conversation_id = ?", (email, conversation_id))
+            cursor = conn.execute(
+                "UPDATE conversations SET message_count = ?, updated_at = ?, title = COALESCE(?, title) WHERE email = ? AND id = ?",
+                (len(messages), now, title, email, conversation_id),
+            )
+            if cursor.rowcount == 0:
+                conn.execute(
+                    "INSERT INTO conversations (email, id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?, ?)",
+                    (email, conversation_id, title, now, now, len(messages)),
+                )
+            for i, message in enumerate(messages):
+                self._insert_message(conn, email, conversation_id, _message_from_client(message, i + 1))
+        return {"conversation_id": conversation_id, "message_count": len(messages)}
+
+    @staticmethod
+    def _row_to_message(row) -> dict:
+        return {"seq": row["seq"], "role": row["role"], "content": row["content"], "created_at": row["created_at"], "meta": json.loads(row["meta"]) if row["meta"] else {}}
+
+    def get_messages(self, email: str, conversation_id: str, before: Optional[int] = None, after: Optional[int] = None, limit: int = CONVERSATION_PAGE_SIZE) -> Optional[Tuple[list, int]]:
+        """A page of messages and the conversation's message count; None if it does not exist
+
+        `after` pages forward (messages newer than that seq); otherwise the
+        newest `limit` messages older than `before` are returned, oldest first.
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT message_count FROM conversations WHERE email = ? AND id = ?", (email, conversation_id)).fetchone()
+        if row is None:
+            return None
+        if after is not None:
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE email = ? AND conversation_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (email, conversation_id, after, limit),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE email = ? AND conversation_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (email, conversation_id, before if before is not None else row[0] + 1, limit),
+            ).fetchall()[::-1]
+        return [self._row_to_message(r) for r in rows], row[0]
+
+    def list_conversations(self, email: str, before: Optional[str] = None, limit: int = CONVERSATION_PAGE_SIZE) -> list:
+        """Conversation summaries, most recently updated first; `before` is the cursor of the previous page's last one"""
+        updated_at, conversation_id = _parse_cursor(before or "")
+        rows = self._connect().execute(
+            "SELECT c.id, c.title, c.created_at, c.updated_at, c.message_count,"
+            " (SELECT substr(m.content, 1, ?) FROM messages m WHERE m.email = c.email AND m.conversation_id = c.id AND m.seq = c.message_count) AS preview"
+            " FROM conversations c WHERE c.email = ? AND (? IS NULL OR (c.updated_at, c.id) < (?, ?))"
+            " ORDER BY c.updated_at DESC, c.id DESC LIMIT ?",
+            (_PREVIEW_CHARS, email, before, updated_at, conversation_id, limit),
+        ).fetchall()
+        return [dict(row, preview=row["preview"] or "") for row in rows]
+
+    def delete_conversation(self, email: str, conversation_id: str) -> bool:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE email = ? AND conversation_id = ?", (email, conversation_id))
+            cursor = conn.execute("DELETE FROM conversations WHERE email = ? AND id = ?", (email, conversation_id))
+        return cursor.rowcount > 0
+
+    def conversations(self, email: str) -> list:
+        """Every conversation with all its messages, newest first (the old whole-list shape)"""
+        conn = self._connect()
+        result = []
+        for row in conn.execute("SELECT * FROM conversations WHERE email = ? ORDER BY updated_at DESC, id DESC", (email,)).fetchall():
+            messages = conn.execute("SELECT * FROM messages WHERE email = ? AND conversation_id = ? ORDER BY seq", (email, row["id"])).fetchall()
+            conversation = {k: row[k] for k in ("id", "title", "created_at", "updated_at")}
+            conversation["messages"] = [self._row_to_message(m) for m in messages]
+            result.append(conversation)
+        return result
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections = []
+            self._local = threading.local()
+
+
+def migrate_json_to_sqlite(json_path: Path = DB_FILE, sqlite_path: Path = DB_SQLITE_FILE, store: Optional[SqliteUserStore] = None) -> int:
+    """Copy the users of a users.json file into SQLite; users already there are kept. Returns how many were added."""
+    users = JsonUserStore(json_path).all_users()
+    if store is not None:
+        return store.insert_many(users)
+    store = SqliteUserStore(sqlite_path, import_from=None)
+    try:
+        return store.insert_many(users)
+    finally:
+        store.close()
+
+
+def _open_store(backend: str):
+    if backend == "json":
+        return JsonUserStore(DB_FILE)
+    if backend == "sqlite":
+        return SqliteUserStore(DB_SQLITE_FILE)
+    raise ValueError(f"Unsupported DB_BACKEND {backend!r}; use 'sqlite' or 'json'")
+
+
+class Database:
+    """User database for authentication, stored in SQLite (default) or users.json"""
+    
+    def __init__(self, store=None, flush_interval: float = DB_FLUSH_INTERVAL):
+        self.store = store if store is not None else _open_store(DB_BACKEND)
+        self.db_file = self.store.path
+        # bookkeeping fields waiting for the next flush, by email
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, dict] = {}
+        self._pending_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+    
+    def record(self, email: str, **fields):
+        """Buffer bookkeeping fields (e.g. last_login) for the next background flush"""
+        if self.flush_interval <= 0:
+            self.store.update(email, **fields)
+            return
+        with self._pending_lock:
+            self._pending.setdefault(email, {}).update(fields)
+            if self._flusher is None:
+                # started on first use so importing this module starts no threads
+                self._flusher = threading.Thread(target=self._flush_loop, name="sofai-db-flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+    
+    def flush(self) -> int:
+        """Write buffered bookkeeping now; returns how many users were updated"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self.store.update_many(pending)
+        except Exception as e:
+            print(f"Error flushing user bookkeeping: {e}")
+            with self._pending_lock:
+                # keep newer values recorded while the write was failing
+                for email, fields in pending.items():
+                    self._pending[email] = {**fields, **self._pending.get(email, {})}
+            return 0
+        return len(pending)
+    
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+    
+    def _with_pending(self, user: Optional[dict]) -> Optional[dict]:
+        if user is not None:
+            with self._pending_lock:
+                user.update(self._pending.get(user["email"], {}))
+        return user
     
     @staticmethod
     def _hash_password(password: str) -> str:
@@ -60,7 +609,7 @@ class Database:
     
     def user_exists(self, email: str) -> bool:
         """Check if user exists by email"""
-        return email.lower() in self.data.get("users", {})
+        return self.store.exists(email.lower())
     
     def create_user(self, email: str, password: str, username: str, gender: str = "not-specified") -> dict:
         """Create a new user account"""
@@ -92,8 +641,9 @@ class Database:
             "conversations": []
         }
         
-        self.data["users"][email.lower()] = user_data
-        self._save_database()
+        if not self.store.insert(user_data):
+            # another worker created it since the check above
+            return {"success": False, "error": "User already exists. Please login or use a different email."}
         
         return {
             "success": True,
@@ -110,18 +660,16 @@ class Database:
         email_lower = email.lower()
         
         # Check if user exists
-        if not self.user_exists(email):
+        user = self.store.get(email_lower)
+        if user is None:
             return {"success": False, "error": "User not found. Please create an account."}
         
-        user = self.data["users"][email_lower]
-        
         # Verify password
         if user["password_hash"] != self._hash_password(password):
             return {"success": False, "error": "Invalid password. Please try again."}
         
-        # Update last login
-        user["last_login"] = datetime.now().isoformat()
-        self._save_database()
+        # Update last login (written by the next background flush)
+        self.record(email_lower, last_login=datetime.now().isoformat())
         
         return {
             "success": True,
@@ -135,27 +683,115 @@ class Database:
     
     def get_user(self, email: str) -> dict:
         """Get user by email"""
-        email_lower = email.lower()
-        if not self.user_exists(email):
-            return None
-        return self.data["users"][email_lower]
+        user = self._with_pending(self.store.get(email.lower()))
+        if user is not None:
+            user["conversations"] = self.store.conversations(email.lower())
+        return user
     
     def update_user_conversations(self, email: str, conversations: list) -> bool:
-        """Update user's conversations"""
-        email_lower = email.lower()
-        if not self.user_exists(email):
-            return False
-        
-        self.data["users"][email_lower]["conversations"] = conversations
-        self._save_database()
-        return True
+        """Replace all of a user's conversations (prefer `append_message`)"""
+        return self.store.update(email.lower(), conversations=conversations)
     
     def get_user_conversations(self, email: str) -> list:
         """Get user's conversations"""
-        user = self.get_user(email)
-        if user:
-            return user.get("conversations", [])
-        return []
+        return self.store.conversations(email.lower())
+    
+    def append_message(self, email: str, conversation_id: str, role: str, content: str, title: str = None, meta: dict = None) -> dict:
+        """Append one message to a conversation (created on its first message)"""
+        if role not in MESSAGE_ROLES:
+            return {"success": False, "error": f"Role must be one of {', '.join(MESSAGE_ROLES)}"}
+        if not conversation_id:
+            return {"success": False, "error": "Conversation id is required"}
+        
+        result = self.store.append_message(email.lower(), str(conversation_id), {"role": role, "content": content, "meta": meta or {}}, title)
+        if result is None:
+            return {"success": False, "error": "User not found. Please create an account."}
+        return {"success": True, **result}
+    
+    def replace_messages(self, email: str, conversation_id: str, messages: list, title: str = None) -> dict:
+        """Replace all messages of a conversation, e.g. after one was edited or deleted
+        
+        `messages` are `{role, content, meta}` dicts, oldest first; they are
+        renumbered from seq 1, so clients should reload the conversation.
+        """
+        if any(m.get("role") not in MESSAGE_ROLES for m in messages):
+            return {"success": False, "error": f"Role must be one of {', '.join(MESSAGE_ROLES)}"}
+        if not conversation_id:
+            return {"success": False, "error": "Conversation id is required"}
+        
+        result = self.store.replace_messages(email.lower(), str(conversation_id), messages, title)
+        if result is None:
+            return {"success": False, "error": "User not found. Please create an account."}
+        return {"success": True, **result}
+    
+    def get_conversation_page(self, email: str, conversation_id: str, before: int = None, after: int = None, limit: int = None) -> dict:
+        """A page of a conversation's messages, oldest first
+        
+        Without a cursor this is the newest page; pass `next_cursor` back as
+        `before` for older messages, or the last seen seq as `after` to get
+        only what was added since.
+        """
+        page = self.store.get_messages(email.lower(), str(conversation_id), before=before, after=after, limit=_page_size(limit))
+        if page is None:
+            return {"success": False, "error": "Conversation not found"}
+        messages, message_count = page
+        if after is not None:
+            next_cursor = messages[-1]["seq"] if messages and messages[-1]["seq"] < message_count else None
+        else:
+            next_cursor = messages[0]["seq"] if messages and messages[0]["seq"] > 1 else None
+        return {
+            "success": True,
+            "conversation_id": str(conversation_id),
+            "message_count": message_count,
+            "messages": messages,
+            "next_cursor": next_cursor,
+        }
+    
+    def list_conversations(self, email: str, before: str = None, limit: int = None) -> dict:
+        """Conversation summaries (no messages), most recently updated first"""
+        limit = _page_size(limit)
+        summaries = self.store.list_conversations(email.lower(), before=before, limit=limit)
+        return {
+            "success": True,
+            "conversations": summaries,
+            "next_cursor": _summary_cursor(summaries[-1]) if len(summaries) == limit else None,
+        }
+    
+    def delete_conversation(self, email: str, conversation_id: str) -> bool:
+        """Delete a conversation and its messages"""
+        return self.store.delete_conversation(email.lower(), str(conversation_id))
+    
+    # Async variants run the blocking storage calls on a worker thread so they
+    # do not stall the event loop
+    
+    async def acreate_user(self, email: str, password: str, username: str, gender: str = "not-specified") -> dict:
+        return await asyncio.to_thread(self.create_user, email, password, username, gender)
+    
+    async def aauthenticate_user(self, email: str, password: str) -> dict:
+        return await asyncio.to_thread(self.authenticate_user, email, password)
+    
+    async def auser_exists(self, email: str) -> bool:
+        return await asyncio.to_thread(self.user_exists, email)
+    
+    async def aappend_message(self, email: str, conversation_id: str, role: str, content: str, title: str = None, meta: dict = None) -> dict:
+        return await asyncio.to_thread(self.append_message, email, conversation_id, role, content, title, meta)
+    
+    async def areplace_messages(self, email: str, conversation_id: str, messages: list, title: str = None) -> dict:
+        return await asyncio.to_thread(self.replace_messages, email, conversation_id, messages, title)
+    
+    async def aget_conversation_page(self, email: str, conversation_id: str, before: int = None, after: int = None, limit: int = None) -> dict:
+        return await asyncio.to_thread(self.get_conversation_page, email, conversation_id, before, after, limit)
+    
+    async def alist_conversations(self, email: str, before: str = None, limit: int = None) -> dict:
+        return await asyncio.to_thread(self.list_conversations, email, before, limit)
+    
+    async def adelete_conversation(self, email: str, conversation_id: str) -> bool:
+        return await asyncio.to_thread(self.delete_conversation, email, conversation_id)
+    
+    def close(self):
+        self._stop.set()
+        self.flush()
+        self.store.close()
 
 # Global database instance
 db = Database()
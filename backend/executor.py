@@ -0,0 +1,132 @@
+"""Bounded thread pools that keep blocking work off the asyncio event loop.
+
+Model generation and web search are synchronous, so calling them from an
+`async def` endpoint freezes every other request on the worker. They run on
+these pools instead and are awaited as futures. Each pool caps both its
+worker threads and the number of queued jobs; once full, `submit` raises
+`ExecutorBusy` so the API can answer 503 instead of piling up work.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+# With MODEL_CONTINUOUS_BATCHING, set INFERENCE_WORKERS to MODEL_MAX_BATCH_SIZE
+# so enough requests are waiting on the engine to fill a batch.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "32"))
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "8"))
+SEARCH_MAX_PENDING = int(os.getenv("SEARCH_MAX_PENDING", "64"))
+
+# how often a running generation checks whether its HTTP client went away
+DISCONNECT_POLL_INTERVAL = 0.25
+
+_DONE = object()
+
+
+class ExecutorBusy(Exception):
+    """Raised when a pool already has its maximum of running + queued jobs."""
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor with a hard cap on outstanding jobs and awaitable results."""
+
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max(1, max_workers) + max(0, max_pending))
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusy(f"{self.name} executor is at capacity")
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run `fn` on the pool and await its result."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    async def iterate(self, iterator: Iterator, stop_event: Optional[threading.Event] = None) -> AsyncIterator:
+        """Drive a blocking iterator on one pool worker and yield its items.
+
+        The worker slot is held for the whole iteration, so streamed
+        generations count against the same bound as regular ones. If the
+        consumer stops early, `stop_event` is set and the iterator is closed
+        on the worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        stop_event = stop_event or threading.Event()
+
+        def _emit(item, error=None):
+            try:
+                loop.call_soon_threadsafe(items.put_nowait, (item, error))
+            except RuntimeError:  # event loop already closed
+                pass
+
+        def _drain():
+            error = None
+            try:
+                for item in iterator:
+                    _emit(item)
+                    if stop_event.is_set():
+                        break
+            except BaseException as e:
+                error = e
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+                _emit(_DONE, error)
+
+        self.submit(_drain)
+        try:
+            while True:
+                item, error = await items.get()
+                if item is _DONE:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            stop_event.set()
+
+    def shutdown(self, wait: bool = False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+inference_executor = BoundedExecutor("sofai-infer", INFERENCE_WORKERS, INFERENCE_MAX_PENDING)
+search_executor = BoundedExecutor("sofai-search", SEARCH_WORKERS, SEARCH_MAX_PENDING)
+
+
+async def watch_disconnect(request, stop_event: threading.Event, interval: float = DISCONNECT_POLL_INTERVAL):
+    """Set `stop_event` as soon as the HTTP client of `request` disconnects."""
+    while not stop_event.is_set():
+        if await request.is_disconnected():
+            stop_event.set()
+            return
+        await asyncio.sleep(interval)
+
+
+async def run_generation(request, fn: Callable, *args, **kwargs) -> Any:
+    """Run a generation callable on the inference pool, aborting it on client disconnect.
+
+    `fn` must accept a `stop_event` keyword (as `ModelWrapper.generate_response`
+    does); it is set when the client goes away or the awaiting task is cancelled.
+    """
+    stop_event = threading.Event()
+    watcher = asyncio.create_task(watch_disconnect(request, stop_event))
+    try:
+        return await inference_executor.run(fn, *args, stop_event=stop_event, **kwargs)
+    except asyncio.CancelledError:
+        stop_event.set()
+        raise
+    finally:
+        watcher.cancel()
@@ -0,0 +1,45 @@
+"""Tiny randomly initialised models for tests that need a real forward pass.
+
+Nothing is downloaded: the tokenizer is built in memory and the model is a
+two-layer Llama with random weights, small enough to run in milliseconds.
+"""
+
+import torch
+import transformers
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+
+WORDS = ["<pad>", "</s>", "<unk>"] + [f"w{i}" for i in range(97)]
+
+
+def tiny_tokenizer():
+    """Whitespace word-level tokenizer over "w0" ... "w96"; decodes back to space-separated words."""
+    tok = Tokenizer(models.WordLevel({w: i for i, w in enumerate(WORDS)}, unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tok.decoder = decoders.WordPiece(prefix="##")
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tok, eos_token="</s>", pad_token="<pad>", unk_token="<unk>")
+
+
+def tiny_model(seed: int = 0, num_hidden_layers: int = 2):
+    torch.manual_seed(seed)
+    config = transformers.LlamaConfig(
+        vocab_size=len(WORDS),
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        eos_token_id=1,
+        pad_token_id=0,
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+def tiny_wrapper(seed: int = 0):
+    """A `ModelWrapper` around the tiny model and tokenizer."""
+    from model_loader import ModelWrapper
+
+    return ModelWrapper(tiny_tokenizer(), tiny_model(seed), device="cpu", model_name="tiny-llama")
+
+
+def prompt(n: int, start: int = 0) -> str:
+    return " ".join(f"w{(start + i) % 97}" for i in range(n))
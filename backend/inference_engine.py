@@ -0,0 +1,264 @@
+"""Continuous (iteration-level) batching for ModelWrapper.
+
+Requests are queued by `InferenceEngine.submit` and picked up by a single
+scheduler thread. Between two decode steps the scheduler admits waiting
+sequences (each is prefilled on its own) and retires finished ones, so a new
+request never waits for the whole running batch to complete. Every decode
+step runs one forward pass over all running sequences.
+
+The running sequences share one batched KV cache, left-padded to a common
+length with the padding masked out by the attention mask. It is only
+rebuilt when sequences join or leave the batch; a decode step just appends
+one position to it, like `generate` does for a single sequence.
+"""
+
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Set
+
+try:
+    import torch
+except Exception:  # pragma: no cover - allow import-time availability to be optional
+    torch = None
+
+try:
+    from .kv_cache import to_legacy, from_legacy, cache_len
+except Exception:
+    from kv_cache import to_legacy, from_legacy, cache_len
+
+
+@dataclass
+class SamplingParams:
+    """Per-request sampling settings (same meaning as in `generate_response`)."""
+    max_new_tokens: int = 80
+    do_sample: bool = True
+    temperature: float = 0.3
+    top_p: float = 0.7
+
+
+@dataclass
+class _Sequence:
+    prompt_ids: List[int]
+    params: SamplingParams
+    stop_event: Optional[threading.Event] = None
+    session_id: Optional[str] = None
+    # called with the output ids after each token; True ends the sequence (stop sequences)
+    stop_check: Optional[Callable[[List[int]], bool]] = None
+    output_ids: List[int] = field(default_factory=list)
+    # legacy tuple of (key, value) per layer, batch size 1; only set between prefill and joining the batch
+    cache: Any = None
+    length: int = 0  # positions held in the KV cache for this sequence
+    # token ids are pushed here as they are sampled; None marks the end
+    queue: "queue.Queue[Optional[List[int]]]" = field(default_factory=queue.Queue)
+    done: threading.Event = field(default_factory=threading.Event)
+    error: Optional[BaseException] = None
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.error = error
+        self.cache = None
+        self.queue.put(None)
+        self.done.set()
+
+
+def sample_next_token(logits, params: SamplingParams) -> int:
+    """Pick the next token from a 1-D logits vector using temperature + top-p."""
+    if not params.do_sample or params.temperature <= 0:
+        return int(torch.argmax(logits).item())
+    probs = torch.softmax(logits.float() / params.temperature, dim=-1)
+    if 0 < params.top_p < 1:
+        sorted_probs, sorted_idx = torch.sort(probs, descending=True)
+        cumulative = torch.cumsum(sorted_probs, dim=-1)
+        # keep the smallest set whose mass reaches top_p (always keeps the top token)
+        sorted_probs[cumulative - sorted_probs > params.top_p] = 0
+        choice = torch.multinomial(sorted_probs / sorted_probs.sum(), 1)
+        return int(sorted_idx[choice].item())
+    return int(torch.multinomial(probs, 1).item())
+
+
+class InferenceEngine:
+    """Iteration-level batching scheduler around one loaded model."""
+
+    def __init__(self, wrapper, max_batch_size: int = 8):
+        self.wrapper = wrapper
+        self.model = wrapper.model
+        self.tokenizer = wrapper.tokenizer
+        self.device = wrapper.device
+        self.max_batch_size = max(1, max_batch_size)
+        self.eos_token_ids = self._eos_token_ids()
+        self._waiting: "queue.Queue[_Sequence]" = queue.Queue()
+        self._running: List[_Sequence] = []
+        # prefilled sequences waiting to join the batched cache before the next decode step
+        self._joining: List[_Sequence] = []
+        # batched cache of the running sequences (transformers cache object) and its (batch, length) attention mask
+        self._past = None
+        self._mask = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _eos_token_ids(self) -> Set[int]:
+        ids: Set[int] = set()
+        config_eos = getattr(getattr(self.model, "generation_config", None), "eos_token_id", None)
+        for value in (config_eos, self.tokenizer.eos_token_id):
+            if isinstance(value, int):
+                ids.add(value)
+            elif value:
+                ids.update(value)
+        return ids
+
+    def submit(self, prompt_ids: List[int], params: SamplingParams, stop_event: Optional[threading.Event] = None, session_id: Optional[str] = None, stop_check: Optional[Callable[[List[int]], bool]] = None) -> _Sequence:
+        """Queue a prompt for generation; tokens arrive on the returned sequence's `queue`."""
+        seq = _Sequence(prompt_ids=list(prompt_ids), params=params, stop_event=stop_event, session_id=session_id, stop_check=stop_check)
+        self._waiting.put(seq)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="sofai-batcher", daemon=True)
+                self._thread.start()
+        return seq
+
+    def generate(self, prompt_ids: List[int], params: SamplingParams, stop_event: Optional[threading.Event] = None) -> List[int]:
+        """Blocking helper: submit and wait for the generated token ids."""
+        seq = self.submit(prompt_ids, params, stop_event)
+        seq.done.wait()
+        if seq.error is not None:
+            raise seq.error
+        return seq.output_ids
+
+    # ---- scheduler ----
+
+    def shutdown(self):
+        """Stop the scheduler thread once the running batch is done (None is the stop marker)."""
+        self._waiting.put(None)
+
+    def _loop(self):
+        while True:
+            if not self._running and not self._joining:
+                # idle: block until work arrives
+                seq = self._waiting.get()
+                if seq is None:
+                    return
+                self._admit(seq)
+            while len(self._running) + len(self._joining) < self.max_batch_size:
+                try:
+                    seq = self._waiting.get_nowait()
+                except queue.Empty:
+                    break
+                if seq is None:
+                    self._waiting.put(None)  # stop after the running batch
+                    break
+                self._admit(seq)
+            if self._running or self._joining:
+                try:
+                    self._join()
+                    self._decode_step()
+                except Exception as e:
+                    for seq in self._running + self._joining:
+                        seq.finish(e)
+                    self._running, self._joining = [], []
+                    self._past = self._mask = None
+
+    def _admit(self, seq: _Sequence):
+        if seq.stop_event is not None and seq.stop_event.is_set():
+            seq.finish()
+            return
+        try:
+            # only the part of the prompt not covered by a cached prefix is prefilled
+            cached, past = self.wrapper.cached_prefix(seq.prompt_ids, seq.session_id)
+            with torch.inference_mode():
+                input_ids = torch.tensor([seq.prompt_ids[cached:]], device=self.device)
+                out = self.model(input_ids=input_ids, past_key_values=from_legacy(past), use_cache=True)
+            seq.cache = to_legacy(out.past_key_values)
+            seq.length = cache_len(seq.cache)
+            self._append_token(seq, sample_next_token(out.logits[0, -1], seq.params), lambda: seq.cache)
+        except Exception as e:
+            seq.finish(e)
+            return
+        if not seq.done.is_set():
+            self._joining.append(seq)
+
+    def _append_token(self, seq: _Sequence, token_id: int, cache_fn: Callable[[], Any]):
+        """Record a sampled token; `cache_fn` returns the sequence's own cache if it finishes."""
+        is_eos = token_id in self.eos_token_ids
+        if not is_eos:
+            seq.output_ids.append(token_id)
+            seq.queue.put([token_id])
+        stopped = seq.stop_event is not None and seq.stop_event.is_set()
+        if not stopped and not is_eos and seq.stop_check is not None:
+            stopped = seq.stop_check(seq.output_ids)
+        if is_eos or stopped or len(seq.output_ids) >= seq.params.max_new_tokens:
+            if seq.session_id:
+                self.wrapper.session_cache.store(seq.session_id, seq.prompt_ids + seq.output_ids, cache_fn())
+            seq.finish()
+
+    def _join(self):
+        """Add the freshly prefilled sequences to the batched cache (one rebuild for all of them)."""
+        if not self._joining:
+            return
+        joining, self._joining = self._joining, []
+        caches = [to_legacy(self._past)] if self._past is not None else []
+        masks = [self._mask] if self._mask is not None else []
+        for seq in joining:
+            caches.append(seq.cache)
+            masks.append(torch.ones((1, seq.length), dtype=torch.long, device=self.device))
+            seq.cache = None
+        max_len = max(mask.shape[1] for mask in masks)
+
+        def _left_pad(t, pad):
+            return torch.nn.functional.pad(t, (0, 0, pad, 0)) if pad else t
+
+        pads = [max_len - mask.shape[1] for mask in masks]
+        self._past = from_legacy(tuple(
+            (
+                torch.cat([_left_pad(cache[layer][0], pad) for cache, pad in zip(caches, pads)], dim=0),
+                torch.cat([_left_pad(cache[layer][1], pad) for cache, pad in zip(caches, pads)], dim=0),
+            )
+            for layer in range(len(caches[0]))
+        ))
+        self._mask = torch.cat([torch.nn.functional.pad(mask, (pad, 0)) for mask, pad in zip(masks, pads)], dim=0)
+        self._running.extend(joining)
+
+    def _row_cache(self, i: int, seq: _Sequence):
+        """Sequence `i`'s slice of the batched cache, without its left padding (views)."""
+        start = self._mask.shape[1] - seq.length
+        return tuple((k[i:i + 1, :, start:], v[i:i + 1, :, start:]) for k, v in to_legacy(self._past))
+
+    def _evict(self, keep: List[int]):
+        """Drop finished rows from the batched cache and any padding no remaining row needs."""
+        if not keep:
+            self._past = self._mask = None
+            return
+        index = torch.tensor(keep, device=self.device)
+        mask = self._mask.index_select(0, index)
+        start = mask.shape[1] - max(self._running[i].length for i in keep)
+        self._mask = mask[:, start:]
+        self._past = from_legacy(tuple(
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in to_legacy(self._past)
+        ))
+
+    def _decode_step(self):
+        batch = self._running
+        # the newest sampled token is the only one not in the cache yet
+        input_ids = torch.tensor([[seq.output_ids[-1]] for seq in batch], device=self.device)
+        position_ids = torch.tensor([[seq.length] for seq in batch], device=self.device)
+        mask = torch.nn.functional.pad(self._mask, (0, 1), value=1)
+
+        with torch.inference_mode():
+            out = self.model(
+                input_ids=input_ids,
+                attention_mask=mask,
+                position_ids=position_ids,
+                past_key_values=self._past,
+                use_cache=True,
+            )
+        self._past, self._mask = out.past_key_values, mask
+
+        keep = []
+        for i, seq in enumerate(batch):
+            seq.length += 1
+            self._append_token(seq, sample_next_token(out.logits[i, -1], seq.params), lambda i=i, seq=seq: self._row_cache(i, seq))
+            if not seq.done.is_set():
+                keep.append(i)
+        if len(keep) < len(batch):
+            self._evict(keep)
+            self._running = [batch[i] for i in keep]
@@ -0,0 +1,209 @@
+"""Reusable past-key-values (KV caches) for ModelWrapper.
+
+Caches are kept in the legacy layout, a tuple of `(key, value)` tensors per
+layer shaped `(batch, heads, seq_len, head_dim)`, because that layout can
+be sliced, padded and saved with plain torch ops. `from_legacy` wraps one
+back into whatever cache object the installed transformers expects.
+
+Reusing a cache never mutates it: `DynamicCache.update` concatenates into
+new tensors, so a stored prefix can be handed to any number of requests.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    import torch
+except Exception:  # pragma: no cover - allow import-time availability to be optional
+    torch = None
+
+try:
+    from transformers import DynamicCache
+except Exception:  # pragma: no cover - older transformers only know tuple caches
+    DynamicCache = None
+
+# prefixes shorter than this are not worth a cache lookup
+PREFIX_CACHE_MIN_TOKENS = int(os.getenv("PREFIX_CACHE_MIN_TOKENS", "8"))
+# directory for persisted prefix caches; unset keeps them in memory only
+PREFIX_CACHE_DIR = os.getenv("PREFIX_CACHE_DIR") or None
+# memory budget for per-session conversation caches, per loaded model
+SESSION_KV_CACHE_MB = int(os.getenv("SESSION_KV_CACHE_MB", "512"))
+
+
+def to_legacy(cache):
+    """Convert a transformers cache object to the tuple-of-tuples layout."""
+    if cache is None:
+        return cache
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    if hasattr(cache, "layers"):  # transformers >= 5 dropped to_legacy_cache
+        return tuple((layer.keys, layer.values) for layer in cache.layers)
+    return cache
+
+
+def from_legacy(cache):
+    """Wrap a tuple-of-tuples cache for the installed transformers version."""
+    if cache is None or DynamicCache is None:
+        return cache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(cache)
+    return DynamicCache(cache)
+
+
+def cache_len(cache) -> int:
+    """Number of positions held by a legacy cache."""
+    return cache[0][0].shape[-2]
+
+
+def crop(cache, length: int):
+    """Keep only the first `length` positions of a legacy cache (views, no copy)."""
+    return tuple((k[:, :, :length], v[:, :, :length]) for k, v in cache)
+
+
+def cache_nbytes(cache) -> int:
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in cache)
+
+
+def common_prefix_len(a: Sequence[int], b: Sequence[int]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixCache:
+    """Past-key-values for known static prompt prefixes (system prompts) of one model.
+
+    `register` prefills a prefix once; `lookup` returns the longest
+    registered prefix shared with a tokenized prompt, so only the rest of
+    the prompt has to be prefilled.
+    """
+
+    def __init__(self, model_name: str, persist_dir: Optional[str] = PREFIX_CACHE_DIR):
+        self.model_name = model_name
+        self.persist_dir = Path(persist_dir) if persist_dir else None
+        self._entries: Dict[str, Tuple[List[int], tuple]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, text: str) -> Optional[Path]:
+        if self.persist_dir is None:
+            return None
+        digest = hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()[:32]
+        return self.persist_dir / f"prefix-{digest}.pt"
+
+    def register(self, wrapper, prefix: Union[str, List[int]]) -> int:
+        """Precompute (or load from disk) the cache for `prefix` (text or token ids); returns its token count."""
+        if isinstance(prefix, str):
+            text, ids = prefix, wrapper.tokenizer(prefix)["input_ids"]
+        else:
+            ids = list(prefix)
+            text = "ids:" + ",".join(map(str, ids))
+        path = self._path(text)
+        cache = None
+        if path is not None and path.exists():
+            try:
+                saved = torch.load(path, map_location=wrapper.device)
+                if saved.get("ids") == ids:
+                    cache = saved["cache"]
+            except Exception as e:
+                print(f"Ignoring unreadable prefix cache {path}: {e}")
+        if cache is None:
+            with torch.inference_mode():
+                out = wrapper.model(input_ids=torch.tensor([ids], device=wrapper.device), use_cache=True)
+            cache = to_legacy(out.past_key_values)
+            if path is not None:
+                try:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    torch.save({"ids": ids, "cache": cache}, path)
+                except Exception as e:
+                    print(f"Could not persist prefix cache {path}: {e}")
+        with self._lock:
+            self._entries[text] = (ids, cache)
+        return len(ids)
+
+    def lookup(self, input_ids: Sequence[int]) -> Tuple[int, Optional[tuple]]:
+        """Return `(n, cache)` for the longest registered prefix of `input_ids`.
+
+        At least one prompt token is always left uncached because the model
+        needs it to produce the next-token logits. Returns `(0, None)` on a miss.
+        """
+        best_len, best_cache = 0, None
+        with self._lock:
+            entries = list(self._entries.values())
+        for ids, cache in entries:
+            n = min(common_prefix_len(ids, input_ids), len(input_ids) - 1)
+            if n > best_len:
+                best_len, best_cache = n, cache
+        if best_len < PREFIX_CACHE_MIN_TOKENS:
+            return 0, None
+        return best_len, crop(best_cache, best_len)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SessionKVCache:
+    """Past-key-values of each chat session's previous turn, evicted LRU under a byte budget.
+
+    After a turn, the cache covering the prompt and the generated reply is
+    stored under the session id. The next turn's prompt normally starts
+    with exactly those tokens, so only the new user message is prefilled.
+    Because a cache depends only on the token ids, a stale or mismatching
+    entry costs nothing but a shorter reuse.
+    """
+
+    def __init__(self, budget_bytes: int = SESSION_KV_CACHE_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, Tuple[List[int], tuple, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.used_bytes = 0
+
+    def store(self, session_id: str, token_ids: Sequence[int], cache) -> None:
+        """Keep `cache` for `session_id`; `token_ids` are the tokens it was built from."""
+        if not session_id or cache is None:
+            return
+        length = cache_len(cache)
+        # own the memory: the tensors may be views into a larger batched cache
+        cache = tuple((k.clone(), v.clone()) for k, v in cache)
+        nbytes = cache_nbytes(cache)
+        if nbytes > self.budget_bytes:
+            self.drop(session_id)
+            return
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self.used_bytes -= old[2]
+            self._entries[session_id] = (list(token_ids[:length]), cache, nbytes)
+            self.used_bytes += nbytes
+            while self.used_bytes > self.budget_bytes and self._entries:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.used_bytes -= evicted
+
+    def lookup(self, session_id: str, input_ids: Sequence[int]) -> Tuple[int, Optional[tuple]]:
+        """Return `(n, cache)` reusable for `input_ids`, or `(0, None)`."""
+        if not session_id:
+            return 0, None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return 0, None
+            self._entries.move_to_end(session_id)
+        ids, cache, _ = entry
+        n = min(common_prefix_len(ids, input_ids), len(input_ids) - 1)
+        if n < PREFIX_CACHE_MIN_TOKENS:
+            return 0, None
+        return n, crop(cache, n)
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self.used_bytes -= entry[2]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,18 +1,34 @@
 from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import json
 import os
+import threading
 from fastapi.middleware.cors import CORSMiddleware
 # Import lightweight helpers (these don't import heavy HF deps)
 try:
-    from .utils import verify_api_key
-    from .storage import ChatStore
-    from .database import db
-    from .web_search import perform_search, needs_search, format_search_context, build_search_prompt
+    from .utils import verify_api_key, issue_session_token, require_session
+    from .storage import ChatStore, CHAT_STORE_BACKEND, CHAT_STORE_PAGE_SIZE
+    from .web_search import perform_search_async, close_search_service, needs_search, format_search_context, build_search_prompt, search_cache_stats
+    from .executor import ExecutorBusy, inference_executor, run_generation
+    from .cache import response_cache
+    from .semantic_cache import semantic_cache, SEMANTIC_CACHE_SEARCH_TTL
+    from .cascade import run_cascade
+    from .speculative import speculation_stats
+    from .prompts import assemble_prompt, prompt_budget, prompt_builders, reply_budget
+    from .model_manager import ModelManager, ModelLoading, ModelNotFound, ModelUnavailable, ModelSpec, hf_model_spec, MODEL_PRELOAD, MODEL_REGISTRY
 except Exception:
-    from utils import verify_api_key
-    from storage import ChatStore
-    from database import db
-    from web_search import perform_search, needs_search, format_search_context, build_search_prompt
+    from utils import verify_api_key, issue_session_token, require_session
+    from storage import ChatStore, CHAT_STORE_BACKEND, CHAT_STORE_PAGE_SIZE
+    from web_search import perform_search_async, close_search_service, needs_search, format_search_context, build_search_prompt, search_cache_stats
+    from executor import ExecutorBusy, inference_executor, run_generation
+    from cache import response_cache
+    from semantic_cache import semantic_cache, SEMANTIC_CACHE_SEARCH_TTL
+    from cascade import run_cascade
+    from speculative import speculation_stats
+    from prompts import assemble_prompt, prompt_budget, prompt_builders, reply_budget
+    from model_manager import ModelManager, ModelLoading, ModelNotFound, ModelUnavailable, ModelSpec, hf_model_spec, MODEL_PRELOAD, MODEL_REGISTRY
 
 
     # Dry-run dummy model used when full HF dependencies are not installed or for quick testing.
@@ -23,6 +39,11 @@ class _DummyModel:
     def generate_response(self, prompt: str, max_new_tokens: int = 256, **kwargs):
         return f"[dry-run reply] I received: {prompt[:200]}"
 
+    def stream_response(self, prompt: str, max_new_tokens: int = 256, **kwargs):
+        words = self.generate_response(prompt, max_new_tokens=max_new_tokens, **kwargs).split(" ")
+        for i, word in enumerate(words):
+            yield word if i == 0 else " " + word
+
 app = FastAPI(title="SofAI Backend")
 
 # Enable CORS for local development. Lock this down in production.
@@ -34,17 +55,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(ModelLoading)
+async def model_loading_handler(request: Request, exc: ModelLoading):
+    # the model is loading in the background; fail fast instead of holding the request
+    return JSONResponse(status_code=503, content={"detail": str(exc), "model": exc.name}, headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(ModelUnavailable)
+async def model_unavailable_handler(request: Request, exc: ModelUnavailable):
+    # the last load failed; it is only retried once the backoff has passed
+    return JSONResponse(status_code=503, content={"detail": str(exc), "model": exc.name}, headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(ExecutorBusy)
+async def executor_busy_handler(request: Request, exc: ExecutorBusy):
+    # the bounded inference/search pools are full; ask the client to retry shortly
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "2"})
+
+
 MODEL_NAME = os.getenv("MODEL_NAME", "mistral-7b-instruct")
 MODEL_TRUST_REMOTE = os.getenv("MODEL_TRUST_REMOTE", "false").lower() in ("1", "true", "yes")
 MODEL_LOAD_8BIT = os.getenv("MODEL_LOAD_8BIT", "false").lower() in ("1", "true", "yes")
+# CPU-only weight quantization: "int8" (dynamic) or "int4" (weight-only, needs torchao)
+MODEL_CPU_QUANTIZE = os.getenv("MODEL_CPU_QUANTIZE") or None
+# per-model inference backend, e.g. "qwen=onnx,tinyllama=torch"; others use MODEL_BACKEND (default torch)
+MODEL_BACKENDS = dict(entry.split("=", 1) for entry in os.getenv("MODEL_BACKENDS", "").split(",") if "=" in entry)
 MODEL_REVISION = os.getenv("MODEL_REVISION") or None
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Literal, Optional, Tuple
 
 class ChatRequest(BaseModel):
     message: str
     max_tokens: int = 2048  # increased for longer, complete ChatGPT-like responses
     model: str = "qwen"
     history: Optional[List[Dict[str, str]]] = None
+    stream: bool = False  # reply as Server-Sent Events instead of one JSON body
+    cache: Optional[bool] = None  # force (True) or skip (False) the response cache; None = default policy
+    speculative: Optional[Literal["draft", "lookup", "off"]] = None  # assisted decoding; None = SPECULATIVE_MODE
 
 
 class ChatResponse(BaseModel):
@@ -71,6 +117,28 @@ class AuthResponse(BaseModel):
     message: str = None
     error: str = None
     user: dict = None
+    token: str = None  # signed session token; send as `Authorization: Bearer <token>`
+    expires_at: int = None  # unix time the token expires
+
+
+class ConversationMessage(BaseModel):
+    role: str
+    content: str
+    meta: Optional[Dict[str, Any]] = None  # e.g. model_used, sources
+
+
+class AppendMessageRequest(ConversationMessage):
+    title: Optional[str] = None  # set or rename the conversation
+
+
+class ReplaceMessagesRequest(BaseModel):
+    messages: List[ConversationMessage]
+    title: Optional[str] = None
+
+
+PREDICT_SYSTEM_PROMPT = """You are a helpful AI assistant like ChatGPT. Provide detailed, accurate, and comprehensive responses. Structure your answers with clear sections, bullet points, numbered lists, and explanations when appropriate. Use engaging language, and offer follow-up suggestions or additional help when relevant."""
+
+CHAT_SYSTEM_PROMPT = """You are a helpful AI assistant with real-time web access. Provide detailed, accurate, and comprehensive responses using the web information provided. Structure your answers with clear sections, bullet points, numbered lists, and explanations when appropriate. Always cite sources when using web information."""
 
 
 def _is_identity_question(text: str) -> bool:
@@ -100,31 +168,128 @@ def _is_identity_question(text: str) -> bool:
     return False
 
 
-# Initialize models dictionary
-models = {}
+def _build_prompt(model_name: str, model, system_prompt: str, turns: List[Tuple[str, str]], max_new_tokens: int, search_results=(), context_title: str = "Web Search Results"):
+    """Build the prompt for `model` in its own format (chat template), fitted to its
+    prefill budget; returns the assembled prompt and the model's stop sequences (see prompts.py)."""
+    builder = prompt_builders.get(model_name, model)
+    assembled = assemble_prompt(builder, system_prompt, turns, prompt_budget(model, max_new_tokens), search_results, format_search_context, context_title)
+    return assembled, builder.stop_sequences
+
+
+def _system_prefix(model_name: str, system_prompt: str):
+    """Prefix-cache entry: the token ids every prompt with `system_prompt` starts with."""
+    return lambda model: prompt_builders.get(model_name, model).system_ids(system_prompt)
+
+
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Encode one Server-Sent Events frame."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_reply(chunks, final: dict, session_id: Optional[str] = None, stop_event: Optional[threading.Event] = None, on_complete=None, request: Optional[Request] = None) -> StreamingResponse:
+    """Stream reply chunks as `data: {"token": ...}` events followed by a `done` event.
+
+    The `done` event carries the full reply plus the `final` metadata
+    (sources, model_used, used_search). `chunks` is a blocking iterator; it
+    is driven on the inference executor, and `stop_event` is set when the
+    client disconnects so generation stops with it. `on_complete` is
+    called (on a worker thread) with the full reply once the stream has
+    finished normally and the client of `request` is still connected.
+    """
+    async def _events():
+        reply = []
+        try:
+            async for chunk in inference_executor.iterate(chunks, stop_event):
+                reply.append(chunk)
+                yield _sse_event({"token": chunk})
+        except Exception as e:
+            yield _sse_event({"error": str(e)}, event="error")
+            return
+        text = "".join(reply)
+        if session_id is not None:
+            await ChatStore.aadd_message(session_id, {"role": "bot", "text": text})
+        if on_complete is not None and text and not await _aborted(request):
+            await asyncio.to_thread(on_complete, text)
+        yield _sse_event({"reply": text, **final}, event="done")
+
+    return StreamingResponse(_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def _aborted(request: Optional[Request]) -> bool:
+    """True if the client went away; generation stops with it, so its reply may be cut short."""
+    return request is not None and await request.is_disconnected()
+
+
+# Servable models, loaded on first use (or at startup via MODEL_PRELOAD)
+models = ModelManager()
+
+
+def _register_models(dry_run: bool = False):
+    """Register the built-in models plus any extra ones from MODEL_REGISTRY."""
+    builtin = [
+        ("qwen", "Qwen/Qwen2.5-0.5B-Instruct", ()),
+        ("TinyLlama/TinyLlama-1.1B-Chat-v1.0", "TinyLlama/TinyLlama-1.1B-Chat-v1.0", ("tinyllama",)),
+    ]
+    builtin += [(name, model_id, ()) for name, model_id in MODEL_REGISTRY.items()]
+    for name, model_id, aliases in builtin:
+        # system prompts whose KV caches are precomputed when the model loads
+        prefixes = (_system_prefix(name, PREDICT_SYSTEM_PROMPT), _system_prefix(name, CHAT_SYSTEM_PROMPT))
+        if dry_run:
+            models.register(ModelSpec(name=name, load=_DummyModel, aliases=aliases))
+        else:
+            backend = next((MODEL_BACKENDS[key] for key in (name, *aliases) if key in MODEL_BACKENDS), None)
+            models.register(hf_model_spec(name, model_id, aliases=aliases, prefixes=prefixes, trust_remote_code=MODEL_TRUST_REMOTE, load_in_8bit=MODEL_LOAD_8BIT, revision=MODEL_REVISION, cpu_quantize=MODEL_CPU_QUANTIZE, backend=backend))
+
+
+def _get_db():
+    """The user database, imported on first use so startup does not open it."""
+    try:
+        from .database import db
+    except Exception:
+        from database import db
+    return db
+
+
+async def _get_model(name: str, wait: bool = False):
+    """Resolve a model for a request; unknown names fall back to qwen.
+
+    A model that is not resident yet starts loading in the background and
+    the request gets a 503 with Retry-After (`ModelLoading`) unless `wait`.
+    After a failed load, requests get a 503 with Retry-After
+    (`ModelUnavailable`) until its backoff has passed.
+    """
+    try:
+        return await models.aget(name, default="qwen", wait=wait)
+    except (ModelLoading, ModelUnavailable):
+        raise
+    except ModelNotFound:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+    except Exception as e:
+        print(f"Error loading model {name}: {e}")
+        raise HTTPException(status_code=503, detail="Model not loaded")
 
 
 @app.on_event("startup")
 async def startup_event():
-    global models
     # If SKIP_MODEL_LOAD is set, use the lightweight dummy model for quick local testing
     skip = os.getenv("SKIP_MODEL_LOAD", "0").lower() in ("1", "true", "yes")
-    if skip:
-        models["qwen"] = _DummyModel()
-        models["TinyLlama/TinyLlama-1.1B-Chat-v1.0"] = _DummyModel()
-        models["tinyllama"] = _DummyModel()
-        return
+    _register_models(dry_run=skip)
+    # load in parallel on background threads so the server (health, auth) is up at once;
+    # /ready reports when each model can take requests
+    for name in MODEL_PRELOAD:
+        try:
+            models.load_in_background(name)
+        except ModelNotFound:
+            print(f"MODEL_PRELOAD names an unknown model: {name}")
 
-    # Import the model loader lazily to avoid importing heavy HF libraries at module import time
-    try:
-        from .model_loader import ModelWrapper
-    except Exception:
-        from model_loader import ModelWrapper
 
-    # Load models
-    models["qwen"] = ModelWrapper.load_cached("Qwen/Qwen2.5-0.5B-Instruct", trust_remote_code=MODEL_TRUST_REMOTE, load_in_8bit=MODEL_LOAD_8BIT, revision=MODEL_REVISION)
-    models["TinyLlama/TinyLlama-1.1B-Chat-v1.0"] = ModelWrapper.load_cached("TinyLlama/TinyLlama-1.1B-Chat-v1.0", trust_remote_code=MODEL_TRUST_REMOTE, load_in_8bit=MODEL_LOAD_8BIT, revision=MODEL_REVISION)
-    models["tinyllama"] = models["TinyLlama/TinyLlama-1.1B-Chat-v1.0"]  # alias
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_search_service()
+    # write buffered last_login updates and chat history
+    await asyncio.to_thread(_get_db().flush)
+    await asyncio.to_thread(ChatStore.close)
 
 
 @app.get("/health")
@@ -132,12 +297,36 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def ready():
+    """200 once every preloaded model can serve requests, else 503 with per-model states."""
+    states = {models.resolve(name): models.state(name) for name in MODEL_PRELOAD if name in models}
+    if all(state == "ready" for state in states.values()):
+        return {"ready": True, "models": states}
+    return JSONResponse(status_code=503, content={"ready": False, "models": states}, headers={"Retry-After": "5"})
+
+
+@app.get("/ready/{name:path}")
+async def model_ready(name: str):
+    """Readiness of one model; 503 with Retry-After while it is loading or not resident."""
+    if name not in models:
+        _unknown_model(name)
+    state = models.state(name)
+    if state == "ready":
+        return {"model": models.resolve(name), "ready": True, "state": state}
+    return JSONResponse(
+        status_code=503,
+        content={"model": models.resolve(name), "ready": False, "state": state},
+        headers={"Retry-After": str(models.retry_after(name))},
+    )
+
+
 # ============= Authentication Endpoints =============
 
 @app.post("/auth/signup", response_model=AuthResponse)
 async def signup(req: SignupRequest):
     """Create a new user account"""
-    result = db.create_user(
+    result = await _get_db().acreate_user(
         email=req.email,
         password=req.password,
         username=req.username,
@@ -148,7 +337,8 @@ async def signup(req: SignupRequest):
         return AuthResponse(
             success=True,
             message=result["message"],
-            user=result["user"]
+            user=result["user"],
+            **issue_session_token(result["user"]["email"])
         )
     else:
         raise HTTPException(status_code=400, detail=result["error"])
@@ -157,22 +347,29 @@ async def signup(req: SignupRequest):
 @app.post("/auth/login", response_model=AuthResponse)
 async def login(req: LoginRequest):
     """Authenticate user and return user data"""
-    result = db.authenticate_user(email=req.email, password=req.password)
+    result = await _get_db().aauthenticate_user(email=req.email, password=req.password)
     
     if result["success"]:
         return AuthResponse(
             success=True,
             message=result["message"],
-            user=result["user"]
+            user=result["user"],
+            **issue_session_token(result["user"]["email"])
         )
     else:
         raise HTTPException(status_code=401, detail=result["error"])
 
 
+@app.get("/auth/session")
+async def session(email: str = Depends(require_session)):
+    """Who the session token belongs to; checked from the token's signature alone"""
+    return {"email": email}
+
+
 @app.post("/auth/check-email")
 async def check_email(email: str):
     """Check if email is already registered"""
-    exists = db.user_exists(email)
+    exists = await _get_db().auser_exists(email)
     return {
         "email": email,
         "exists": exists,
@@ -180,9 +377,59 @@ async def check_email(email: str):
     }
 
 
+# ============= Conversation Endpoints =============
+# Messages are appended one at a time and read back in pages, so a save or a
+# sync only moves the new messages instead of the whole history; an edit or a
+# deleted message resends the conversation once. The user comes from the
+# session token.
+
+@app.get("/conversations")
+async def list_conversations(email: str = Depends(require_session), cursor: Optional[str] = None, limit: Optional[int] = None):
+    """Conversation summaries, most recently updated first; pass `next_cursor` as `cursor` for more"""
+    return await _get_db().alist_conversations(email, before=cursor, limit=limit)
+
+
+@app.post("/conversations/{conversation_id}/messages")
+async def append_conversation_message(conversation_id: str, req: AppendMessageRequest, email: str = Depends(require_session)):
+    """Append one message (the conversation is created by its first message)"""
+    result = await _get_db().aappend_message(email, conversation_id, req.role, req.content, title=req.title, meta=req.meta)
+    if not result["success"]:
+        status = 404 if "not found" in result["error"] else 400
+        raise HTTPException(status_code=status, detail=result["error"])
+    return result
+
+
+@app.put("/conversations/{conversation_id}/messages")
+async def replace_conversation_messages(conversation_id: str, req: ReplaceMessagesRequest, email: str = Depends(require_session)):
+    """Replace every message of a conversation after one was edited, deleted or regenerated"""
+    messages = [{"role": m.role, "content": m.content, "meta": m.meta or {}} for m in req.messages]
+    result = await _get_db().areplace_messages(email, conversation_id, messages, title=req.title)
+    if not result["success"]:
+        status = 404 if "not found" in result["error"] else 400
+        raise HTTPException(status_code=status, detail=result["error"])
+    return result
+
+
+@app.get("/conversations/{conversation_id}/messages")
+async def get_conversation_messages(conversation_id: str, email: str = Depends(require_session), before: Optional[int] = None, after: Optional[int] = None, limit: Optional[int] = None):
+    """A page of messages, oldest first: the newest page by default, older ones with
+    `before=<next_cursor>`, or only messages added since `after=<last seq>`"""
+    result = await _get_db().aget_conversation_page(email, conversation_id, before=before, after=after, limit=limit)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
+@app.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str, email: str = Depends(require_session)):
+    if not await _get_db().adelete_conversation(email, conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"success": True}
+
+
 # ============= Chat Endpoints =============
 @app.post("/chat")
-async def chat(req: ChatRequest):
+async def chat(req: ChatRequest, request: Request):
     """
     Web search enabled chat endpoint.
     
@@ -193,36 +440,68 @@ async def chat(req: ChatRequest):
     4. Generate response using model
     5. Return response with sources
     """
-    # 1. Search web
-    search_results = perform_search(req.message, num_results=5)
-
-    # 2. Build context from search results
-    context = format_search_context(search_results)
-
-    # 3. Build prompt with context
-    system_prompt = """You are a helpful AI assistant with real-time web access. Provide detailed, accurate, and comprehensive responses using the web information provided. Structure your answers with clear sections, bullet points, numbered lists, and explanations when appropriate. Always cite sources when using web information."""
-    
-    prompt = f"""System: {system_prompt}
-
-Web Context:
-{context}
-
-User Question: {req.message}
-
-Answer:"""
+    # Paraphrases of a recently answered question skip both search and generation.
+    # Like the response cache, only replies it would cache qualify: the reply below is
+    # sampled at temperature 0.7, so by default (greedy replies only) it is not stored.
+    semantic_ns = f"chat:{req.model}"
+    use_semantic = response_cache.should_use(req.cache, True, 0.7)
+    if use_semantic:
+        hit = await asyncio.to_thread(semantic_cache.lookup, semantic_ns, req.message)
+        if hit is not None:
+            if req.stream:
+                return _sse_reply(iter([hit["reply"]]), {"sources": hit["sources"], "model_used": req.model, "used_search": bool(hit["sources"])})
+            return {"response": hit["reply"], "sources": hit["sources"]}
+
+    def _remember(answer: str):
+        # blocking (embeds the question): run on a worker thread, and only for complete replies
+        if use_semantic:
+            semantic_cache.add(semantic_ns, req.message, {"reply": answer, "sources": search_results}, ttl=SEMANTIC_CACHE_SEARCH_TTL)
+
+    # 1. Search web (async, over pooled keep-alive connections)
+    search_results = await perform_search_async(req.message, num_results=5)
+
+    selected_model = await _get_model(req.model)
+
+    # 2.-3. Build the prompt in the model's format with as much search context as fits
+    assembled, stop_tokens = _build_prompt(
+        models.resolve(req.model, default="qwen"), selected_model, CHAT_SYSTEM_PROMPT,
+        [("user", req.message)], 250, search_results, context_title="Web Context",
+    )
+    max_new_tokens = reply_budget(selected_model, assembled.tokens, 250)
 
     # 4. Run model and generate response
-    selected_model = models.get(req.model, models.get("qwen"))
-    if selected_model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+
+    if req.stream:
+        stop_event = threading.Event()
+        chunks = selected_model.stream_response(
+            assembled.prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=0.7,
+            top_p=0.95,
+            do_sample=True,
+            stop_tokens=stop_tokens,
+            stop_event=stop_event,
+            use_cache=req.cache,
+            speculative=req.speculative,
+            prompt_ids=assembled.ids,
+        )
+        return _sse_reply(chunks, {"sources": search_results, "model_used": req.model, "used_search": bool(search_results)}, stop_event=stop_event, on_complete=_remember, request=request)
     
-    answer = selected_model.generate_response(
-        prompt,
-        max_new_tokens=250,
+    answer = await run_generation(
+        request,
+        selected_model.generate_response,
+        assembled.prompt,
+        max_new_tokens=max_new_tokens,
         temperature=0.7,
         top_p=0.95,
-        do_sample=True
+        do_sample=True,
+        stop_tokens=stop_tokens,
+        use_cache=req.cache,
+        speculative=req.speculative,
+        prompt_ids=assembled.ids,
     )
+    if not await _aborted(request):
+        await asyncio.to_thread(_remember, answer)
 
     # 5. Return response with sources
     return {
@@ -237,103 +516,209 @@ async def predict(req: ChatRequest, request: Request):
     This endpoint intentionally does not require API key authentication (meant for local testing).
     It returns JSON {"reply": str, "model_used": str} so simple clients can consume it.
     """
-    selected_model = models.get(req.model, models.get("qwen"))
-    if req.model == "auto":
-        selected_model = models.get("qwen")  # for now, auto uses qwen
-    if selected_model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+    # for now, auto uses qwen
+    selected_model = await _get_model("qwen" if req.model == "auto" else req.model)
 
     session_id = request.headers.get('x-session-id', 'default')
-    ChatStore.add_message(session_id, {"role": "user", "text": req.message})
+    await ChatStore.aadd_message(session_id, {"role": "user", "text": req.message})
 
     # reuse the same canned-response logic used by /chat
     # If the user asks about the assistant's identity, return the canned SofAi reply
     if _is_identity_question(req.message):
         canned = 'I am SofAi, created by the Sofdev Team'
-        ChatStore.add_message(session_id, {"role": "bot", "text": canned})
+        if req.stream:
+            return _sse_reply(iter([canned]), {"model_used": "canned", "sources": None, "used_search": False}, session_id)
+        await ChatStore.aadd_message(session_id, {"role": "bot", "text": canned})
         return {"reply": canned, "model_used": "canned", "sources": None, "used_search": False}
 
+    # Paraphrases of a recently answered question are served from the semantic cache,
+    # under the response cache's sampling rule (see /chat). Follow-ups depend on the
+    # conversation, so only questions without history qualify.
+    semantic_ns = f"predict:{req.model}"
+    use_semantic = response_cache.should_use(req.cache, True, 0.7) and not req.history
+    if use_semantic:
+        hit = await asyncio.to_thread(semantic_cache.lookup, semantic_ns, req.message)
+        if hit is not None:
+            final = {"model_used": hit["model_used"], "sources": hit["sources"], "used_search": hit["used_search"]}
+            if req.stream:
+                return _sse_reply(iter([hit["reply"]]), final, session_id)
+            await ChatStore.aadd_message(session_id, {"role": "bot", "text": hit["reply"]})
+            return {"reply": hit["reply"], **final}
+
     # Check if web search is needed
     search_results = []
     used_search = False
     
     if needs_search(req.message):
         try:
-            search_results = perform_search(req.message, num_results=5)
+            search_results = await perform_search_async(req.message, num_results=5)
             used_search = len(search_results) > 0
         except Exception as e:
             print(f"Search error: {e}")
             search_results = []
 
-    # Format prompt based on the selected model
-    system_prompt = """You are a helpful AI assistant like ChatGPT. Provide detailed, accurate, and comprehensive responses. Structure your answers with clear sections, bullet points, numbered lists, and explanations when appropriate. Use engaging language, and offer follow-up suggestions or additional help when relevant."""
-    
-    # Build conversation history
-    conversation = []
-    if req.history:
-        for msg in req.history:
-            conversation.append(f"{msg['role'].capitalize()}: {msg['content']}")
-    
-    # Add search context if available
-    if used_search and search_results:
-        search_context = format_search_context(search_results)
-        system_prompt += f"\n\nWeb Search Results:\n{search_context}"
-    
-    conversation.append(f"User: {req.message}")
-    
-    if req.model == "qwen":
-        formatted_prompt = f"System: {system_prompt}\n" + "\n".join(conversation) + "\nAssistant:"
-    elif req.model == "TinyLlama/TinyLlama-1.1B-Chat-v1.0":
-        formatted_prompt = f"<|system|>\n{system_prompt}\n" + "\n".join([f"<|{msg.split(': ')[0].lower()}|>\n{msg.split(': ', 1)[1]}" for msg in conversation]) + "\n<|assistant|>\n"
-    else:
-        formatted_prompt = f"System: {system_prompt}\n" + "\n".join(conversation) + "\nAssistant:"  # fallback
+    # Conversation turns, oldest first. Each model gets the prompt in its own format
+    # with the newest turns and best-ranked search results that fit its budget.
+    turns = [(msg['role'], msg['content']) for msg in req.history or []]
+    turns.append(("user", req.message))
+
+    def _predict_prompt(model_key: str, model):
+        return _build_prompt(model_key, model, PREDICT_SYSTEM_PROMPT, turns, req.max_tokens, search_results if used_search else ())
+
+    assembled, stop_tokens = _predict_prompt(models.resolve(req.model, default="qwen"), selected_model)
+    # the prompt budget reserves at most half the window for the reply; never generate past it
+    max_new_tokens = reply_budget(selected_model, assembled.tokens, req.max_tokens)
+
+    def _remember(reply: str, model_used: str):
+        # blocking (embeds the question): run on a worker thread, and only for complete replies
+        if use_semantic:
+            semantic_cache.add(
+                semantic_ns, req.message,
+                {"reply": reply, "model_used": model_used, "sources": search_results if used_search else None, "used_search": used_search},
+                ttl=SEMANTIC_CACHE_SEARCH_TTL if used_search else None,
+            )
 
     final_model = req.model
-    reply = selected_model.generate_response(
-        formatted_prompt,
-        max_new_tokens=req.max_tokens,
-        temperature=0.7,
-        top_p=0.95,
-        do_sample=True,
-    )
-
-    # Auto-switch model if response is too short for better quality
-    if len(reply.strip()) < 200 and req.model in models:
-        other_model_key = "TinyLlama/TinyLlama-1.1B-Chat-v1.0" if req.model == "qwen" else "qwen"
-        if other_model_key in models:
-            final_model = other_model_key
-            other_model = models[other_model_key]
-            # Reformat prompt for other model
-            if other_model_key == "qwen":
-                formatted_prompt = f"System: {system_prompt}\n" + "\n".join(conversation) + "\nAssistant:"
-            else:
-                formatted_prompt = f"<|system|>\n{system_prompt}\n" + "\n".join([f"<|{msg.split(': ')[0].lower()}|>\n{msg.split(': ', 1)[1]}" for msg in conversation]) + "\n<|assistant|>\n"
-            reply = other_model.generate_response(
-                formatted_prompt,
-                max_new_tokens=req.max_tokens,
-                temperature=0.7,
-                top_p=0.95,
-                do_sample=True,
-            )
+    if req.stream:
+        # streamed text can't be retracted, so the short-reply auto-switch below is skipped
+        stop_event = threading.Event()
+        chunks = selected_model.stream_response(
+            assembled.prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=0.7,
+            top_p=0.95,
+            do_sample=True,
+            stop_tokens=stop_tokens,
+            stop_event=stop_event,
+            session_id=session_id,
+            use_cache=req.cache,
+            speculative=req.speculative,
+            prompt_ids=assembled.ids,
+        )
+        return _sse_reply(chunks, {"model_used": final_model, "sources": search_results if used_search else None, "used_search": used_search}, session_id, stop_event, on_complete=lambda text: _remember(text, final_model), request=request)
+
+    # Short replies fall back to the other model; the cascade runs the fallback
+    # after the primary, or concurrently / hedged (CASCADE_MODE) and cancels the loser
+    other_model_key = "TinyLlama/TinyLlama-1.1B-Chat-v1.0" if req.model == "qwen" else "qwen"
+    cascade = None
+    if req.model in models and other_model_key in models:
+        def _fallback_candidate(other_model):
+            other, other_stop_tokens = _predict_prompt(other_model_key, other_model)
+            return (other_model_key, other_model, other.prompt, {"stop_tokens": other_stop_tokens, "prompt_ids": other.ids, "max_new_tokens": reply_budget(other_model, other.tokens, req.max_tokens)})
+
+        if models.is_loaded(other_model_key):
+            fallback = _fallback_candidate(models[other_model_key])
+        else:
+            # not resident: only worth loading once the primary's reply turned out short
+            async def fallback():
+                return _fallback_candidate(await _get_model(other_model_key, wait=True))
+
+        cascade = await run_cascade(
+            request,
+            (req.model, selected_model, assembled.prompt, {"stop_tokens": stop_tokens, "prompt_ids": assembled.ids}),
+            fallback,
+            max_new_tokens=max_new_tokens,
+            temperature=0.7,
+            top_p=0.95,
+            do_sample=True,
+            session_id=session_id,
+            use_cache=req.cache,
+            speculative=req.speculative,
+        )
+        reply, final_model = cascade.reply, cascade.winner
+    else:
+        reply = await run_generation(
+            request,
+            selected_model.generate_response,
+            assembled.prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=0.7,
+            top_p=0.95,
+            do_sample=True,
+            stop_tokens=stop_tokens,
+            session_id=session_id,
+            use_cache=req.cache,
+            speculative=req.speculative,
+            prompt_ids=assembled.ids,
+        )
 
-    ChatStore.add_message(session_id, {"role": "bot", "text": reply})
+    if not await _aborted(request):
+        await asyncio.to_thread(_remember, reply, final_model)
+    await ChatStore.aadd_message(session_id, {"role": "bot", "text": reply})
     return {
         "reply": reply, 
         "model_used": final_model, 
         "sources": search_results if used_search else None,
-        "used_search": used_search
+        "used_search": used_search,
+        "cascade": cascade.info() if cascade is not None else None,
+        "prompt": assembled.info(),
     }
 
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the response caches."""
+    return {"response_cache": response_cache.stats(), "semantic_cache": semantic_cache.stats(), "search_cache": search_cache_stats()}
+
+
+@app.get("/speculation/stats")
+async def speculation_stats_endpoint():
+    """Proposed/accepted token counts of assisted decoding per model and mode."""
+    return speculation_stats.stats()
+
+
+# ============= Model Admin Endpoints =============
+
+def _unknown_model(name: str):
+    raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+
+
+@app.get("/admin/models")
+async def list_models(api_key: str = Depends(verify_api_key)):
+    """Registered models with their load state, resident size and the memory budget."""
+    return models.stats()
+
+
+@app.post("/admin/models/{name:path}/load")
+async def load_model(name: str, api_key: str = Depends(verify_api_key)):
+    """Preload a model (evicting least recently used ones if over budget); retries a failed load at once."""
+    if name not in models:
+        _unknown_model(name)
+    models.reset_backoff(name)
+    await _get_model(name, wait=True)
+    return {"ok": True, "models": models.status()}
+
+
+@app.post("/admin/models/{name:path}/unload")
+async def unload_model(name: str, api_key: str = Depends(verify_api_key)):
+    """Unload a resident model; it loads again on its next request."""
+    if name not in models:
+        _unknown_model(name)
+    unloaded = await asyncio.to_thread(models.unload, name)
+    return {"ok": True, "unloaded": unloaded, "models": models.status()}
+
+
 @app.get("/history")
-async def get_history(session_id: str = 'default'):
-    return {"session_id": session_id, "messages": ChatStore.get_history(session_id)}
+async def get_history(session_id: str = 'default', cursor: Optional[int] = None, limit: int = CHAT_STORE_PAGE_SIZE):
+    """The newest `limit` messages of a session (oldest first); pass `next_cursor` as `cursor` for older ones"""
+    page = await ChatStore.aget_page(session_id, before=cursor, limit=min(max(1, limit), 500))
+    return {"session_id": session_id, **page}
+
+
+@app.get("/history/stats")
+async def history_stats():
+    """Sessions, messages and memory held by the chat history store"""
+    return await ChatStore.astats()
 
 
 @app.post("/history/clear")
 async def clear_history(session_id: str = 'default'):
-    ChatStore.clear(session_id)
+    await ChatStore.aclear(session_id)
+    for model in models.loaded().values():
+        session_cache = getattr(model, "session_cache", None)
+        if session_cache is not None:
+            session_cache.drop(session_id)
     return {"ok": True}
 
 
@@ -343,5 +728,10 @@ if __name__ == "__main__":
 
     port = int(os.getenv("PORT", "8000"))
     host = os.getenv("HOST", "127.0.0.1")
+    # worker processes; each loads its own models, and more than one needs a shared
+    # CHAT_STORE_BACKEND (sqlite or redis) so session histories are seen by all of them
+    workers = int(os.getenv("WORKERS", "1"))
+    if workers > 1 and CHAT_STORE_BACKEND == "memory":
+        print("WORKERS > 1 with CHAT_STORE_BACKEND=memory: each worker keeps its own session histories")
     # When running `python main.py` from the backend folder, use the module name 'main'
-    uvicorn.run("main:app", host=host, port=port, reload=True)
+    uvicorn.run("main:app", host=host, port=port, reload=workers == 1, workers=workers)
@@ -1,11 +1,209 @@
 import os
-from typing import Optional, Dict, Any
+import queue
+import re
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, Collection, Iterator, List, Sequence, Tuple, Union
 
 try:
     import torch
-    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList
 except Exception:  # pragma: no cover - allow import-time availability to be optional
     AutoTokenizer = AutoModelForCausalLM = torch = None
+    StoppingCriteria = object
+    StoppingCriteriaList = list
+
+try:
+    from .cache import response_cache
+except Exception:
+    from cache import response_cache
+
+try:
+    from .kv_cache import PrefixCache, SessionKVCache, from_legacy, to_legacy
+    from .quantization import checkpoint_path, load_checkpoint, module_nbytes, normalize_mode, quantize_model, save_checkpoint
+    from .speculative import SPECULATIVE_DRAFT_MODELS, SPECULATIVE_LOOKUP_NGRAM, SPECULATIVE_LOOKUP_TOKENS, SPECULATIVE_MODE, SpeculationStats, normalize_speculation, speculation_stats
+except Exception:
+    from kv_cache import PrefixCache, SessionKVCache, from_legacy, to_legacy
+    from quantization import checkpoint_path, load_checkpoint, module_nbytes, normalize_mode, quantize_model, save_checkpoint
+    from speculative import SPECULATIVE_DRAFT_MODELS, SPECULATIVE_LOOKUP_NGRAM, SPECULATIVE_LOOKUP_TOKENS, SPECULATIVE_MODE, SpeculationStats, normalize_speculation, speculation_stats
+
+# Route plain generate/stream calls through the continuous batching engine
+# (inference_engine.py) so concurrent requests share decode steps.
+MODEL_CONTINUOUS_BATCHING = os.getenv("MODEL_CONTINUOUS_BATCHING", "false").lower() in ("1", "true", "yes")
+MODEL_MAX_BATCH_SIZE = int(os.getenv("MODEL_MAX_BATCH_SIZE", "8"))
+
+# Inference backend: "torch" (eager PyTorch) or "onnx" (ONNX Runtime through
+# optimum, CPU only); load_cached(backend=...) picks one per model. Exported ONNX graphs are kept under MODEL_ONNX_DIR
+# so only the first load pays for the export.
+SUPPORTED_BACKENDS = ("torch", "onnx")
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "torch").lower()
+MODEL_ONNX_DIR = os.getenv("MODEL_ONNX_DIR") or str(Path.home() / ".cache" / "sofai" / "onnx")
+
+
+def decode_generated(tokenizer, ids, keep_special: Collection[int] = ()) -> str:
+    """Decode generated ids without special tokens, except those in `keep_special`."""
+    if not keep_special:
+        return tokenizer.decode(ids, skip_special_tokens=True)
+    special = set(tokenizer.all_special_ids)
+    ids = ids.tolist() if hasattr(ids, "tolist") else ids
+    return tokenizer.decode([i for i in ids if i in keep_special or i not in special], skip_special_tokens=False)
+
+
+class IncrementalDetokenizer:
+    """Turn a growing list of generated token ids into text deltas.
+
+    Decoding one token at a time breaks multi-byte characters and
+    SentencePiece word boundaries, so every step re-decodes a short window
+    ending at the newest token and only emits the text past what the window
+    had already produced (the prefix/read offset scheme used by TGI and vLLM).
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True, keep_special: Collection[int] = ()):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.keep_special = keep_special
+        self.token_ids: List[int] = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, ids: List[int]) -> str:
+        if self.skip_special_tokens:
+            return decode_generated(self.tokenizer, ids, self.keep_special)
+        return self.tokenizer.decode(ids, skip_special_tokens=False)
+
+    def push(self, token_ids: List[int]) -> str:
+        """Append new token ids and return the newly completed text (may be empty)."""
+        self.token_ids.extend(token_ids)
+        prefix_text = self._decode(self.token_ids[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.token_ids[self.prefix_offset:])
+        # an unfinished multi-byte sequence decodes to U+FFFD; wait for more tokens
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            delta = new_text[len(prefix_text):]
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.token_ids)
+            return delta
+        return ""
+
+
+class StopSequenceTrimmer:
+    """Cuts generated text at the first stop sequence, streamed or all at once.
+
+    Text is held back until it can no longer be the start of a stop sequence,
+    so a streamed reply never shows a partial "User:" that is later cut off.
+    Stop sequences can contain special tokens (ChatML's "<|im_start|>user"),
+    so the text pushed in is decoded with those tokens kept; they are given
+    as `special_tokens` and removed from what comes out.
+    Leading and trailing whitespace is dropped, as `strip()` would.
+    """
+
+    def __init__(self, stop_tokens: Optional[list] = None, special_tokens: Sequence[str] = ()):
+        self.stop_tokens = [t for t in (stop_tokens or []) if t]
+        self.special_tokens = [t for t in special_tokens if t]
+        self.holdback = max((len(t) for t in self.stop_tokens), default=1) - 1
+        self.pending = ""
+        self.started = False
+        self.stopped = False
+
+    def _emit(self, text: str) -> str:
+        for t in self.special_tokens:
+            text = text.replace(t, "")
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+    def push(self, text: str) -> str:
+        if self.stopped or not text:
+            return ""
+        self.pending += text
+        for t in self.stop_tokens:
+            idx = self.pending.find(t)
+            if idx != -1:
+                self.stopped = True
+                out, self.pending = self.pending[:idx], ""
+                return self._emit(out).rstrip()
+        cut = len(self.pending) - self.holdback
+        # never split a special token between what is emitted and what is held back
+        for t in self.special_tokens:
+            idx = self.pending.find(t, max(0, cut - len(t) + 1))
+            if -1 < idx < cut:
+                cut = idx
+        if cut <= 0:
+            return ""
+        out, self.pending = self.pending[:cut], self.pending[cut:]
+        return self._emit(out)
+
+    def flush(self) -> str:
+        out, self.pending = ("" if self.stopped else self._emit(self.pending).rstrip()), ""
+        return out
+
+    def trim(self, text: str) -> str:
+        """The whole of `text` up to the first stop sequence, stripped."""
+        return (self.push(text) + self.flush()).strip()
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """Stop generation as soon as the generated text contains a stop sequence.
+
+    Enforces `stop_tokens` inside the decode loop, so the model does not
+    keep generating up to `max_new_tokens` after starting a fake "User:"
+    turn. Each step re-decodes only a short tail of the generated tokens: enough
+    to hold the longest stop sequence plus every token added since the last
+    check (assisted decoding adds several per step). The stop text itself is
+    still trimmed off afterwards by `generate_response` / `StopSequenceTrimmer`.
+    """
+
+    def __init__(self, tokenizer, stop_tokens: list, prompt_len: int = 0):
+        self.tokenizer = tokenizer
+        self.stop_tokens = [t for t in stop_tokens if t]
+        self.prompt_len = prompt_len
+        self.window = max((len(t) for t in self.stop_tokens), default=0) + 2
+        self._checked = 0
+
+    def matches(self, output_ids: List[int]) -> bool:
+        """True if the generated ids (prompt excluded) contain a stop sequence."""
+        if not self.stop_tokens or not output_ids:
+            return False
+        new = max(1, len(output_ids) - self._checked)
+        self._checked = len(output_ids)
+        tail = self.tokenizer.decode(output_ids[-(self.window + new):], skip_special_tokens=False)
+        return any(t in tail for t in self.stop_tokens)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        hit = self.matches(input_ids[0, self.prompt_len:].tolist())
+        return torch.full((input_ids.shape[0],), hit, dtype=torch.bool, device=input_ids.device)
+
+
+class _TokenQueueStreamer:
+    """Minimal `generate(streamer=...)` sink that forwards new token ids to a queue.
+
+    `generate` first calls `put` with the prompt ids, which are skipped.
+    """
+
+    def __init__(self):
+        self.queue: "queue.Queue[Optional[List[int]]]" = queue.Queue()
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        if value.dim() > 1:
+            value = value[0]
+        self.queue.put(value.tolist())
+
+    def end(self):
+        self.queue.put(None)
+
+
+class _StopOnEvent(StoppingCriteria):
+    """Stop generation once `event` is set (e.g. the consumer went away)."""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
 
 
 class ModelWrapper:
@@ -15,29 +213,179 @@ class ModelWrapper:
     - cached model instances
     - automatic device selection (CUDA if available)
     - optional 8-bit / bfloat16 hints when supported
+    - optional int8 / int4 weight quantization on CPU (quantization.py)
+    - optional ONNX Runtime backend (`backend="onnx"`); KV cache reuse and
+      continuous batching need direct access to the PyTorch model, so they
+      are only used with the torch backend
     - safer tokenizer handling
+    - optional continuous batching across concurrent requests
+    - reusable KV caches for static prompt prefixes (system prompts)
+      and for each session's previous conversation turn
+    - optional assisted decoding with a draft model or prompt lookup
+      (speculative.py), chosen per request
     """
 
     MODEL_CACHE: Dict[str, "ModelWrapper"] = {}
 
-    def __init__(self, tokenizer, model, device: str = "cpu"):
+    def __init__(self, tokenizer, model, device: str = "cpu", model_name: Optional[str] = None, backend: str = "torch"):
         self.tokenizer = tokenizer
         self.model = model
         self.device = device
+        self.backend = backend
+        self.model_name = model_name or getattr(getattr(model, "config", None), "_name_or_path", "model")
+        self.prefix_cache = PrefixCache(self.model_name)
+        self.session_cache = SessionKVCache()
+        self._engine = None
+        self._engine_lock = threading.Lock()
+        # small model of the same family used for speculative="draft"; loaded on first use
+        self.draft_model_name: Optional[str] = SPECULATIVE_DRAFT_MODELS.get(self.model_name)
+        self._draft: Optional["ModelWrapper"] = None
+
+    @property
+    def engine(self):
+        """Lazily started continuous batching engine for this model."""
+        if self._engine is None:
+            with self._engine_lock:
+                if self._engine is None:
+                    try:
+                        from .inference_engine import InferenceEngine
+                    except Exception:
+                        from inference_engine import InferenceEngine
+                    self._engine = InferenceEngine(self, max_batch_size=MODEL_MAX_BATCH_SIZE)
+        return self._engine
+
+    def _use_engine(self, gen_kwargs: Dict[str, Any], speculative: Optional[str] = None) -> bool:
+        # extra generate() options (beam search, custom criteria, ...) and assisted decoding only work with HF generate
+        if not MODEL_CONTINUOUS_BATCHING or gen_kwargs or self.backend != "torch":
+            return False
+        return normalize_speculation(SPECULATIVE_MODE if speculative is None else speculative) is None
+
+    def _submit_to_engine(self, prompt: str, max_new_tokens: int, do_sample: bool, temperature: float, top_p: float, stop_event: Optional[threading.Event] = None, session_id: Optional[str] = None, stop_tokens: Optional[list] = None, prompt_ids: Optional[List[int]] = None):
+        try:
+            from .inference_engine import SamplingParams
+        except Exception:
+            from inference_engine import SamplingParams
+        if prompt_ids is None:
+            prompt_ids = self.tokenizer(prompt)["input_ids"]
+        params = SamplingParams(max_new_tokens=max_new_tokens, do_sample=do_sample, temperature=temperature, top_p=top_p)
+        stop_check = StopSequenceCriteria(self.tokenizer, stop_tokens).matches if stop_tokens else None
+        return self.engine.submit(prompt_ids, params, stop_event, session_id, stop_check)
+
+    @property
+    def draft(self) -> Optional["ModelWrapper"]:
+        """The draft model for assisted decoding, or None if none is configured."""
+        if self._draft is None and self.draft_model_name:
+            with self._engine_lock:
+                if self._draft is None:
+                    self._draft = ModelWrapper.load_cached(self.draft_model_name, backend="torch")
+        return self._draft
+
+    def _speculation_params(self, speculative: Optional[str], prompt_len: int) -> Tuple[Dict[str, Any], Optional[SpeculationStats]]:
+        """`generate` kwargs for assisted decoding in mode `speculative` (default SPECULATIVE_MODE).
+
+        Returns `({}, None)` when decoding stays plain: mode off, a non-torch
+        backend, or "draft" without a configured draft model.
+        """
+        mode = normalize_speculation(SPECULATIVE_MODE if speculative is None else speculative)
+        if mode is None or self.backend != "torch":
+            return {}, None
+        if mode == "draft":
+            draft = self.draft
+            if draft is None:
+                return {}, None
+            params: Dict[str, Any] = {"assistant_model": draft.model}
+            if draft.tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                # different tokenizers: let HF re-tokenize the drafted text
+                params.update(tokenizer=self.tokenizer, assistant_tokenizer=draft.tokenizer)
+        else:
+            params = {"prompt_lookup_num_tokens": SPECULATIVE_LOOKUP_TOKENS, "max_matching_ngram_size": SPECULATIVE_LOOKUP_NGRAM}
+        stats = SpeculationStats(mode, prompt_len)
+        params["stopping_criteria"] = StoppingCriteriaList([stats])
+        return params, stats
+
+    def register_prefix(self, prefix: Union[str, List[int]]) -> int:
+        """Precompute the KV cache of a static prompt prefix (e.g. a system prompt).
+
+        `prefix` is text or, for prompts built from token ids (prompts.py),
+        the ids themselves. Any later prompt whose tokens start with the
+        same ids skips prefilling that part. Returns the number of cached tokens.
+        """
+        if self.backend != "torch":
+            return 0
+        return self.prefix_cache.register(self, prefix)
+
+    def cached_prefix(self, input_ids: List[int], session_id: Optional[str] = None):
+        """Return `(n, legacy_cache)` covering the first `n` prompt tokens, or `(0, None)`.
+
+        The session's previous turn usually covers far more of the prompt
+        than a static prefix, so the longer of the two matches wins.
+        """
+        if self.backend != "torch":
+            return 0, None
+        best = self.prefix_cache.lookup(input_ids)
+        if session_id:
+            hit = self.session_cache.lookup(session_id, input_ids)
+            if hit[0] > best[0]:
+                best = hit
+        return best
+
+    def _remember_session(self, session_id: Optional[str], outputs) -> None:
+        """Keep the cache of a finished `generate(return_dict_in_generate=True)` call for the next turn."""
+        if session_id and getattr(outputs, "past_key_values", None) is not None:
+            self.session_cache.store(session_id, outputs.sequences[0].tolist(), to_legacy(outputs.past_key_values))
+
+    def resident_bytes(self) -> int:
+        """Memory held by the model's weights and buffers plus its KV caches."""
+        if self.backend == "onnx":
+            # ONNX Runtime holds the weights of the graph files it loaded
+            save_dir = Path(getattr(self.model, "model_save_dir", ""))
+            return sum(f.stat().st_size for f in save_dir.glob("*.onnx*") if f.is_file())
+        draft = self._draft.resident_bytes() if self._draft is not None else 0
+        return module_nbytes(self.model) + self.session_cache.used_bytes + draft
+
+    def close(self) -> None:
+        """Stop the batching engine and drop cached KV state so the model can be freed."""
+        if self._engine is not None:
+            self._engine.shutdown()
+            self._engine = None
+        self.session_cache = SessionKVCache()
+        self.prefix_cache = PrefixCache(self.model_name)
+        if self._draft is not None:
+            self._draft = None
+            ModelWrapper.unload_cached(self.draft_model_name, backend="torch")
+
+    @staticmethod
+    def cache_key(model_name: str, load_in_8bit: bool = False, revision: Optional[str] = None, cpu_quantize: Optional[str] = None, backend: str = MODEL_BACKEND) -> str:
+        if backend == "onnx":
+            precision = "fp"  # quantization options apply to the torch backend only
+        else:
+            precision = "8bit" if load_in_8bit else normalize_mode(cpu_quantize) or "fp"
+        return f"{model_name}:{precision}:{revision or 'main'}:{backend}"
 
     @classmethod
-    def load_cached(cls, model_name: str = "mistral-7b-instruct", trust_remote_code: bool = False, load_in_8bit: bool = False, revision: Optional[str] = None) -> "ModelWrapper":
-        key = f"{model_name}:{'8bit' if load_in_8bit else 'fp'}:{revision or 'main'}"
+    def load_cached(cls, model_name: str = "mistral-7b-instruct", trust_remote_code: bool = False, load_in_8bit: bool = False, revision: Optional[str] = None, cpu_quantize: Optional[str] = None, backend: str = MODEL_BACKEND) -> "ModelWrapper":
+        key = cls.cache_key(model_name, load_in_8bit, revision, cpu_quantize, backend)
         if key in cls.MODEL_CACHE:
             return cls.MODEL_CACHE[key]
-        wrapper = cls._load_model(model_name, trust_remote_code=trust_remote_code, load_in_8bit=load_in_8bit, revision=revision)
+        wrapper = cls._load_model(model_name, trust_remote_code=trust_remote_code, load_in_8bit=load_in_8bit, revision=revision, cpu_quantize=cpu_quantize, backend=backend)
         cls.MODEL_CACHE[key] = wrapper
         return wrapper
 
     @classmethod
-    def _load_model(cls, model_name: str, trust_remote_code: bool = False, load_in_8bit: bool = False, revision: Optional[str] = None) -> "ModelWrapper":
+    def unload_cached(cls, model_name: str, load_in_8bit: bool = False, revision: Optional[str] = None, cpu_quantize: Optional[str] = None, backend: str = MODEL_BACKEND) -> bool:
+        """Remove a model from MODEL_CACHE and release its engine; True if it was loaded."""
+        wrapper = cls.MODEL_CACHE.pop(cls.cache_key(model_name, load_in_8bit, revision, cpu_quantize, backend), None)
+        if wrapper is None:
+            return False
+        wrapper.close()
+        return True
+
+    @classmethod
+    def _load_model(cls, model_name: str, trust_remote_code: bool = False, load_in_8bit: bool = False, revision: Optional[str] = None, cpu_quantize: Optional[str] = None, backend: str = MODEL_BACKEND) -> "ModelWrapper":
         if AutoTokenizer is None:
             raise ImportError("transformers and torch are required to load models. Install via pip: pip install transformers torch accelerate")
+        if backend not in SUPPORTED_BACKENDS:
+            raise ValueError(f"Unknown model backend {backend!r}; use one of {SUPPORTED_BACKENDS}")
 
         # choose device
         has_cuda = torch.cuda.is_available() if torch is not None else False
@@ -52,6 +400,10 @@ class ModelWrapper:
             else:
                 tokenizer.add_special_tokens({"pad_token": "<pad>"})
 
+        if backend == "onnx":
+            model = cls._load_onnx_model(model_name, trust_remote_code=trust_remote_code, revision=revision)
+            return cls(tokenizer=tokenizer, model=model, device="cpu", model_name=model_name, backend="onnx")
+
         # model loading kwargs
         load_kwargs: Dict[str, Any] = {"trust_remote_code": trust_remote_code}
         if device == "cuda":
@@ -64,33 +416,61 @@ class ModelWrapper:
             # CPU-friendly flags
             load_kwargs.update({"low_cpu_mem_usage": True})
 
-        model = AutoModelForCausalLM.from_pretrained(model_name, revision=revision, **load_kwargs)
+        # int8/int4 CPU quantization; a previously quantized checkpoint skips the fp32 load
+        quantize = normalize_mode(cpu_quantize) if device == "cpu" else None
+        quantized_path = checkpoint_path(model_name, revision, quantize) if quantize else None
+        model = load_checkpoint(quantized_path)
+        if model is None:
+            model = AutoModelForCausalLM.from_pretrained(model_name, revision=revision, **load_kwargs)
 
-        # move to cpu if needed (from_pretrained may have placed it already)
-        if device == "cpu":
-            try:
-                model.to("cpu")
-            except Exception:
-                pass
+            # move to cpu if needed (from_pretrained may have placed it already)
+            if device == "cpu":
+                try:
+                    model.to("cpu")
+                except Exception:
+                    pass
 
-        return cls(tokenizer=tokenizer, model=model, device=device)
+            if quantize:
+                model = quantize_model(model.eval(), quantize)
+                save_checkpoint(model, quantized_path)
 
-    def generate_response(self, prompt: str, max_new_tokens: int = 80, do_sample: bool = True, temperature: float = 0.3, top_p: float = 0.7, stop_tokens: Optional[list] = None, **gen_kwargs) -> str:
-        """Generate a response string for a given prompt with improved quality settings.
+        return cls(tokenizer=tokenizer, model=model, device=device, model_name=model_name)
 
-        This method keeps the implementation simple but avoids returning the prompt
-        concatenated with the model output by removing the input prompt from the
-        decoded text when possible.
-        
-        Ultra-tuned defaults for focused, direct answers:
-        - max_new_tokens=80: Very short, direct answers only
-        - temperature=0.3: Highly deterministic, minimal rambling
-        - top_p=0.7: Very tight nucleus sampling for consistency
+    @staticmethod
+    def _load_onnx_model(model_name: str, trust_remote_code: bool = False, revision: Optional[str] = None):
+        """Load `model_name` as an ONNX Runtime model with KV-cache inputs, exporting it on first use."""
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError as e:
+            raise ImportError("The onnx backend needs optimum and onnxruntime: pip install optimum[onnxruntime]") from e
+
+        export_dir = Path(MODEL_ONNX_DIR) / f"{re.sub(r'[^A-Za-z0-9._-]+', '--', model_name.strip('/'))}__{revision or 'main'}"
+        if any(export_dir.glob("*.onnx")):
+            return ORTModelForCausalLM.from_pretrained(export_dir, use_cache=True, provider="CPUExecutionProvider")
+
+        model = ORTModelForCausalLM.from_pretrained(model_name, revision=revision, export=True, use_cache=True, trust_remote_code=trust_remote_code, provider="CPUExecutionProvider")
+        try:
+            model.save_pretrained(export_dir)
+        except Exception as e:
+            print(f"Could not keep the ONNX export of {model_name} in {export_dir}: {e}")
+        return model
+
+    def _prepare_generation(self, prompt: str, max_new_tokens: int, do_sample: bool, temperature: float, top_p: float, session_id: Optional[str] = None, speculative: Optional[str] = None, stop_tokens: Optional[list] = None, prompt_ids: Optional[List[int]] = None, **gen_kwargs) -> Tuple[Dict[str, Any], Any, Optional[SpeculationStats]]:
+        """Tokenize `prompt` and build the keyword arguments for `model.generate`.
+
+        Returns the generate kwargs, the prompt `input_ids` (used to slice
+        the prompt off the generated sequence) and the acceptance counters
+        of assisted decoding (None when it is not used).
         """
         if self.tokenizer is None or self.model is None:
             raise RuntimeError("ModelWrapper is not properly initialized")
 
-        inputs = self.tokenizer(prompt, return_tensors="pt")
+        if prompt_ids is not None:
+            # already tokenized by a prompt builder (prompts.py)
+            input_ids = torch.tensor([prompt_ids], dtype=torch.long)
+            inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        else:
+            inputs = self.tokenizer(prompt, return_tensors="pt")
         input_ids = inputs.get("input_ids")
         if self.device == "cuda":
             inputs = {k: v.to("cuda") for k, v in inputs.items()}
@@ -104,30 +484,210 @@ class ModelWrapper:
             top_p=top_p,
             pad_token_id=self.tokenizer.eos_token_id,
         )
+        cached, past = self.cached_prefix(input_ids[0].tolist(), session_id)
+        if past is not None:
+            # generate() only prefills the tokens beyond the cached prefix
+            generate_params["past_key_values"] = from_legacy(past)
+        if session_id and self.backend == "torch":
+            # hand back the final cache so the next turn of this session can reuse it
+            generate_params.update(return_dict_in_generate=True, use_cache=True)
+        spec_params, spec_stats = self._speculation_params(speculative, input_ids.shape[-1])
+        criteria = StoppingCriteriaList(gen_kwargs.pop("stopping_criteria", None) or [])
+        criteria.extend(spec_params.pop("stopping_criteria", []))
+        if stop_tokens:
+            criteria.append(StopSequenceCriteria(self.tokenizer, stop_tokens, input_ids.shape[-1]))
+        generate_params.update(spec_params)
         generate_params.update(gen_kwargs)
+        if criteria:
+            generate_params["stopping_criteria"] = criteria
+        return generate_params, input_ids, spec_stats
+
+    def generate_response(self, prompt: str, max_new_tokens: int = 80, do_sample: bool = True, temperature: float = 0.3, top_p: float = 0.7, stop_tokens: Optional[list] = None, stop_event: Optional[threading.Event] = None, session_id: Optional[str] = None, use_cache: Optional[bool] = None, speculative: Optional[str] = None, prompt_ids: Optional[List[int]] = None, **gen_kwargs) -> str:
+        """Generate a response string for a given prompt with improved quality settings.
+
+        This method keeps the implementation simple but avoids returning the prompt
+        concatenated with the model output by removing the input prompt from the
+        decoded text when possible.
+        
+        Ultra-tuned defaults for focused, direct answers:
+        - max_new_tokens=80: Very short, direct answers only
+        - temperature=0.3: Highly deterministic, minimal rambling
+        - top_p=0.7: Very tight nucleus sampling for consistency
+
+        Setting `stop_event` (e.g. when the HTTP client disconnects) aborts
+        generation at the next decode step and returns what was produced so far.
+        With a `session_id`, the KV cache of this turn is kept so the next
+        turn of the same conversation only prefills its new tokens.
+
+        Replies are served from / stored in the shared response cache (see
+        cache.py) unless `use_cache=False`; by default only greedy decoding
+        uses it, because sampled replies are meant to vary.
 
-        outputs = self.model.generate(**generate_params)
+        `prompt_ids` are the token ids of `prompt` when the caller already
+        has them (prompts.py builds prompts from cached token segments); the
+        prompt text is then only used as the cache key.
+
+        `speculative` ("draft", "lookup" or "off"; default SPECULATIVE_MODE)
+        turns on assisted decoding (speculative.py). It does not change the
+        output distribution, so it is not part of the response cache key.
+        """
+        if gen_kwargs or not response_cache.should_use(use_cache, do_sample, temperature):
+            return self._generate_reply(prompt, max_new_tokens, do_sample, temperature, top_p, stop_tokens, stop_event, session_id, speculative, prompt_ids, **gen_kwargs)
+
+        key = response_cache.make_key(self.model_name, prompt, max_new_tokens=max_new_tokens, do_sample=do_sample, temperature=temperature, top_p=top_p, stop_tokens=stop_tokens)
+
+        def _compute():
+            reply = self._generate_reply(prompt, max_new_tokens, do_sample, temperature, top_p, stop_tokens, stop_event, session_id, speculative, prompt_ids)
+            # an aborted generation is partial and must not be cached
+            return reply, not (stop_event is not None and stop_event.is_set())
+
+        return response_cache.get_or_compute(key, _compute)
+
+    def _generate_reply(self, prompt: str, max_new_tokens: int, do_sample: bool, temperature: float, top_p: float, stop_tokens: Optional[list] = None, stop_event: Optional[threading.Event] = None, session_id: Optional[str] = None, speculative: Optional[str] = None, prompt_ids: Optional[List[int]] = None, **gen_kwargs) -> str:
+        if self._use_engine(gen_kwargs, speculative):
+            seq = self._submit_to_engine(prompt, max_new_tokens, do_sample, temperature, top_p, stop_event=stop_event, session_id=session_id, stop_tokens=stop_tokens, prompt_ids=prompt_ids)
+            seq.done.wait()
+            if seq.error is not None:
+                raise seq.error
+            text = decode_generated(self.tokenizer, seq.output_ids, self._stop_specials(stop_tokens))
+        else:
+            text = self._generate_text(prompt, max_new_tokens, do_sample, temperature, top_p, stop_event=stop_event, session_id=session_id, speculative=speculative, stop_tokens=stop_tokens, prompt_ids=prompt_ids, **gen_kwargs)
+
+        # generation halts right after a stop sequence; cut it (and anything after it) off
+        if stop_tokens:
+            return self._stop_trimmer(stop_tokens).trim(text or "")
+
+        return text.strip() if text else ""
+
+    def _stop_specials(self, stop_tokens: Optional[list]) -> Dict[int, str]:
+        """Special tokens that are part of a stop sequence, by id.
+
+        They are decoded instead of skipped so the stop sequence can match
+        the reply text, as it does in `StopSequenceCriteria`.
+        """
+        if not stop_tokens:
+            return {}
+        tokenizer = self.tokenizer
+        specials = zip(getattr(tokenizer, "all_special_ids", ()), getattr(tokenizer, "all_special_tokens", ()))
+        return {i: t for i, t in specials if any(t in stop for stop in stop_tokens if stop)}
+
+    def _stop_trimmer(self, stop_tokens: Optional[list]) -> StopSequenceTrimmer:
+        return StopSequenceTrimmer(stop_tokens, list(self._stop_specials(stop_tokens).values()))
+
+    def _generate_text(self, prompt: str, max_new_tokens: int, do_sample: bool, temperature: float, top_p: float, stop_event: Optional[threading.Event] = None, session_id: Optional[str] = None, speculative: Optional[str] = None, stop_tokens: Optional[list] = None, prompt_ids: Optional[List[int]] = None, **gen_kwargs) -> str:
+        """Run HF `generate` for a single prompt and decode only the new tokens."""
+        generate_params, input_ids, spec_stats = self._prepare_generation(prompt, max_new_tokens, do_sample, temperature, top_p, session_id=session_id, speculative=speculative, stop_tokens=stop_tokens, prompt_ids=prompt_ids, **gen_kwargs)
+        if stop_event is not None:
+            criteria = StoppingCriteriaList(generate_params.pop("stopping_criteria", None) or [])
+            criteria.append(_StopOnEvent(stop_event))
+            generate_params["stopping_criteria"] = criteria
+
+        try:
+            outputs = self.model.generate(**generate_params)
+        finally:
+            if spec_stats is not None:
+                speculation_stats.record(self.model_name, spec_stats)
+        if generate_params.get("return_dict_in_generate"):
+            self._remember_session(session_id, outputs)
+            outputs = outputs.sequences
 
         # outputs may include the prompt tokens; decode only the newly generated tokens
         try:
             # When possible, slice off the prompt length
             if isinstance(outputs, torch.Tensor):
-                generated_ids = outputs[0][input_ids.shape[-1]:]
+                # prompt lookup can overshoot max_new_tokens by part of its last step
+                generated_ids = outputs[0][input_ids.shape[-1]:][:max_new_tokens]
             else:
                 generated_ids = outputs[0]
-            text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+            text = decode_generated(self.tokenizer, generated_ids, self._stop_specials(stop_tokens))
         except Exception:
             # fallback: decode full sequence and remove prompt text if present
             text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
             if text.startswith(prompt):
                 text = text[len(prompt):]
+        return text
 
-        # apply simple stop token trimming
-        if stop_tokens:
-            for t in stop_tokens:
-                idx = text.find(t)
-                if idx != -1:
-                    text = text[:idx]
-                    break
+    def stream_response(self, prompt: str, max_new_tokens: int = 80, do_sample: bool = True, temperature: float = 0.3, top_p: float = 0.7, stop_tokens: Optional[list] = None, stop_event: Optional[threading.Event] = None, session_id: Optional[str] = None, speculative: Optional[str] = None, prompt_ids: Optional[List[int]] = None, use_cache: Optional[bool] = None, **gen_kwargs) -> Iterator[str]:
+        """Incremental version of `generate_response` that yields text deltas.
 
-        return text.strip() if text else ""
+        `generate` runs on a background thread and pushes token ids through a
+        queue; they are detokenized incrementally so the first words reach
+        the caller right after prefill instead of after the full completion.
+        Closing the iterator early or setting `stop_event` (e.g. the client
+        disconnected) stops the generation thread at the next decode step.
+
+        The response cache is shared with `generate_response` (same key and
+        `use_cache` policy): a cached reply is yielded as one chunk, and a
+        reply streamed to the end without being stopped is stored.
+        """
+        cache_key = None
+        if not gen_kwargs and response_cache.should_use(use_cache, do_sample, temperature):
+            cache_key = response_cache.make_key(self.model_name, prompt, max_new_tokens=max_new_tokens, do_sample=do_sample, temperature=temperature, top_p=top_p, stop_tokens=stop_tokens)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                if cached:
+                    yield cached
+                return
+
+        cancel = stop_event or threading.Event()
+        errors: List[BaseException] = []
+        seq = None
+
+        if self._use_engine(gen_kwargs, speculative):
+            seq = self._submit_to_engine(prompt, max_new_tokens, do_sample, temperature, top_p, stop_event=cancel, session_id=session_id, stop_tokens=stop_tokens, prompt_ids=prompt_ids)
+            token_queue = seq.queue
+        else:
+            generate_params, _, spec_stats = self._prepare_generation(prompt, max_new_tokens, do_sample, temperature, top_p, session_id=session_id, speculative=speculative, stop_tokens=stop_tokens, prompt_ids=prompt_ids, **gen_kwargs)
+            streamer = _TokenQueueStreamer()
+            criteria = StoppingCriteriaList(generate_params.pop("stopping_criteria", None) or [])
+            criteria.append(_StopOnEvent(cancel))
+            generate_params.update(streamer=streamer, stopping_criteria=criteria)
+            token_queue = streamer.queue
+
+            def _run():
+                try:
+                    outputs = self.model.generate(**generate_params)
+                    if generate_params.get("return_dict_in_generate"):
+                        self._remember_session(session_id, outputs)
+                except BaseException as e:  # surfaced to the consumer below
+                    errors.append(e)
+                finally:
+                    if spec_stats is not None:
+                        speculation_stats.record(self.model_name, spec_stats)
+                    streamer.end()
+
+            thread = threading.Thread(target=_run, name="sofai-stream", daemon=True)
+            thread.start()
+
+        # special tokens of the stop sequences are decoded for the trimmer to match, then dropped
+        detokenizer = IncrementalDetokenizer(self.tokenizer, keep_special=self._stop_specials(stop_tokens))
+        trimmer = self._stop_trimmer(stop_tokens)
+        remaining = max_new_tokens
+        reply: List[str] = []
+        try:
+            while remaining > 0:
+                token_ids = token_queue.get()
+                if token_ids is None:
+                    break
+                # assisted decoding yields several tokens per step and may overshoot max_new_tokens
+                token_ids, remaining = token_ids[:remaining], remaining - len(token_ids)
+                text = trimmer.push(detokenizer.push(token_ids))
+                if text:
+                    reply.append(text)
+                    yield text
+                if trimmer.stopped:
+                    break
+            # a generation stopped from outside is partial and must not be cached
+            complete = not cancel.is_set()
+            if seq is not None and seq.error is not None:
+                errors.append(seq.error)
+            if errors:
+                raise errors[0]
+            tail = trimmer.flush()
+            if tail:
+                reply.append(tail)
+                yield tail
+            if cache_key is not None and complete:
+                response_cache.set(cache_key, "".join(reply))
+        finally:
+            cancel.set()
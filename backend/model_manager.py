@@ -0,0 +1,365 @@
+"""Registry of servable models, loaded on first use and evicted under a RAM budget.
+
+Models are registered by name with a loader instead of being loaded at
+startup. The first request for a model loads it (concurrent requests wait
+for the same load), its resident size is measured, and the least recently
+used other models are unloaded until the total fits MODEL_MEMORY_BUDGET_MB.
+Requests already running on an evicted model finish normally; its memory
+is released when they are done.
+
+`ModelManager` is a read-only mapping, so `models[name]` and
+`models.get(name)` keep working (loading on demand). Async endpoints should
+use `await models.aget(name)` so a load does not block the event loop, or
+`models.aget(name, wait=False)`, which starts the load in the background
+and raises `ModelLoading` at once so the API can answer 503 + Retry-After.
+
+A failed load is not retried until a backoff has passed (MODEL_LOAD_BACKOFF
+seconds, doubling with every consecutive failure up to
+MODEL_LOAD_BACKOFF_MAX); until then requests get `ModelUnavailable` at once
+instead of each one hitting the hub or disk again.
+"""
+
+import asyncio
+import gc
+import os
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+# total memory for resident models; 0 disables eviction
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+# models loaded (in parallel) at startup; everything else loads on first use.
+# Both built-in models by default: /predict falls back from one to the other.
+MODEL_PRELOAD = [m.strip() for m in os.getenv("MODEL_PRELOAD", "qwen,tinyllama").split(",") if m.strip()]
+# Retry-After hint for a model that has never finished loading before
+MODEL_LOADING_RETRY_AFTER = int(os.getenv("MODEL_LOADING_RETRY_AFTER", "10"))
+# seconds before a failed load is retried; doubles per consecutive failure up to the max
+MODEL_LOAD_BACKOFF = float(os.getenv("MODEL_LOAD_BACKOFF", "30"))
+MODEL_LOAD_BACKOFF_MAX = float(os.getenv("MODEL_LOAD_BACKOFF_MAX", "600"))
+# extra servable models, e.g. "phi=microsoft/Phi-3-mini-4k-instruct,smol=HuggingFaceTB/SmolLM2-360M-Instruct"
+MODEL_REGISTRY = dict(
+    entry.split("=", 1) for entry in os.getenv("MODEL_REGISTRY", "").split(",") if "=" in entry
+)
+
+
+class ModelNotFound(KeyError):
+    """Raised for a model name that was never registered."""
+
+
+class ModelLoading(Exception):
+    """Raised by `aget(..., wait=False)` while the requested model is still loading."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Model {name} is loading, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class ModelUnavailable(Exception):
+    """Raised while a model whose last load failed is backing off before the next attempt."""
+
+    def __init__(self, name: str, retry_after: int, error: Optional[str] = None):
+        super().__init__(f"Model {name} failed to load, retry in {retry_after}s: {error}")
+        self.name = name
+        self.retry_after = retry_after
+        self.error = error
+
+
+@dataclass
+class ModelSpec:
+    name: str
+    load: Callable[[], Any]
+    unload: Optional[Callable[[Any], None]] = None
+    aliases: Tuple[str, ...] = ()
+    # static prompt prefixes whose KV caches are precomputed after loading: text, or a
+    # callable that returns the prefix (text or token ids) for the loaded model
+    prefixes: Tuple[Union[str, Callable[[Any], Any]], ...] = ()
+
+
+class _Slot:
+    def __init__(self, spec: ModelSpec):
+        self.spec = spec
+        self.model: Any = None
+        self.nbytes = 0  # measured at the last load, also used as the estimate for the next one
+        self.last_used = 0.0
+        self.loaded_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.failures = 0  # consecutive failed loads
+        self.failed_at: Optional[float] = None
+        self.lock = threading.Lock()  # held while loading or unloading
+        self.background: Optional[threading.Thread] = None
+
+    @property
+    def state(self) -> str:
+        if self.model is not None:
+            return "ready"
+        if self.lock.locked() or (self.background is not None and self.background.is_alive()):
+            return "loading"
+        return "failed" if self.error else "unloaded"
+
+    def backoff_remaining(self) -> float:
+        """Seconds until a failed load may be retried (0 if it may be retried now)."""
+        if not self.failures or self.failed_at is None:
+            return 0.0
+        backoff = min(MODEL_LOAD_BACKOFF_MAX, MODEL_LOAD_BACKOFF * 2 ** (self.failures - 1))
+        return max(0.0, self.failed_at + backoff - time.monotonic())
+
+    def check_backoff(self) -> None:
+        remaining = self.backoff_remaining()
+        if remaining > 0:
+            raise ModelUnavailable(self.spec.name, max(1, int(remaining + 0.999)), self.error)
+
+
+def hf_model_spec(name: str, model_id: str, aliases: Tuple[str, ...] = (), prefixes: Tuple[Union[str, Callable[[Any], Any]], ...] = (), trust_remote_code: bool = False, load_in_8bit: bool = False, revision: Optional[str] = None, cpu_quantize: Optional[str] = None, backend: Optional[str] = None) -> ModelSpec:
+    """Spec for a Hugging Face model served through `ModelWrapper`.
+
+    `backend` ("torch" or "onnx") defaults to MODEL_BACKEND in model_loader.
+    """
+    options: Dict[str, Any] = {"load_in_8bit": load_in_8bit, "revision": revision, "cpu_quantize": cpu_quantize}
+    if backend:
+        options["backend"] = backend
+
+    def _wrapper_cls():
+        # imported lazily so registering models does not import torch/transformers
+        try:
+            from .model_loader import ModelWrapper
+        except Exception:
+            from model_loader import ModelWrapper
+        return ModelWrapper
+
+    def _load():
+        return _wrapper_cls().load_cached(model_id, trust_remote_code=trust_remote_code, **options)
+
+    def _unload(model):
+        _wrapper_cls().unload_cached(model_id, **options)
+
+    return ModelSpec(name=name, load=_load, unload=_unload, aliases=tuple(aliases), prefixes=tuple(prefixes))
+
+
+class ModelManager(Mapping):
+    """Lazily loaded models with LRU eviction under a memory budget."""
+
+    def __init__(self, budget_bytes: int = MODEL_MEMORY_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._slots: Dict[str, _Slot] = {}
+        self._aliases: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def register(self, spec: ModelSpec) -> None:
+        with self._lock:
+            self._slots[spec.name] = _Slot(spec)
+            self._aliases[spec.name] = spec.name
+            for alias in spec.aliases:
+                self._aliases[alias] = spec.name
+
+    def resolve(self, name: str, default: Optional[str] = None) -> str:
+        """Canonical name for `name` or one of its aliases (else for `default`)."""
+        canonical = self._aliases.get(name)
+        if canonical is None and default is not None:
+            canonical = self._aliases.get(default)
+        if canonical is None:
+            raise ModelNotFound(name)
+        return canonical
+
+    # ---- Mapping interface (registered names; values load on access) ----
+
+    def __getitem__(self, name: str) -> Any:
+        return self.load(name)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._aliases
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._slots))
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # ---- loading ----
+
+    def is_loaded(self, name: str) -> bool:
+        slot = self._slots.get(self._aliases.get(name, name))
+        return slot is not None and slot.model is not None
+
+    def loaded(self) -> Dict[str, Any]:
+        """Currently resident models by canonical name (does not load anything)."""
+        return {name: slot.model for name, slot in list(self._slots.items()) if slot.model is not None}
+
+    def load(self, name: str) -> Any:
+        """Return the model for `name`, loading it (and evicting others) if needed."""
+        slot = self._slots[self.resolve(name)]
+        model = slot.model
+        if model is None:
+            slot.check_backoff()
+            with slot.lock:
+                if slot.model is None:
+                    # a concurrent load of this model may just have failed
+                    slot.check_backoff()
+                    self._load_slot(slot)
+            model = slot.model
+        slot.last_used = time.monotonic()
+        return model
+
+    async def aget(self, name: str, default: Optional[str] = None, wait: bool = True) -> Any:
+        """Async `load`: resident models return at once, others load on a worker thread.
+
+        With `wait=False` a model that is not resident is loaded in the
+        background and `ModelLoading` is raised instead of waiting for it.
+        """
+        canonical = self.resolve(name, default)
+        slot = self._slots[canonical]
+        model = slot.model
+        if model is not None:
+            slot.last_used = time.monotonic()
+            return model
+        slot.check_backoff()
+        if not wait:
+            self.load_in_background(canonical)
+            raise ModelLoading(canonical, self.retry_after(canonical))
+        return await asyncio.to_thread(self.load, canonical)
+
+    def load_in_background(self, name: str) -> None:
+        """Start loading `name` on a daemon thread unless it is resident or already loading."""
+        slot = self._slots[self.resolve(name)]
+        with self._lock:
+            if slot.model is not None or (slot.background is not None and slot.background.is_alive()) or slot.backoff_remaining() > 0:
+                return
+
+            def _run():
+                try:
+                    self.load(slot.spec.name)
+                except Exception as e:
+                    print(f"Error loading model {slot.spec.name}: {e}")
+
+            slot.background = threading.Thread(target=_run, name=f"sofai-load-{slot.spec.name}", daemon=True)
+            slot.background.start()
+
+    def state(self, name: str) -> str:
+        """One of "ready", "loading", "unloaded" or "failed"."""
+        return self._slots[self.resolve(name)].state
+
+    def retry_after(self, name: str) -> int:
+        """Seconds a client should wait for `name`: its load backoff after a failure,
+        else its previous load time if known."""
+        slot = self._slots[self.resolve(name)]
+        remaining = slot.backoff_remaining()
+        if remaining > 0:
+            return max(1, int(remaining + 0.999))
+        return max(1, int(slot.load_seconds)) if slot.load_seconds else MODEL_LOADING_RETRY_AFTER
+
+    def _load_slot(self, slot: _Slot) -> None:
+        spec = slot.spec
+        # make room up front using the size measured at the previous load, if any
+        self._evict_to_fit(slot.nbytes, keep=spec.name)
+        started = time.monotonic()
+        try:
+            model = spec.load()
+            register_prefix = getattr(model, "register_prefix", None)
+            if register_prefix is not None:
+                for prefix in spec.prefixes:
+                    register_prefix(prefix(model) if callable(prefix) else prefix)
+        except Exception as e:
+            slot.error = str(e)
+            slot.failures += 1
+            slot.failed_at = time.monotonic()
+            raise
+        slot.load_seconds = round(time.monotonic() - started, 2)
+        measure = getattr(model, "resident_bytes", None)
+        slot.nbytes = measure() if measure is not None else 0
+        slot.model = model
+        slot.loaded_at = time.time()
+        slot.last_used = time.monotonic()
+        slot.error = None
+        slot.failures = 0
+        self.loads += 1
+        print(f"Loaded model {spec.name} in {slot.load_seconds}s ({slot.nbytes / 2**20:.0f} MiB)")
+        self._evict_to_fit(0, keep=spec.name)
+
+    def reset_backoff(self, name: str) -> None:
+        """Allow the next load of `name` right away (e.g. after fixing what made it fail)."""
+        slot = self._slots[self.resolve(name)]
+        slot.failures, slot.failed_at = 0, None
+
+    def unload(self, name: str) -> bool:
+        """Unload a resident model; returns False if it was not loaded."""
+        slot = self._slots[self.resolve(name)]
+        with slot.lock:
+            return self._unload_slot(slot)
+
+    def _unload_slot(self, slot: _Slot) -> bool:
+        model, slot.model = slot.model, None
+        if model is None:
+            return False
+        if slot.spec.unload is not None:
+            try:
+                slot.spec.unload(model)
+            except Exception as e:
+                print(f"Error unloading model {slot.spec.name}: {e}")
+        del model
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except Exception:
+            pass
+        print(f"Unloaded model {slot.spec.name}")
+        return True
+
+    def resident_bytes(self) -> int:
+        return sum(slot.nbytes for slot in list(self._slots.values()) if slot.model is not None)
+
+    def _evict_to_fit(self, incoming_bytes: int, keep: str) -> None:
+        """Unload least recently used models until `incoming_bytes` more fit the budget."""
+        if self.budget_bytes <= 0:
+            return
+        while self.resident_bytes() + incoming_bytes > self.budget_bytes:
+            with self._lock:
+                candidates = sorted(
+                    (slot for name, slot in self._slots.items() if name != keep and slot.model is not None),
+                    key=lambda slot: slot.last_used,
+                )
+            evicted = False
+            for slot in candidates:
+                # skip models that are busy loading/unloading instead of waiting on them
+                if slot.lock.acquire(blocking=False):
+                    try:
+                        evicted = self._unload_slot(slot)
+                    finally:
+                        slot.lock.release()
+                if evicted:
+                    self.evictions += 1
+                    break
+            if not evicted:
+                return  # nothing left to evict; the budget is exceeded by a single model
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "name": name,
+                "aliases": list(slot.spec.aliases),
+                "state": slot.state,
+                "loaded": slot.model is not None,
+                "resident_mb": round(slot.nbytes / 2**20, 1) if slot.model is not None else 0.0,
+                "idle_seconds": round(now - slot.last_used, 1) if slot.model is not None else None,
+                "load_seconds": slot.load_seconds,
+                "error": slot.error,
+                "retry_in": round(slot.backoff_remaining(), 1) if slot.model is None and slot.failures else None,
+            }
+            for name, slot in list(self._slots.items())
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budget_mb": round(self.budget_bytes / 2**20, 1) if self.budget_bytes > 0 else None,
+            "resident_mb": round(self.resident_bytes() / 2**20, 1),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "models": self.status(),
+        }
@@ -0,0 +1,402 @@
+"""Prompt building for /predict and /chat: per-model formats and a token budget.
+
+`PromptBuilder` renders a system prompt and conversation turns in one
+model's format and produces the token ids directly from cached segments:
+
+- the role markers come from the tokenizer's chat template (rendered once
+  with placeholder messages); tokenizers without a usable template fall
+  back to the plain "System: / User: / Assistant:" format
+- every segment (markers, system prompts, earlier turns, search context)
+  is tokenized once and its ids are kept in an LRU, so a request only
+  tokenizes text it has not seen before, usually just the new user turn
+- `system_ids` gives the exact ids a prompt starts with, which is what the
+  prefix KV cache of `ModelWrapper` is keyed on
+
+`prompt_builders` holds one builder per model name (PROMPT_FORMATS can
+force the plain format for a model).
+
+`assemble_prompt` fits a prompt into a prefill budget:
+
+- the system prompt and the latest user turn are always kept
+- search results are added in rank order; lower-ranked ones that do not
+  fit are dropped
+- earlier turns are added newest first; the oldest one that only partly
+  fits is truncated from the front, older ones are dropped
+
+The budget is PROMPT_TOKEN_BUDGET, lowered where needed so that the
+model's context window still has room for the requested new tokens.
+Prefill cost grows with prompt length, so this also bounds latency on
+long chats.
+"""
+
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from .cache import LRUCache
+except Exception:
+    from cache import LRUCache
+
+# max prompt (prefill) tokens
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2048"))
+# a partly fitting turn is kept only if at least this many of its tokens fit
+PROMPT_MIN_TURN_TOKENS = int(os.getenv("PROMPT_MIN_TURN_TOKENS", "32"))
+# tokenized segments (system prompts, turns, context blocks) kept per builder
+PROMPT_SEGMENT_CACHE_SIZE = int(os.getenv("PROMPT_SEGMENT_CACHE_SIZE", "4096"))
+# models that use the plain format instead of their chat template, e.g. "qwen=plain"
+PROMPT_FORMATS = dict(
+    entry.split("=", 1) for entry in os.getenv("PROMPT_FORMATS", "").split(",") if "=" in entry
+)
+# rough characters per token when the model has no tokenizer (dry-run)
+_CHARS_PER_TOKEN = 4
+
+ROLES = ("system", "user", "assistant")
+PLAIN_MARKERS = {
+    "system_open": "System: ", "system_close": "\n",
+    "user_open": "User: ", "user_close": "\n",
+    "assistant_open": "Assistant: ", "assistant_close": "\n",
+    "generation": "Assistant:",
+}
+# text put in front of a segment so it is tokenized as in the middle of a prompt
+_ANCHOR = "\n"
+_SLOTS = {"system": "<<SOFAI_SYSTEM>>", "user": "<<SOFAI_USER>>", "assistant": "<<SOFAI_ASSISTANT>>"}
+
+
+def chat_template_markers(tokenizer) -> Optional[Dict[str, str]]:
+    """Role markers of `tokenizer`'s chat template, or None if it has no usable one.
+
+    The template is rendered for growing placeholder conversations; each
+    message must add exactly `<role open> content <role close>` to the
+    text (true for ChatML, Zephyr/TinyLlama and most instruct models).
+    Templates that reject a system message or rewrite earlier turns are
+    not supported and use the plain format instead.
+    """
+    if tokenizer is None or not getattr(tokenizer, "chat_template", None):
+        return None
+    messages = [{"role": role, "content": _SLOTS[role]} for role in ("system", "user", "assistant", "user")]
+    try:
+        rendered = [tokenizer.apply_chat_template(messages[:n], tokenize=False) for n in range(1, 5)]
+        with_generation = tokenizer.apply_chat_template(messages[:2], tokenize=False, add_generation_prompt=True)
+    except Exception:
+        return None
+
+    markers: Dict[str, str] = {}
+    previous = ""
+    for message, text in zip(messages, rendered):
+        if not text.startswith(previous):
+            return None
+        opened, slot, closed = text[len(previous):].partition(message["content"])
+        if not slot:
+            return None
+        if f"{message['role']}_open" in markers:
+            # the second user turn must look like the first
+            if (opened, closed) != (markers["user_open"], markers["user_close"]):
+                return None
+        markers[f"{message['role']}_open"], markers[f"{message['role']}_close"] = opened, closed
+        previous = text
+    if not with_generation.startswith(rendered[1]):
+        return None
+    markers["generation"] = with_generation[len(rendered[1]):]
+    return markers
+
+
+class TokenCounter:
+    """Counts and truncates text in tokens of `tokenizer` (or estimates without one)."""
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+
+    def _ids(self, text: str) -> List[int]:
+        return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return math.ceil(len(text) / _CHARS_PER_TOKEN)
+        return len(self._ids(text))
+
+    def keep_last(self, text: str, max_tokens: int) -> str:
+        """The end of `text`, at most `max_tokens` long."""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[-max_tokens * _CHARS_PER_TOKEN:]
+        return self.tokenizer.decode(self._ids(text)[-max_tokens:], skip_special_tokens=True)
+
+
+class PromptBuilder(TokenCounter):
+    """Builds prompt text and token ids in one model's format from cached segments.
+
+    Segments are tokenized on their own and their ids concatenated, like
+    `apply_chat_template` output split at message boundaries. This can
+    differ from tokenizing the whole string where a merge would cross a
+    boundary, but decodes to the same text. SentencePiece-style tokenizers
+    (Metaspace) prepend a "▁" to every string they tokenize; every segment
+    but the first is therefore tokenized behind a newline whose ids
+    are dropped again, so it gets the ids it has in the middle of a prompt.
+    """
+
+    def __init__(self, tokenizer=None, markers: Optional[Dict[str, str]] = None, cache_size: int = PROMPT_SEGMENT_CACHE_SIZE):
+        super().__init__(tokenizer)
+        self.uses_chat_template = markers is not None
+        self.markers = markers or PLAIN_MARKERS
+        self._segments = LRUCache(cache_size)
+        # the plain format is tokenized like before, with the tokenizer's BOS etc.;
+        # chat templates already spell out their special tokens
+        self.leading_ids: List[int] = []
+        if tokenizer is not None and not self.uses_chat_template:
+            with_special = tokenizer("x")["input_ids"]
+            without = tokenizer("x", add_special_tokens=False)["input_ids"]
+            if without and with_special[-len(without):] == without:
+                self.leading_ids = with_special[:len(with_special) - len(without)]
+        # set for tokenizers that tokenize a segment differently at the start of a string
+        self._anchor_ids: Optional[List[int]] = None
+        if tokenizer is not None:
+            anchor = self._encode(_ANCHOR)
+            anchored = self._encode(_ANCHOR + "x")
+            if anchor and anchored[:len(anchor)] == anchor and anchored[len(anchor):] != self._encode("x"):
+                self._anchor_ids = anchor
+
+    @classmethod
+    def for_tokenizer(cls, tokenizer) -> "PromptBuilder":
+        """Builder for the tokenizer's chat template, or the plain format without one."""
+        return cls(tokenizer, chat_template_markers(tokenizer))
+
+    @classmethod
+    def plain(cls, tokenizer) -> "PromptBuilder":
+        return cls(tokenizer, None)
+
+    def _encode(self, text: str) -> List[int]:
+        return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def _ids(self, text: str, first: bool = False) -> List[int]:
+        """Ids of `text` in the middle of a prompt, or at its start if `first`."""
+        key = (text, first and self._anchor_ids is not None)
+        ids = self._segments.get(key)
+        if ids is None:
+            ids = self._encode(text)
+            if self._anchor_ids is not None and not first:
+                anchored = self._encode(_ANCHOR + text)
+                if anchored[:len(self._anchor_ids)] == self._anchor_ids:
+                    ids = anchored[len(self._anchor_ids):]
+            self._segments.set(key, ids)
+        return ids
+
+    @staticmethod
+    def role(role: str) -> str:
+        """History roles other than user/system ("bot", "model", ...) are the assistant."""
+        role = (role or "").lower()
+        return role if role in ROLES else "assistant"
+
+    @property
+    def stop_sequences(self) -> List[str]:
+        """Text that starts a new turn; generation should stop when the model writes it."""
+        stops = []
+        for role in ROLES:
+            marker = self.markers[f"{role}_open"].strip()
+            if marker:
+                stops.append(marker if self.uses_chat_template else "\n" + marker)
+        return stops
+
+    def _pieces(self, system_parts: Sequence[str], turns: Sequence[Tuple[str, str]]) -> List[str]:
+        pieces = [self.markers["system_open"], *[p for p in system_parts if p], self.markers["system_close"]]
+        for role, text in turns:
+            role = self.role(role)
+            pieces += [self.markers[f"{role}_open"], text, self.markers[f"{role}_close"]]
+        pieces.append(self.markers["generation"])
+        return pieces
+
+    def build(self, system_parts: Sequence[str], turns: Sequence[Tuple[str, str]]) -> Tuple[str, Optional[List[int]]]:
+        """Prompt text and ids (None without a tokenizer) for `(role, text)` turns.
+
+        `system_parts` are concatenated into the system message (e.g. the
+        static system prompt and this request's search context) and are
+        tokenized separately so the static part stays cached.
+        """
+        pieces = self._pieces(system_parts, turns)
+        text = "".join(pieces)
+        if self.tokenizer is None:
+            return text, None
+        ids = list(self.leading_ids)
+        for piece in pieces:
+            if piece:
+                ids.extend(self._ids(piece, first=len(ids) == len(self.leading_ids)))
+        return text, ids
+
+    def system_ids(self, system_prompt: str) -> List[int]:
+        """Ids every prompt with this system prompt starts with (for the prefix KV cache)."""
+        opening = self._ids(self.markers["system_open"], first=True)
+        return list(self.leading_ids) + opening + self._ids(system_prompt, first=not opening)
+
+    def turn_tokens(self, role: str, text: str) -> int:
+        role = self.role(role)
+        return self.count(self.markers[f"{role}_open"]) + self.count(text) + self.count(self.markers[f"{role}_close"])
+
+
+class PromptBuilderRegistry:
+    """One `PromptBuilder` per model name, rebuilt when the model (tokenizer) is reloaded."""
+
+    def __init__(self, formats: Optional[Dict[str, str]] = None):
+        self._factories: Dict[str, Callable[[Any], PromptBuilder]] = {}
+        self._builders: Dict[str, PromptBuilder] = {}
+        self._lock = threading.Lock()
+        for name, fmt in (formats or {}).items():
+            if fmt.strip().lower() == "plain":
+                self.register(name, PromptBuilder.plain)
+
+    def register(self, name: str, factory: Callable[[Any], PromptBuilder]) -> None:
+        """Use `factory(tokenizer)` instead of the chat template for model `name`."""
+        with self._lock:
+            self._factories[name] = factory
+            self._builders.pop(name, None)
+
+    def get(self, name: str, model) -> PromptBuilder:
+        tokenizer = getattr(model, "tokenizer", None)
+        builder = self._builders.get(name)
+        if builder is None or builder.tokenizer is not tokenizer:
+            with self._lock:
+                builder = self._builders.get(name)
+                if builder is None or builder.tokenizer is not tokenizer:
+                    builder = self._factories.get(name, PromptBuilder.for_tokenizer)(tokenizer)
+                    self._builders[name] = builder
+        return builder
+
+
+prompt_builders = PromptBuilderRegistry(PROMPT_FORMATS)
+
+
+def context_window(model) -> Optional[int]:
+    """Max sequence length of a `ModelWrapper`'s model, if its config says."""
+    config = getattr(getattr(model, "model", None), "config", None)
+    return getattr(config, "max_position_embeddings", None)
+
+
+def prompt_budget(model, max_new_tokens: int, budget: int = PROMPT_TOKEN_BUDGET) -> int:
+    """Prompt tokens allowed for `model` when up to `max_new_tokens` are generated.
+
+    At most half of the context window is reserved for the reply, so a
+    large `max_tokens` cannot squeeze the prompt down to nothing.
+    """
+    window = context_window(model)
+    if window:
+        budget = min(budget, window - min(max_new_tokens, window // 2))
+    return max(1, budget)
+
+
+def reply_budget(model, prompt_tokens: int, max_new_tokens: int) -> int:
+    """`max_new_tokens` clamped to what is left of the context window after the prompt.
+
+    A prompt shorter than its budget leaves the reply its full
+    `max_new_tokens`, but one that filled the budget (or a model whose
+    window is smaller than the budget assumed) must not generate past the
+    window.
+    """
+    window = context_window(model)
+    if window:
+        max_new_tokens = min(max_new_tokens, window - prompt_tokens)
+    return max(1, max_new_tokens)
+
+
+@dataclass
+class AssembledPrompt:
+    prompt: str
+    ids: Optional[List[int]]
+    tokens: int
+    budget: int
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    results: List[Dict[str, str]] = field(default_factory=list)
+    dropped_turns: int = 0
+    truncated_turn: bool = False
+    dropped_results: int = 0
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "tokens": self.tokens,
+            "budget": self.budget,
+            "dropped_turns": self.dropped_turns,
+            "truncated_turn": self.truncated_turn,
+            "dropped_results": self.dropped_results,
+        }
+
+
+def assemble_prompt(
+    builder: PromptBuilder,
+    system_prompt: str,
+    turns: Sequence[Tuple[str, str]],
+    budget: int,
+    search_results: Sequence[Dict[str, str]] = (),
+    format_context: Optional[Callable[[List[Dict[str, str]]], str]] = None,
+    context_title: str = "Web Search Results",
+) -> AssembledPrompt:
+    """Fit `(role, text)` turns (oldest first, the last one is the new user
+    turn) and ranked `search_results` into `budget` tokens.
+
+    Kept search results are formatted by `format_context` and appended to
+    the system message under `context_title`.
+    """
+    turns = list(turns)
+    latest, older = turns[-1:], turns[:-1]
+    results = list(search_results) if format_context is not None else []
+
+    def _context(kept_results: List[Dict[str, str]]) -> str:
+        return f"\n\n{context_title}:\n{format_context(kept_results)}" if kept_results else ""
+
+    def _build(kept_results: List[Dict[str, str]], kept_turns: List[Tuple[str, str]]) -> Tuple[str, Optional[List[int]], int]:
+        text, ids = builder.build([system_prompt, _context(kept_results)], kept_turns)
+        return text, ids, len(ids) if ids is not None else builder.count(text)
+
+    used = _build([], latest)[2]
+
+    # search results in rank order; each adds the tokens of its part of the context block
+    kept_results: List[Dict[str, str]] = []
+    context_tokens = 0
+    for result in results:
+        with_result = builder.count(_context(kept_results + [result]))
+        if used + with_result - context_tokens > budget:
+            break
+        kept_results.append(result)
+        used += with_result - context_tokens
+        context_tokens = with_result
+
+    # earlier turns, newest first
+    kept_turns: List[Tuple[str, str]] = []
+    truncated = False
+    for role, text in reversed(older):
+        cost = builder.turn_tokens(role, text)
+        if used + cost <= budget:
+            kept_turns.insert(0, (role, text))
+            used += cost
+            continue
+        room = budget - used - builder.turn_tokens(role, "")
+        if room >= PROMPT_MIN_TURN_TOKENS:
+            kept_turns.insert(0, (role, builder.keep_last(text, room)))
+            truncated = True
+        break
+
+    # segment counts are exact with a tokenizer but estimates without one (and
+    # truncated text may re-tokenize differently): drop the oldest turn /
+    # lowest-ranked result until the built prompt fits
+    prompt, ids, tokens = _build(kept_results, kept_turns + latest)
+    while tokens > budget and (kept_turns or kept_results):
+        if kept_turns:
+            kept_turns.pop(0)
+            truncated = False
+        else:
+            kept_results.pop()
+        prompt, ids, tokens = _build(kept_results, kept_turns + latest)
+
+    return AssembledPrompt(
+        prompt=prompt,
+        ids=ids,
+        tokens=tokens,
+        budget=budget,
+        turns=kept_turns + latest,
+        results=kept_results,
+        dropped_turns=len(older) - len(kept_turns),
+        truncated_turn=truncated,
+        dropped_results=len(results) - len(kept_results),
+    )
@@ -0,0 +1,132 @@
+"""CPU weight quantization for ModelWrapper (MODEL_CPU_QUANTIZE).
+
+- "int8": dynamic int8 quantization of every `nn.Linear` (weights stored as
+  int8, activations quantized per batch at run time) via
+  `torch.ao.quantization.quantize_dynamic`; no extra dependency
+- "int4": weight-only int4 with per-group scales via torchao
+  (pip install torchao); activations stay in float
+
+Quantizing takes a while and needs the full-precision weights, so the
+quantized model is saved under MODEL_QUANTIZED_DIR and later loads read it
+from there directly. The files are pickled modules: only point
+MODEL_QUANTIZED_DIR at a directory you trust.
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import Optional
+
+try:
+    import torch
+except Exception:  # pragma: no cover - allow import-time availability to be optional
+    torch = None
+
+QUANTIZE_MODES = ("int8", "int4")
+MODEL_QUANTIZED_DIR = os.getenv("MODEL_QUANTIZED_DIR") or str(Path.home() / ".cache" / "sofai" / "quantized")
+# group size for int4 weight scales
+MODEL_INT4_GROUP_SIZE = int(os.getenv("MODEL_INT4_GROUP_SIZE", "32"))
+
+
+def normalize_mode(mode: Optional[str]) -> Optional[str]:
+    """Map an env/config value to "int8", "int4" or None (full precision)."""
+    mode = (mode or "").strip().lower()
+    if mode in ("", "none", "false", "0", "fp32"):
+        return None
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Unsupported CPU quantization mode {mode!r}; use one of {QUANTIZE_MODES}")
+    return mode
+
+
+def quantize_model(model, mode: str):
+    """Quantize the linear layers of `model` in place and return it."""
+    if mode == "int8":
+        from torch.ao.quantization import quantize_dynamic
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if mode == "int4":
+        try:
+            from torchao.quantization import IntxWeightOnlyConfig, PerGroup, quantize_
+        except ImportError as e:
+            raise ImportError("int4 CPU quantization needs torchao: pip install torchao") from e
+        quantize_(model, IntxWeightOnlyConfig(weight_dtype=torch.int4, granularity=PerGroup(MODEL_INT4_GROUP_SIZE)))
+        # torchao patches a functools.partial in as extra_repr, which cannot be pickled
+        for module in model.modules():
+            module.__dict__.pop("extra_repr", None)
+        return model
+    raise ValueError(f"Unsupported CPU quantization mode {mode!r}")
+
+
+def checkpoint_path(model_name: str, revision: Optional[str], mode: str, cache_dir: Optional[str] = MODEL_QUANTIZED_DIR) -> Optional[Path]:
+    """Where the quantized model is cached; None disables the cache.
+
+    The file is a pickled module, so the key includes the torch and
+    transformers versions: after upgrading either, the model is quantized
+    again instead of unpickling classes that may have changed.
+    """
+    if not cache_dir:
+        return None
+    import transformers
+
+    safe = re.sub(r"[^A-Za-z0-9._-]+", "--", model_name.strip("/"))
+    versions = f"torch{torch.__version__.split('+')[0]}-transformers{transformers.__version__}"
+    return Path(cache_dir) / f"{safe}@{revision or 'main'}-{mode}-{versions}.pt"
+
+
+def load_checkpoint(path: Optional[Path]):
+    """Return the cached quantized model at `path`, or None."""
+    if path is None or not path.exists():
+        return None
+    try:
+        model = torch.load(path, map_location="cpu", weights_only=False)
+    except Exception as e:
+        print(f"Ignoring unreadable quantized checkpoint {path}: {e}")
+        return None
+    model.eval()
+    return model
+
+
+def save_checkpoint(model, path: Optional[Path]) -> None:
+    if path is None:
+        return
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save(model, tmp)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"Could not cache quantized checkpoint {path}: {e}")
+        tmp.unlink(missing_ok=True)
+
+
+def module_nbytes(model) -> int:
+    """Bytes held by a module's weights, including quantized packed params."""
+    seen = set()
+    total = 0
+
+    def _add(value):
+        nonlocal total
+        if isinstance(value, (tuple, list)):
+            for item in value:
+                _add(item)
+            return
+        if not isinstance(value, torch.Tensor):
+            return
+        try:
+            key = (value.data_ptr(), value.dtype, tuple(value.shape))
+        except Exception:
+            key = id(value)
+        if key in seen:
+            return  # tied weights (e.g. lm_head / embeddings) count once
+        seen.add(key)
+        flatten = getattr(value, "__tensor_flatten__", None)
+        if flatten is not None:  # torchao tensor subclasses keep their data in inner tensors
+            names, _ = flatten()
+            for name in names:
+                _add(getattr(value, name))
+            return
+        total += value.numel() * value.element_size()
+
+    # state_dict (unlike parameters()) includes the packed weights of quantized linears
+    for value in model.state_dict(keep_vars=True).values():
+        _add(value)
+    return total
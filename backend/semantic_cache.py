@@ -0,0 +1,247 @@
+"""Semantic reply cache for near-duplicate questions.
+
+Messages are embedded with a sentence-embedding model (SEMANTIC_CACHE_MODEL,
+all-MiniLM-L6-v2 by default, mean-pooled and L2-normalised), so paraphrases
+such as "what's sofai" and "tell me about SofAi" land close together even
+when they share few words. The model loads on a background thread the first
+time the cache is used; until it is ready (or if it cannot be loaded) every
+lookup is a miss, so the cache never answers from a guess.
+
+Sentence embeddings still score a question and its negation, or the same
+words with their roles swapped ("list to string" vs "string to list"), as
+near-identical. A candidate above the threshold is therefore also rejected
+when the two questions differ in negation or use the same content words in
+a different order.
+
+Embeddings live in one preallocated NumPy matrix; a lookup is a single
+matrix-vector product. When the index is full, the least recently used (or
+expired) slot is reused. `scripts/calibrate_semantic_cache.py` scores
+labelled question pairs to pick SEMANTIC_CACHE_THRESHOLD for a model.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - allow import-time availability to be optional
+    np = None
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "true").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "4096"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+# answers grounded in live web results go stale much sooner
+SEMANTIC_CACHE_SEARCH_TTL = float(os.getenv("SEMANTIC_CACHE_SEARCH_TTL", "600"))
+# candidates above the threshold checked against the negation / word-order guard
+_MAX_CANDIDATES = 5
+
+_CONTRACTIONS = {
+    "what's": "what is", "who's": "who is", "where's": "where is", "how's": "how is",
+    "it's": "it is", "that's": "that is", "whats": "what is", "whos": "who is",
+    "can't": "cannot", "won't": "will not", "i'm": "i am", "you're": "you are",
+    "dont": "do not", "doesnt": "does not", "isnt": "is not", "cant": "cannot",
+}
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_NEGATIONS = {"not", "no", "never", "none", "nothing", "nobody", "neither", "nor", "without", "cannot"}
+_STOPWORDS = {
+    "a", "an", "the", "i", "you", "me", "my", "your", "we", "it", "is", "are", "was", "were", "be",
+    "do", "does", "did", "can", "could", "should", "would", "will", "to", "of", "in", "on", "for",
+    "at", "by", "with", "from", "into", "about", "and", "or", "what", "how", "who", "why", "when",
+    "where", "which", "that", "this", "there", "please", "tell", "explain",
+}
+
+
+def normalize(text: str) -> str:
+    words = []
+    for w in text.lower().replace("’", "'").split():
+        if w in _CONTRACTIONS:
+            w = _CONTRACTIONS[w]
+        elif w.endswith("n't"):
+            w = w[:-3] + " not"
+        words.append(w)
+    return " ".join(_TOKEN_RE.findall(" ".join(words)))
+
+
+def conflicts(a: str, b: str) -> bool:
+    """True if two questions that embed closely still ask different things.
+
+    That is the case when only one of them is negated, or when they use
+    the same content words in a different order ("convert a list to a
+    string" vs "convert a string to a list").
+    """
+    wa, wb = normalize(a).split(), normalize(b).split()
+    if sorted(w for w in wa if w in _NEGATIONS) != sorted(w for w in wb if w in _NEGATIONS):
+        return True
+    ca = [w for w in wa if w not in _STOPWORDS and w not in _NEGATIONS]
+    cb = [w for w in wb if w not in _STOPWORDS and w not in _NEGATIONS]
+    return ca != cb and sorted(ca) == sorted(cb)
+
+
+class SentenceEmbedder:
+    """Mean-pooled, L2-normalised sentence embeddings from a transformers encoder.
+
+    `ready()` starts loading the model on a background thread and returns
+    False until it can embed; a model that fails to load is not retried.
+    """
+
+    def __init__(self, model_name: str = SEMANTIC_CACHE_MODEL, local_files_only: bool = False):
+        self.model_name = model_name
+        self.local_files_only = local_files_only
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+        self._loading: Optional[threading.Thread] = None
+        self.error: Optional[str] = None
+
+    def load(self) -> bool:
+        """Load the model on the calling thread; True if it is usable."""
+        try:
+            from transformers import AutoModel, AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name, local_files_only=self.local_files_only)
+            model = AutoModel.from_pretrained(self.model_name, local_files_only=self.local_files_only).eval()
+        except Exception as e:
+            self.error = str(e)
+            print(f"Semantic cache disabled: could not load embedding model {self.model_name}: {e}")
+            return False
+        self._tokenizer, self._model = tokenizer, model
+        return True
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def ready(self) -> bool:
+        if self._model is not None:
+            return True
+        with self._lock:
+            if self._loading is None and self.error is None:
+                self._loading = threading.Thread(target=self.load, name="sofai-embedder", daemon=True)
+                self._loading.start()
+        return False
+
+    def __call__(self, text: str):
+        import torch
+
+        inputs = self._tokenizer(text, return_tensors="pt", truncation=True, max_length=256)
+        with torch.inference_mode():
+            hidden = self._model(**inputs).last_hidden_state[0]
+        mask = inputs["attention_mask"][0].unsqueeze(-1).to(hidden.dtype)
+        vec = ((hidden * mask).sum(0) / mask.sum().clamp(min=1)).float().numpy()
+        length = np.linalg.norm(vec)
+        return (vec / length if length else vec).astype(np.float32)
+
+
+class SemanticCache:
+    """Fixed-capacity cosine-similarity index from questions to stored replies.
+
+    `embedder` maps a question to an L2-normalised vector; it may expose
+    `ready()`, and the cache stays empty while that returns False.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL, enabled: bool = SEMANTIC_CACHE_ENABLED, embedder: Optional[Callable[[str], Any]] = None):
+        self.enabled = enabled and np is not None
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.embedder = embedder if embedder is not None else SentenceEmbedder()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0  # candidates above the threshold that failed the negation / word-order guard
+        # allocated on the first add, once the embedding size is known
+        self._vectors = None
+        self._namespace_ids: Dict[str, int] = {}
+
+    def _ready(self) -> bool:
+        if not self.enabled:
+            return False
+        ready = getattr(self.embedder, "ready", None)
+        return ready() if ready is not None else True
+
+    def _allocate(self, dim: int) -> None:
+        self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._namespaces = np.full(self.max_entries, -1, dtype=np.int32)  # -1 marks a free slot
+        self._expires = np.zeros(self.max_entries, dtype=np.float64)
+        self._last_used = np.zeros(self.max_entries, dtype=np.float64)
+        self._texts: List[str] = [""] * self.max_entries
+        self._values: List[Optional[Dict[str, Any]]] = [None] * self.max_entries
+
+    def lookup(self, namespace: str, text: str) -> Optional[Dict[str, Any]]:
+        """Return the stored value for the most similar cached question, if close enough."""
+        if not self._ready():
+            return None
+        query = self.embedder(text)
+        now = time.time()
+        with self._lock:
+            ns = self._namespace_ids.get(namespace)
+            if ns is None or self._vectors is None:
+                self.misses += 1
+                return None
+            scores = self._vectors @ query
+            valid = (self._namespaces == ns) & (self._expires > now)
+            scores = np.where(valid, scores, -1.0)
+            for slot in np.argsort(-scores)[:_MAX_CANDIDATES]:
+                slot = int(slot)
+                if scores[slot] < self.threshold:
+                    break
+                if conflicts(text, self._texts[slot]):
+                    self.rejected += 1
+                    continue
+                self._last_used[slot] = now
+                self.hits += 1
+                return dict(self._values[slot], similarity=round(float(scores[slot]), 4))
+            self.misses += 1
+            return None
+
+    def add(self, namespace: str, text: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        if not self._ready():
+            return
+        vector = self.embedder(text)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None:
+                self._allocate(vector.shape[0])
+            ns = self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+            # the same question again replaces its old entry instead of taking a new slot
+            same = np.where((self._namespaces == ns) & (self._expires > now), self._vectors @ vector, -1.0)
+            slot = int(np.argmax(same))
+            if same[slot] < 0.999:
+                # reuse a free or expired slot, else evict the least recently used one
+                stale = np.where(self._expires <= now, -np.inf, self._last_used)
+                slot = int(np.argmin(stale))
+                if self._namespaces[slot] != -1 and self._expires[slot] > now:
+                    self.evictions += 1
+            self._vectors[slot] = vector
+            self._namespaces[slot] = ns
+            self._expires[slot] = now + (self.ttl if ttl is None else ttl)
+            self._last_used[slot] = now
+            self._texts[slot] = text
+            self._values[slot] = dict(value)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        entries = int(np.count_nonzero(self._expires > time.time())) if self._vectors is not None else 0
+        return {
+            "enabled": self.enabled,
+            "model": getattr(self.embedder, "model_name", None),
+            "model_ready": self.enabled and getattr(self.embedder, "loaded", True),
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+# Global semantic cache instance
+semantic_cache = SemanticCache()
@@ -0,0 +1,115 @@
+"""Assisted (speculative) decoding options for ModelWrapper.
+
+Two ways to propose tokens that the model then verifies in a single
+forward pass, both through HF `generate`:
+
+- "draft": a small model of the same family (SPECULATIVE_DRAFT_MODELS)
+  drafts a few tokens ahead (`assistant_model=`)
+- "lookup": n-gram prompt lookup proposes the tokens that followed the
+  last few generated tokens in the prompt (`prompt_lookup_num_tokens=`);
+  pays off when answers copy from the prompt, e.g. web search context
+
+Accepted tokens are exactly the ones the model would have produced itself
+(greedy) or are accepted by speculative sampling, so the output
+distribution does not change. `SpeculationStats` counts proposed and
+accepted tokens per generation; `speculation_stats` aggregates them per
+model and mode for the API.
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+SPECULATIVE_MODES = ("draft", "lookup")
+# default for requests that do not choose a mode: "off", "draft" or "lookup"
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "off").lower()
+# draft model per target model id, e.g. "Qwen/Qwen2.5-7B-Instruct=Qwen/Qwen2.5-0.5B-Instruct"
+SPECULATIVE_DRAFT_MODELS = dict(
+    entry.split("=", 1) for entry in os.getenv("SPECULATIVE_DRAFT_MODELS", "").split(",") if "=" in entry
+)
+# tokens proposed per prompt-lookup step, and the longest n-gram matched against the prompt
+SPECULATIVE_LOOKUP_TOKENS = int(os.getenv("SPECULATIVE_LOOKUP_TOKENS", "10"))
+SPECULATIVE_LOOKUP_NGRAM = int(os.getenv("SPECULATIVE_LOOKUP_NGRAM", "3"))
+
+
+def normalize_speculation(mode: Optional[str]) -> Optional[str]:
+    """Map a request/env value to "draft", "lookup" or None (plain decoding)."""
+    mode = (mode or "").strip().lower()
+    if mode in ("", "off", "none", "false", "0"):
+        return None
+    if mode not in SPECULATIVE_MODES:
+        raise ValueError(f"Unsupported speculative decoding mode {mode!r}; use one of {SPECULATIVE_MODES} or 'off'")
+    return mode
+
+
+class SpeculationStats:
+    """Stopping criterion that never stops; counts proposed and accepted tokens instead.
+
+    Assisted generation calls the stopping criteria twice per step: first
+    with the candidate sequence (prompt + accepted + proposed tokens), then
+    with the sequence after verification, which keeps the accepted
+    proposals plus one token from the model itself. Kept free of
+    torch/transformers imports so the API can read the totals cheaply.
+    """
+
+    def __init__(self, mode: str, prompt_len: int):
+        self.mode = mode
+        self.length = prompt_len
+        self.steps = 0
+        self.proposed = 0
+        self.accepted = 0
+        self.generated = 0
+        self._candidate = True
+
+    def __call__(self, input_ids, scores, **kwargs):
+        length = input_ids.shape[-1]
+        if self._candidate:
+            self.proposed += length - self.length
+        else:
+            self.steps += 1
+            self.generated += length - self.length
+            self.accepted += max(0, length - self.length - 1)
+            self.length = length
+        self._candidate = not self._candidate
+        return input_ids.new_zeros((input_ids.shape[0],)).bool()
+
+
+class SpeculationTracker:
+    """Running totals of `SpeculationStats` per (model, mode)."""
+
+    _FIELDS = ("steps", "generated", "proposed", "accepted")
+
+    def __init__(self):
+        self._totals: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, stats: SpeculationStats) -> None:
+        with self._lock:
+            totals = self._totals.setdefault((model_name, stats.mode), dict.fromkeys(("requests",) + self._FIELDS, 0))
+            totals["requests"] += 1
+            for field in self._FIELDS:
+                totals[field] += getattr(stats, field)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            items = [(key, dict(totals)) for key, totals in self._totals.items()]
+        return {
+            "default_mode": SPECULATIVE_MODE,
+            "draft_models": dict(SPECULATIVE_DRAFT_MODELS),
+            "models": [
+                {
+                    "model": model_name,
+                    "mode": mode,
+                    "requests": t["requests"],
+                    "generated_tokens": t["generated"],
+                    "proposed_tokens": t["proposed"],
+                    "accepted_tokens": t["accepted"],
+                    "acceptance_rate": round(t["accepted"] / t["proposed"], 3) if t["proposed"] else None,
+                    "tokens_per_step": round(t["generated"] / t["steps"], 2) if t["steps"] else None,
+                }
+                for (model_name, mode), t in items
+            ],
+        }
+
+
+speculation_stats = SpeculationTracker()
@@ -1,27 +1,838 @@
-"""In-memory chat storage for simple session-based histories.
+"""Chat storage for session-based histories.
 
-This is a lightweight implementation for local testing. Replace with a
-persistent store (Redis, Supabase, Postgres) for production use.
+Backends (CHAT_STORE_BACKEND):
+
+- "memory" (default): `MemoryChatStore`, in this process only
+- "sqlite": `SqliteChatStore`, a WAL-mode SQLite file shared by every
+  worker process on the host
+- "redis": `RedisChatStore`, any server speaking the Redis protocol,
+  shared across hosts
+
+The shared backends buffer writes and flush them in batches (every
+CHAT_STORE_FLUSH_INTERVAL seconds or CHAT_STORE_BATCH_SIZE messages); a
+worker always sees its own writes because reads flush first. While the
+backend is unreachable at most CHAT_STORE_MAX_PENDING messages stay queued.
+
+Sessions are bounded so a long-running server does not grow without
+limit:
+
+- each session keeps its last CHAT_STORE_MAX_MESSAGES messages (a ring
+  buffer; older ones are dropped as new ones arrive)
+- sessions idle for CHAT_STORE_SESSION_TTL seconds expire
+- when all sessions together exceed CHAT_STORE_MEMORY_MB (or there are
+  more than CHAT_STORE_MAX_SESSIONS), the least recently used sessions are
+  evicted
+
+Every message gets a per-session sequence number, so histories can be read
+a page at a time with a cursor that stays valid while older messages are
+dropped. `ChatStore` keeps its classmethod API on top of the configured
+backend. The memory budget applies to the memory backend; the shared ones
+bound sessions by count, message cap and TTL.
 """
 
-from typing import List, Dict, Any
+import asyncio
+import atexit
+import json
+import os
+import select
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+CHAT_STORE_MAX_MESSAGES = int(os.getenv("CHAT_STORE_MAX_MESSAGES", "200"))
+CHAT_STORE_MAX_SESSIONS = int(os.getenv("CHAT_STORE_MAX_SESSIONS", "10000"))
+CHAT_STORE_MEMORY_MB = float(os.getenv("CHAT_STORE_MEMORY_MB", "64"))
+# idle seconds before a session expires; 0 keeps sessions until they are evicted
+CHAT_STORE_SESSION_TTL = float(os.getenv("CHAT_STORE_SESSION_TTL", "21600"))
+CHAT_STORE_PAGE_SIZE = int(os.getenv("CHAT_STORE_PAGE_SIZE", "50"))
+CHAT_STORE_BACKEND = os.getenv("CHAT_STORE_BACKEND", "memory").lower()
+CHAT_STORE_SQLITE_FILE = Path(os.getenv("CHAT_STORE_SQLITE_FILE", str(Path(__file__).parent / "data" / "chat_store.db")))
+CHAT_STORE_REDIS_URL = os.getenv("CHAT_STORE_REDIS_URL", "redis://localhost:6379/0")
+CHAT_STORE_REDIS_PREFIX = os.getenv("CHAT_STORE_REDIS_PREFIX", "sofai:chat")
+# shared backends: buffered writes are flushed this often, or at once when this many are waiting
+CHAT_STORE_FLUSH_INTERVAL = float(os.getenv("CHAT_STORE_FLUSH_INTERVAL", "0.05"))
+CHAT_STORE_BATCH_SIZE = int(os.getenv("CHAT_STORE_BATCH_SIZE", "256"))
+# messages kept queued while the shared backend is unreachable; the oldest are dropped beyond this
+CHAT_STORE_MAX_PENDING = int(os.getenv("CHAT_STORE_MAX_PENDING", "10000"))
+# failed writes are logged at most once per this many seconds
+_ERROR_LOG_INTERVAL = 60.0
+
+# rough per-message / per-session bookkeeping cost on top of the text itself
+_MESSAGE_OVERHEAD = 200
+_SESSION_OVERHEAD = 400
+
+
+def message_size(message: Dict[str, Any]) -> int:
+    """Approximate bytes held by a message (its keys and values as text plus overhead)."""
+    return _MESSAGE_OVERHEAD + sum(len(str(k)) + len(str(v)) for k, v in message.items())
+
+
+class _Session:
+    __slots__ = ("messages", "first_seq", "nbytes", "last_used")
+
+    def __init__(self, max_messages: int, now: float):
+        self.messages: Deque[Dict[str, Any]] = deque(maxlen=max_messages)
+        self.first_seq = 1  # seq of messages[0]
+        self.nbytes = _SESSION_OVERHEAD
+        self.last_used = now
+
+    @property
+    def next_seq(self) -> int:
+        return self.first_seq + len(self.messages)
+
+    def drop_oldest(self) -> None:
+        self.nbytes -= message_size(self.messages.popleft())
+        self.first_seq += 1
+
+
+class MemoryChatStore:
+    """Bounded session histories in this process; safe to share between threads."""
+
+    def __init__(
+        self,
+        max_messages: int = CHAT_STORE_MAX_MESSAGES,
+        max_sessions: int = CHAT_STORE_MAX_SESSIONS,
+        memory_bytes: int = int(CHAT_STORE_MEMORY_MB * 1024 * 1024),
+        session_ttl: float = CHAT_STORE_SESSION_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_messages = max(1, max_messages)
+        self.max_sessions = max(1, max_sessions)
+        self.memory_bytes = memory_bytes
+        self.session_ttl = session_ttl
+        self._clock = clock
+        # least recently used first
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._nbytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.dropped_messages = 0
+
+    # ---- internals (called with the lock held) ----
+
+    def _expire(self, now: float) -> None:
+        if self.session_ttl <= 0:
+            return
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used < self.session_ttl:
+                break
+            self._remove(session_id)
+            self.expirations += 1
+
+    def _remove(self, session_id: str) -> Optional[_Session]:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._nbytes -= session.nbytes
+        return session
+
+    def _live(self, session_id: str, now: float) -> Optional[_Session]:
+        self._expire(now)
+        return self._sessions.get(session_id)
+
+    def _enforce_budget(self, keep: str) -> None:
+        while len(self._sessions) > self.max_sessions or (self.memory_bytes > 0 and self._nbytes > self.memory_bytes):
+            oldest = next(iter(self._sessions))
+            if oldest != keep:
+                self._remove(oldest)
+                self.evictions += 1
+                continue
+            # only the active session is left: trim its history instead
+            session = self._sessions[keep]
+            if len(session.messages) <= 1:
+                break
+            before = session.nbytes
+            session.drop_oldest()
+            self._nbytes -= before - session.nbytes
+            self.dropped_messages += 1
+
+    # ---- API ----
+
+    def add_message(self, session_id: str, message: Dict[str, Any]) -> int:
+        """Append a message; returns its sequence number within the session."""
+        now = self._clock()
+        with self._lock:
+            session = self._live(session_id, now)
+            if session is None:
+                session = self._sessions[session_id] = _Session(self.max_messages, now)
+                self._nbytes += session.nbytes
+            self._sessions.move_to_end(session_id)
+            session.last_used = now
+            before = session.nbytes
+            if len(session.messages) == self.max_messages:
+                session.drop_oldest()
+                self.dropped_messages += 1
+            seq = session.next_seq
+            session.messages.append(dict(message))
+            session.nbytes += message_size(message)
+            self._nbytes += session.nbytes - before
+            self._enforce_budget(keep=session_id)
+            return seq
+
+    def get_history(self, session_id: str) -> List[Dict[str, Any]]:
+        """All retained messages of a session, oldest first."""
+        with self._lock:
+            session = self._live(session_id, self._clock())
+            return [dict(m) for m in session.messages] if session is not None else []
+
+    def get_page(self, session_id: str, before: Optional[int] = None, limit: int = CHAT_STORE_PAGE_SIZE) -> Dict[str, Any]:
+        """The newest `limit` messages older than seq `before`, oldest first, each with its `seq`.
+
+        `next_cursor` is the `before` for the previous page, or None at the
+        oldest retained message.
+        """
+        limit = max(1, limit)
+        with self._lock:
+            session = self._live(session_id, self._clock())
+            if session is None:
+                return {"messages": [], "next_cursor": None, "total": 0}
+            end = session.next_seq if before is None else max(session.first_seq, min(before, session.next_seq))
+            start = max(session.first_seq, end - limit)
+            messages = [
+                {**session.messages[seq - session.first_seq], "seq": seq}
+                for seq in range(start, end)
+            ]
+            return {
+                "messages": messages,
+                "next_cursor": start if start > session.first_seq else None,
+                "total": len(session.messages),
+            }
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._remove(session_id)
+
+    def list_sessions(self) -> List[str]:
+        with self._lock:
+            self._expire(self._clock())
+            return list(self._sessions.keys())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(self._clock())
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": sum(len(s.messages) for s in self._sessions.values()),
+                "memory_mb": round(self._nbytes / 2**20, 3),
+                "memory_budget_mb": round(self.memory_bytes / 2**20, 1) if self.memory_bytes > 0 else None,
+                "max_sessions": self.max_sessions,
+                "max_messages_per_session": self.max_messages,
+                "session_ttl": self.session_ttl or None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "dropped_messages": self.dropped_messages,
+            }
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _page(entries: List[Tuple[int, Dict[str, Any]]], before: Optional[int], limit: int) -> Dict[str, Any]:
+    """`get_page` over a session's retained `(seq, message)` pairs, oldest first."""
+    if not entries:
+        return {"messages": [], "next_cursor": None, "total": 0}
+    first_seq = entries[0][0]
+    older = [e for e in entries if before is None or e[0] < before]
+    page = older[-max(1, limit):]
+    return {
+        "messages": [{**message, "seq": seq} for seq, message in page],
+        "next_cursor": page[0][0] if page and page[0][0] > first_seq else None,
+        "total": len(entries),
+    }
+
+
+class _BatchedChatStore(ABC):
+    """Write buffer shared by the out-of-process backends.
+
+    `add_message` only queues the message; a daemon thread (started on the
+    first write) hands everything queued to `_write` every `flush_interval`
+    seconds, in order, and a full batch is written at once. Reads call
+    `flush` first. Subclasses implement `_write(batch)`.
+
+    A batch that could not be written is queued again for the next flush,
+    unless it may already have reached the backend (`RedisSentError`):
+    history is kept at most once. While the backend is down at most
+    `max_pending` messages wait; older ones are dropped.
+    """
+
+    def __init__(self, flush_interval: float = CHAT_STORE_FLUSH_INTERVAL, batch_size: int = CHAT_STORE_BATCH_SIZE, max_pending: int = CHAT_STORE_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.max_pending = max(1, max_pending)
+        self._pending: List[Tuple[str, Dict[str, Any]]] = []
+        self._pending_lock = threading.Lock()
+        # serializes flushes so batches are written in the order they were queued
+        self._flush_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.flushes = 0
+        self.flushed_messages = 0
+        self.write_errors = 0
+        self.dropped_messages = 0
+        self._logged_at = float("-inf")
+        self._unlogged_errors = 0
+
+    def add_message(self, session_id: str, message: Dict[str, Any]) -> None:
+        with self._pending_lock:
+            self._pending.append((session_id, dict(message)))
+            self._drop_excess()
+            full = len(self._pending) >= self.batch_size or self.flush_interval <= 0
+            if self._flusher is None and not full:
+                self._flusher = threading.Thread(target=self._flush_loop, name=f"sofai-{type(self).__name__}-flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+        if full:
+            self.flush()
+
+    def _drop_excess(self) -> None:
+        """Drop the oldest queued messages beyond `max_pending` (call with `_pending_lock` held)."""
+        excess = len(self._pending) - self.max_pending
+        if excess > 0:
+            del self._pending[:excess]
+            self.dropped_messages += excess
+
+    def _log_error(self, text: str) -> None:
+        """Log a write error, at most once per _ERROR_LOG_INTERVAL seconds while the backend stays down."""
+        self.write_errors += 1
+        now = time.monotonic()
+        if now - self._logged_at < _ERROR_LOG_INTERVAL:
+            self._unlogged_errors += 1
+            return
+        suppressed = f" ({self._unlogged_errors} more since the last report)" if self._unlogged_errors else ""
+        print(f"{text}{suppressed}; {len(self._pending)} messages queued, {self.dropped_messages} dropped so far")
+        self._logged_at, self._unlogged_errors = now, 0
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                self._write(batch)
+            except RedisSentError as e:
+                # the server may have stored the batch already; sending it again could store it twice
+                self.dropped_messages += len(batch)
+                self._log_error(f"Chat history batch of {len(batch)} messages may not have been written: {e}")
+                return
+            except Exception as e:
+                # history is best effort: keep the batch for the next flush and carry on
+                with self._pending_lock:
+                    self._pending[:0] = batch
+                    self._drop_excess()
+                self._log_error(f"Error writing chat history batch: {e}")
+                return
+            self.flushes += 1
+            self.flushed_messages += len(batch)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    @staticmethod
+    def _group(batch: List[Tuple[str, Dict[str, Any]]]) -> "OrderedDict[str, List[Dict[str, Any]]]":
+        grouped: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        for session_id, message in batch:
+            grouped.setdefault(session_id, []).append(message)
+        return grouped
+
+    @abstractmethod
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Store `batch` (session id, message pairs, oldest first) in the backend."""
+
+    def _batch_stats(self) -> Dict[str, Any]:
+        return {
+            "pending_messages": len(self._pending),
+            "max_pending": self.max_pending,
+            "flushes": self.flushes,
+            "flushed_messages": self.flushed_messages,
+            "write_errors": self.write_errors,
+            "dropped_messages": self.dropped_messages,
+            "flush_interval": self.flush_interval,
+            "batch_size": self.batch_size,
+        }
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+
+class SqliteChatStore(_BatchedChatStore):
+    """Session histories in a WAL-mode SQLite file shared by the worker processes of a host.
+
+    A batch is one transaction: per session it bumps the sequence counter,
+    inserts the messages and trims the ring buffer; idle sessions expire
+    and the least recently used ones beyond `max_sessions` are evicted.
+    """
+
+    def __init__(
+        self,
+        path: Path = CHAT_STORE_SQLITE_FILE,
+        max_messages: int = CHAT_STORE_MAX_MESSAGES,
+        max_sessions: int = CHAT_STORE_MAX_SESSIONS,
+        session_ttl: float = CHAT_STORE_SESSION_TTL,
+        flush_interval: float = CHAT_STORE_FLUSH_INTERVAL,
+        batch_size: int = CHAT_STORE_BATCH_SIZE,
+        max_pending: int = CHAT_STORE_MAX_PENDING,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(flush_interval, batch_size, max_pending)
+        self.path = Path(path)
+        self.max_messages = max(1, max_messages)
+        self.max_sessions = max(1, max_sessions)
+        self.session_ttl = session_ttl
+        self._clock = clock
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        with self._lock:
+            # created on first use so importing this module has no side effects on disk
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                    " session_id TEXT PRIMARY KEY,"
+                    " next_seq INTEGER NOT NULL,"
+                    " last_used REAL NOT NULL"
+                    ") WITHOUT ROWID"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS chat_sessions_last_used ON chat_sessions (last_used)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS chat_messages ("
+                    " session_id TEXT NOT NULL,"
+                    " seq INTEGER NOT NULL,"
+                    " message TEXT NOT NULL,"
+                    " PRIMARY KEY (session_id, seq)"
+                    ") WITHOUT ROWID"
+                )
+            self._connections.append(conn)
+            self._local.conn = conn
+        return conn
+
+    def _delete_sessions(self, conn: sqlite3.Connection, session_ids: List[str]) -> None:
+        conn.executemany("DELETE FROM chat_messages WHERE session_id = ?", [(s,) for s in session_ids])
+        conn.executemany("DELETE FROM chat_sessions WHERE session_id = ?", [(s,) for s in session_ids])
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        conn = self._connect()
+        now = self._clock()
+        with conn:
+            # the first statement takes the write lock, so seqs cannot interleave between processes
+            if self.session_ttl > 0:
+                expired = [r[0] for r in conn.execute("SELECT session_id FROM chat_sessions WHERE last_used < ?", (now - self.session_ttl,))]
+                if expired:
+                    self._delete_sessions(conn, expired)
+                    self.expirations += len(expired)
+            for session_id, messages in self._group(batch).items():
+                conn.execute(
+                    "INSERT INTO chat_sessions (session_id, next_seq, last_used) VALUES (?, 1, ?)"
+                    " ON CONFLICT (session_id) DO UPDATE SET last_used = excluded.last_used",
+                    (session_id, now),
+                )
+                first = conn.execute("SELECT next_seq FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchone()[0]
+                next_seq = first + len(messages)
+                conn.execute("UPDATE chat_sessions SET next_seq = ? WHERE session_id = ?", (next_seq, session_id))
+                conn.executemany(
+                    "INSERT INTO chat_messages (session_id, seq, message) VALUES (?, ?, ?)",
+                    [(session_id, first + i, json.dumps(m, ensure_ascii=False)) for i, m in enumerate(messages)],
+                )
+                conn.execute("DELETE FROM chat_messages WHERE session_id = ? AND seq < ?", (session_id, next_seq - self.max_messages))
+            excess = conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0] - self.max_sessions
+            if excess > 0:
+                oldest = [r[0] for r in conn.execute("SELECT session_id FROM chat_sessions ORDER BY last_used LIMIT ?", (excess,))]
+                self._delete_sessions(conn, oldest)
+                self.evictions += len(oldest)
+
+    def _entries(self, session_id: str, before: Optional[int] = None, limit: int = -1) -> Optional[List[Tuple[int, Dict[str, Any]]]]:
+        self.flush()
+        conn = self._connect()
+        row = conn.execute("SELECT last_used FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None or (self.session_ttl > 0 and row[0] < self._clock() - self.session_ttl):
+            return None
+        rows = conn.execute(
+            "SELECT seq, message FROM chat_messages WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+            (session_id, before if before is not None else 2**62, limit),
+        ).fetchall()
+        return [(seq, json.loads(message)) for seq, message in reversed(rows)]
+
+    def get_history(self, session_id: str) -> List[Dict[str, Any]]:
+        return [message for _, message in self._entries(session_id) or []]
+
+    def get_page(self, session_id: str, before: Optional[int] = None, limit: int = CHAT_STORE_PAGE_SIZE) -> Dict[str, Any]:
+        limit = max(1, limit)
+        entries = self._entries(session_id, before, limit)
+        if entries is None:
+            return {"messages": [], "next_cursor": None, "total": 0}
+        conn = self._connect()
+        first_seq, total = conn.execute("SELECT MIN(seq), COUNT(*) FROM chat_messages WHERE session_id = ?", (session_id,)).fetchone()
+        return {
+            "messages": [{**message, "seq": seq} for seq, message in entries],
+            "next_cursor": entries[0][0] if entries and entries[0][0] > first_seq else None,
+            "total": total,
+        }
+
+    def clear(self, session_id: str) -> None:
+        self.flush()
+        conn = self._connect()
+        with conn:
+            self._delete_sessions(conn, [session_id])
+
+    def list_sessions(self) -> List[str]:
+        self.flush()
+        oldest = self._clock() - self.session_ttl if self.session_ttl > 0 else float("-inf")
+        return [r[0] for r in self._connect().execute("SELECT session_id FROM chat_sessions WHERE last_used >= ? ORDER BY last_used", (oldest,))]
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        sessions = conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0]
+        messages = conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "path": str(self.path),
+            "sessions": sessions,
+            "messages": messages,
+            "file_mb": round(self.path.stat().st_size / 2**20, 3) if self.path.exists() else 0.0,
+            "max_sessions": self.max_sessions,
+            "max_messages_per_session": self.max_messages,
+            "session_ttl": self.session_ttl or None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            **self._batch_stats(),
+        }
+
+    def close(self) -> None:
+        super().close()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._local = threading.local()
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+class RedisSentError(ConnectionError):
+    """The connection failed after the commands were sent: the server may have run them."""
+
+
+class RespClient:
+    """Minimal client for the Redis protocol (RESP2): one socket, pipelined commands.
+
+    Enough for `RedisChatStore` without the `redis` package; works with
+    Redis, Valkey, KeyDB and other compatible servers.
+    """
+
+    def __init__(self, url: str = CHAT_STORE_REDIS_URL, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._file = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.username, self.password) if self.username else ("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._roundtrip(setup)
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the Redis server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)[:-2]
+            return data.decode()
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise RedisError(f"Unexpected reply from the Redis server: {line!r}")
+
+    def _roundtrip(self, commands) -> list:
+        self._sock.sendall(b"".join(self._encode([a for a in command if a is not None]) for command in commands))
+        return [self._read() for _ in commands]
+
+    def _closed_by_server(self) -> bool:
+        """True if the idle connection was closed (or has unexpected data) and must not be reused."""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def pipeline(self, commands, idempotent: bool = False) -> list:
+        """Send all commands in one write and return their replies; raises on the first error reply.
+
+        An idle connection the server has closed is replaced before sending.
+        Once the commands were sent, a failed connection is only retried for
+        `idempotent` pipelines (reads); otherwise `RedisSentError` is raised,
+        because the server may already have run them.
+        """
+        with self._lock:
+            for attempt in (0, 1):
+                sent = False
+                try:
+                    if self._sock is not None and self._closed_by_server():
+                        self.close_socket()
+                    if self._sock is None:
+                        self._connect()
+                    sent = True
+                    replies = self._roundtrip(commands)
+                    break
+                except (OSError, ConnectionError) as e:
+                    self.close_socket()
+                    if sent and not idempotent:
+                        raise RedisSentError(str(e) or type(e).__name__) from e
+                    if attempt:
+                        raise
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+            if isinstance(reply, list):
+                for item in reply:
+                    if isinstance(item, RedisError):
+                        raise item
+        return replies
+
+    def execute(self, *args, idempotent: bool = False):
+        return self.pipeline([args], idempotent=idempotent)[0]
+
+    def close_socket(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+
+class RedisChatStore(_BatchedChatStore):
+    """Session histories on a Redis-protocol server, shared by every worker and host.
+
+    Per session a list holds the retained messages (RPUSH + LTRIM) and a
+    counter the total written, so seq = total - len + 1 + index. Both keys
+    expire after `session_ttl`; a sorted set of sessions by last use
+    evicts the least recently used ones beyond `max_sessions`. Each
+    session's writes in a batch run in one MULTI/EXEC, and the whole batch
+    is a single round trip.
+    """
+
+    def __init__(
+        self,
+        url: str = CHAT_STORE_REDIS_URL,
+        prefix: str = CHAT_STORE_REDIS_PREFIX,
+        max_messages: int = CHAT_STORE_MAX_MESSAGES,
+        max_sessions: int = CHAT_STORE_MAX_SESSIONS,
+        session_ttl: float = CHAT_STORE_SESSION_TTL,
+        flush_interval: float = CHAT_STORE_FLUSH_INTERVAL,
+        batch_size: int = CHAT_STORE_BATCH_SIZE,
+        max_pending: int = CHAT_STORE_MAX_PENDING,
+        clock: Callable[[], float] = time.time,
+        client: Optional[RespClient] = None,
+    ):
+        super().__init__(flush_interval, batch_size, max_pending)
+        self.client = client or RespClient(url)
+        self.url = url
+        self.prefix = prefix
+        self.max_messages = max(1, max_messages)
+        self.max_sessions = max(1, max_sessions)
+        self.session_ttl = session_ttl
+        self._clock = clock
+        self.evictions = 0
+
+    def _keys(self, session_id: str) -> Tuple[str, str]:
+        return f"{self.prefix}:{session_id}:messages", f"{self.prefix}:{session_id}:count"
+
+    @property
+    def _index(self) -> str:
+        return f"{self.prefix}:sessions"
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        now = self._clock()
+        ttl = int(self.session_ttl) if self.session_ttl > 0 else 0
+        commands = []
+        for session_id, messages in self._group(batch).items():
+            messages_key, count_key = self._keys(session_id)
+            commands += [
+                ("MULTI",),
+                ("RPUSH", messages_key, *[json.dumps(m, ensure_ascii=False) for m in messages]),
+                ("LTRIM", messages_key, -self.max_messages, -1),
+                ("INCRBY", count_key, len(messages)),
+                ("ZADD", self._index, now, session_id),
+            ]
+            if ttl:
+                commands += [("EXPIRE", messages_key, ttl), ("EXPIRE", count_key, ttl)]
+            commands.append(("EXEC",))
+        if ttl:
+            commands.append(("ZREMRANGEBYSCORE", self._index, "-inf", f"({now - ttl}"))
+        commands.append(("ZCARD", self._index))
+        excess = self.client.pipeline(commands)[-1] - self.max_sessions
+        if excess > 0:
+            # the batch is written; a failed eviction must not queue it again (the next batch retries it)
+            try:
+                popped = self.client.execute("ZPOPMIN", self._index, excess)
+                evicted = popped[::2]
+                if evicted:
+                    self.client.execute("DEL", *[key for session_id in evicted for key in self._keys(session_id)])
+                    self.evictions += len(evicted)
+            except (RedisError, OSError) as e:
+                self._log_error(f"Error evicting chat sessions: {e}")
+
+    def _entries(self, session_id: str) -> List[Tuple[int, Dict[str, Any]]]:
+        self.flush()
+        messages_key, count_key = self._keys(session_id)
+        _, _, _, (raw, count) = self.client.pipeline([("MULTI",), ("LRANGE", messages_key, 0, -1), ("GET", count_key), ("EXEC",)], idempotent=True)
+        first_seq = int(count or 0) - len(raw) + 1
+        return [(first_seq + i, json.loads(m)) for i, m in enumerate(raw)]
+
+    def get_history(self, session_id: str) -> List[Dict[str, Any]]:
+        return [message for _, message in self._entries(session_id)]
+
+    def get_page(self, session_id: str, before: Optional[int] = None, limit: int = CHAT_STORE_PAGE_SIZE) -> Dict[str, Any]:
+        return _page(self._entries(session_id), before, limit)
+
+    def clear(self, session_id: str) -> None:
+        self.flush()
+        self.client.pipeline([("DEL", *self._keys(session_id)), ("ZREM", self._index, session_id)], idempotent=True)
+
+    def list_sessions(self) -> List[str]:
+        self.flush()
+        oldest = self._clock() - self.session_ttl if self.session_ttl > 0 else "-inf"
+        return self.client.execute("ZRANGEBYSCORE", self._index, oldest, "+inf", idempotent=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis",
+            "url": f"{self.client.host}:{self.client.port}/{self.client.db}",
+            "sessions": self.client.execute("ZCARD", self._index, idempotent=True),
+            "max_sessions": self.max_sessions,
+            "max_messages_per_session": self.max_messages,
+            "session_ttl": self.session_ttl or None,
+            "evictions": self.evictions,
+            **self._batch_stats(),
+        }
+
+    def close(self) -> None:
+        super().close()
+        self.client.close_socket()
+
+
+def open_chat_store(backend: str = CHAT_STORE_BACKEND):
+    if backend == "memory":
+        return MemoryChatStore()
+    if backend == "sqlite":
+        return SqliteChatStore()
+    if backend == "redis":
+        return RedisChatStore()
+    raise ValueError(f"Unsupported CHAT_STORE_BACKEND {backend!r}; use 'memory', 'sqlite' or 'redis'")
 
 
 class ChatStore:
-    _store: Dict[str, List[Dict[str, Any]]] = {}
+    _store = open_chat_store()
+
+    @classmethod
+    def use(cls, store) -> None:
+        """Swap the backend (e.g. in tests); the previous one is flushed and closed."""
+        previous, cls._store = cls._store, store
+        previous.close()
+
+    @classmethod
+    def flush(cls):
+        cls._store.flush()
+
+    @classmethod
+    def close(cls):
+        cls._store.close()
 
     @classmethod
     def add_message(cls, session_id: str, message: Dict[str, Any]):
-        cls._store.setdefault(session_id, []).append(message)
+        cls._store.add_message(session_id, message)
 
     @classmethod
     def get_history(cls, session_id: str):
-        return cls._store.get(session_id, [])
+        return cls._store.get_history(session_id)
+
+    @classmethod
+    def get_page(cls, session_id: str, before: Optional[int] = None, limit: int = CHAT_STORE_PAGE_SIZE):
+        return cls._store.get_page(session_id, before=before, limit=limit)
 
     @classmethod
     def clear(cls, session_id: str):
-        cls._store.pop(session_id, None)
+        cls._store.clear(session_id)
 
     @classmethod
     def list_sessions(cls):
-        return list(cls._store.keys())
+        return cls._store.list_sessions()
+
+    @classmethod
+    def stats(cls):
+        return cls._store.stats()
+
+    # Async wrappers: the shared backends flush and do SQLite or socket I/O,
+    # which must not block the event loop.
+    @classmethod
+    async def aadd_message(cls, session_id: str, message: Dict[str, Any]):
+        await asyncio.to_thread(cls.add_message, session_id, message)
+
+    @classmethod
+    async def aget_page(cls, session_id: str, before: Optional[int] = None, limit: int = CHAT_STORE_PAGE_SIZE):
+        return await asyncio.to_thread(cls.get_page, session_id, before, limit)
+
+    @classmethod
+    async def aclear(cls, session_id: str):
+        await asyncio.to_thread(cls.clear, session_id)
+
+    @classmethod
+    async def astats(cls):
+        return await asyncio.to_thread(cls.stats)
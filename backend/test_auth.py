@@ -142,10 +142,7 @@ def test_auth_system():
     
     # Display database content
     print("\n[DATABASE CONTENT]")
-    if db.db_file.exists():
-        with open(db.db_file, 'r') as f:
-            data = json.load(f)
-            print(json.dumps(data, indent=2))
+    print(json.dumps(db.get_user("testuser@example.com"), indent=2))
     
     print("\nDatabase file location:", db.db_file)
 
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests for the caching primitives in cache.py
+Run this from the backend directory: python test_cache.py
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from cache import AsyncSingleFlight, LRUCache, SingleFlight, ResponseCache
+
+
+def test_lru_eviction_and_ttl():
+    cache = LRUCache(max_entries=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" becomes most recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None, "least recently used entry should be evicted"
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    time.sleep(0.06)
+    assert cache.get("a") is None, "entry should expire after its TTL"
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["expirations"] == 1
+    assert stats["hits"] == 3 and stats["misses"] == 2
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        release.wait(1)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", work))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1, "only one caller should do the work"
+    assert [r[0] for r in results] == ["result"] * 5
+    assert sum(1 for _, shared in results if shared) == 4
+
+
+def test_async_single_flight_survives_a_cancelled_leader():
+    async def scenario():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        leader = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()  # e.g. the first client disconnected
+        assert await follower == ("result", True)
+        assert leader.cancelled() and len(calls) == 1
+
+        # once every awaiter is gone, the shared call is cancelled too
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        only = asyncio.create_task(flight.do("slow", slow))
+        await started.wait()
+        [(task, _)] = flight._calls.values()
+        only.cancel()
+        await asyncio.sleep(0)
+        assert not flight._calls
+        await asyncio.sleep(0)
+        assert task.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_response_cache_policy_and_disk_tier():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(max_entries=4, ttl=60, disk_dir=tmp, max_temperature=0.5)
+        assert cache.should_use(None, do_sample=False, temperature=1.0)
+        assert not cache.should_use(None, do_sample=True, temperature=0.9)
+        assert cache.should_use(True, do_sample=True, temperature=0.9)
+        assert not cache.should_use(False, do_sample=False, temperature=0.0)
+        assert cache.should_use(None, do_sample=True, temperature=0.5)
+
+        # the default only caches greedy decoding: every endpoint samples at 0.7
+        default = ResponseCache(disk_dir=None)
+        assert default.should_use(None, do_sample=False, temperature=0.7)
+        assert not default.should_use(None, do_sample=True, temperature=0.7)
+        assert not default.should_use(None, do_sample=True, temperature=0.1)
+
+        key = ResponseCache.make_key("qwen", "hello", temperature=0.3)
+        assert key != ResponseCache.make_key("qwen", "hello", temperature=0.4)
+        assert cache.get_or_compute(key, lambda: ("hi there", True)) == "hi there"
+        assert cache.get_or_compute(key, lambda: ("other", True)) == "hi there"
+
+        # a fresh instance (e.g. after a restart) finds the reply on disk
+        restarted = ResponseCache(max_entries=4, ttl=60, disk_dir=tmp)
+        assert restarted.get(key) == "hi there"
+        assert restarted.stats()["disk_hits"] == 1
+
+        # aborted (non-cacheable) replies are returned but not stored
+        other = ResponseCache.make_key("qwen", "partial")
+        assert cache.get_or_compute(other, lambda: ("half an ans", False)) == "half an ans"
+        assert cache.get(other) is None
+
+
+if __name__ == "__main__":
+    test_lru_eviction_and_ttl()
+    test_single_flight_coalesces_concurrent_calls()
+    test_async_single_flight_survives_a_cancelled_leader()
+    test_response_cache_policy_and_disk_tier()
+    print("✅ All cache tests passed!")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for the /predict model cascade
+Run this from the backend directory: python test_cascade.py
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from cascade import run_cascade
+
+
+class _Request:
+    async def is_disconnected(self):
+        return False
+
+
+class _FakeModel:
+    """Streams `words` with `delay` seconds per word and records whether it was stopped."""
+
+    def __init__(self, words, delay):
+        self.words = words
+        self.delay = delay
+        self.started = None
+        self.stopped = False
+
+    def stream_response(self, prompt, stop_event=None, **kwargs):
+        self.kwargs = kwargs
+        self.started = time.monotonic()
+        try:
+            for word in self.words:
+                if stop_event.is_set():
+                    return
+                time.sleep(self.delay)
+                yield word + " "
+        finally:
+            self.stopped = stop_event.is_set()
+
+
+def _cascade(primary, fallback, **kwargs):
+    return asyncio.run(run_cascade(_Request(), ("primary", primary, "p"), ("fallback", fallback, "f"), min_chars=20, **kwargs))
+
+
+def test_concurrent_cascade_cancels_fallback_once_primary_is_long_enough():
+    primary = _FakeModel(["word"] * 10, 0.01)
+    fallback = _FakeModel(["other"] * 100, 0.01)
+    result = _cascade(primary, fallback, mode="concurrent")
+    assert result.winner == "primary" and result.reason == "primary_long_enough"
+    assert result.cancelled == ["fallback"]
+    time.sleep(0.05)
+    assert fallback.stopped
+
+
+def test_concurrent_cascade_overlaps_short_primary_with_fallback():
+    primary = _FakeModel(["short"], 0.2)
+    fallback = _FakeModel(["a longer answer"] * 4, 0.05)
+    started = time.monotonic()
+    result = _cascade(primary, fallback, mode="concurrent")
+    elapsed = time.monotonic() - started
+    assert result.winner == "fallback" and result.reason == "primary_short"
+    assert result.reply.startswith("a longer answer")
+    assert elapsed < 0.35, "fallback should run alongside the primary, not after it"
+
+
+def test_hedged_cascade_starts_fallback_only_after_delay():
+    fast = _FakeModel(["word"] * 10, 0.001)
+    unused = _FakeModel(["other"] * 10, 0.001)
+    result = _cascade(fast, unused, mode="hedge", hedge_delay=0.5)
+    assert result.winner == "primary" and unused.started is None
+
+    slow = _FakeModel(["short"], 0.3)
+    fallback = _FakeModel(["a longer answer"] * 4, 0.01)
+    result = _cascade(slow, fallback, mode="hedge", hedge_delay=0.05)
+    assert result.winner == "fallback"
+    assert fallback.started - slow.started < 0.2, "fallback should be hedged before the primary finished"
+
+
+def test_sequential_cascade_keeps_longer_reply():
+    primary = _FakeModel(["short", "reply"], 0.001)
+    fallback = _FakeModel(["tiny"], 0.001)
+    result = _cascade(primary, fallback, mode="sequential")
+    assert result.winner == "primary" and result.reason == "fallback_not_longer"
+    assert result.reply == "short reply"
+
+
+def test_generation_options_reach_both_models():
+    primary = _FakeModel(["short"], 0.001)
+    fallback = _FakeModel(["a longer answer"] * 4, 0.001)
+    _cascade(primary, fallback, mode="sequential", use_cache=True, temperature=0.7)
+    assert primary.kwargs == fallback.kwargs == {"use_cache": True, "temperature": 0.7}
+
+
+def test_lazy_fallback_is_only_resolved_for_short_replies():
+    resolved = []
+
+    def lazy(model):
+        async def resolve():
+            resolved.append(model)
+            return ("fallback", model, "f")
+        return resolve
+
+    long_primary = _FakeModel(["word"] * 10, 0.001)
+    result = asyncio.run(run_cascade(_Request(), ("primary", long_primary, "p"), lazy(_FakeModel(["x"], 0.001)), min_chars=20, mode="concurrent"))
+    assert result.winner == "primary" and result.mode == "sequential" and resolved == []
+
+    fallback = _FakeModel(["a longer answer"] * 4, 0.001)
+    result = asyncio.run(run_cascade(_Request(), ("primary", _FakeModel(["short"], 0.001), "p"), lazy(fallback), min_chars=20))
+    assert result.winner == "fallback" and resolved == [fallback]
+
+    async def unavailable():
+        raise RuntimeError("could not load")
+
+    result = asyncio.run(run_cascade(_Request(), ("primary", _FakeModel(["short"], 0.001), "p"), unavailable, min_chars=20))
+    assert result.winner == "primary" and result.reason == "fallback_unavailable" and result.reply == "short"
+
+
+if __name__ == "__main__":
+    test_concurrent_cascade_cancels_fallback_once_primary_is_long_enough()
+    test_concurrent_cascade_overlaps_short_primary_with_fallback()
+    test_hedged_cascade_starts_fallback_only_after_delay()
+    test_sequential_cascade_keeps_longer_reply()
+    test_generation_options_reach_both_models()
+    test_lazy_fallback_is_only_resolved_for_short_replies()
+    print("✅ All cascade tests passed!")
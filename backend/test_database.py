@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Tests for the user database storage engines in database.py
+Run this from the backend directory: python test_database.py
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from database import Database, JsonUserStore, SqliteUserStore, migrate_json_to_sqlite
+
+
+def _json_db(directory: Path) -> Database:
+    return Database(JsonUserStore(directory / "users.json"))
+
+
+def test_sqlite_engine_matches_json_behaviour():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(SqliteUserStore(Path(tmp) / "users.db", import_from=None))
+        assert db.create_user("Ada@Example.com", "SecurePass123", "ada")["success"]
+        assert "already exists" in db.create_user("ada@example.com", "SecurePass123", "ada")["error"]
+        assert db.user_exists("ADA@example.com")
+        assert "Invalid password" in db.authenticate_user("ada@example.com", "WrongPass123")["error"]
+        assert "User not found" in db.authenticate_user("bob@example.com", "SecurePass123")["error"]
+
+        result = db.authenticate_user("ada@example.com", "SecurePass123")
+        assert result["success"] and result["user"] == {"email": "ada@example.com", "username": "ada", "gender": "not-specified"}
+        assert db.get_user("ada@example.com")["last_login"] is not None
+
+        assert db.update_user_conversations("ada@example.com", [{"id": 1, "title": "héllo", "messages": [{"role": "user", "text": "hi"}]}])
+        [conversation] = db.get_user_conversations("ada@example.com")
+        assert (conversation["id"], conversation["title"], conversation["messages"][0]["content"]) == ("1", "héllo", "hi")
+        assert not db.update_user_conversations("bob@example.com", [])
+        db.close()
+
+
+def test_new_sqlite_database_imports_users_json():
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = _json_db(Path(tmp))
+        legacy.create_user("ada@example.com", "SecurePass123", "ada", "female")
+        legacy.update_user_conversations("ada@example.com", [{"id": 1, "messages": [{"role": "user", "text": "hi"}]}])
+
+        db = Database(SqliteUserStore(Path(tmp) / "users.db", import_from=Path(tmp) / "users.json"))
+        assert db.authenticate_user("ada@example.com", "SecurePass123")["success"]
+        assert db.get_conversation_page("ada@example.com", "1")["messages"][0]["content"] == "hi"
+        # running the migration again keeps the rows already there
+        assert migrate_json_to_sqlite(Path(tmp) / "users.json", store=db.store) == 0
+        assert db.get_user("ada@example.com")["last_login"] is not None
+        db.close()
+
+
+def test_concurrent_signups_from_two_connections():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "users.db"
+        # two stores stand in for two worker processes sharing the file
+        workers = [Database(SqliteUserStore(path, import_from=None)) for _ in range(2)]
+        results = []
+
+        def _signup(db, start):
+            for i in range(start, 40, 2):
+                results.append(db.create_user(f"user{i % 20}@example.com", "SecurePass123", f"user{i}")["success"])
+
+        threads = [threading.Thread(target=_signup, args=(db, n)) for n, db in enumerate(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sum(results) == 20  # each email is created exactly once
+        assert len(workers[0].store.all_users()) == 20
+        assert workers[1].store.path.with_name("users.db-wal").exists()
+        for db in workers:
+            db.close()
+
+
+def test_async_access_path():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(SqliteUserStore(Path(tmp) / "users.db", import_from=None))
+
+        async def _run():
+            assert (await db.acreate_user("ada@example.com", "SecurePass123", "ada"))["success"]
+            logins = await asyncio.gather(*(db.aauthenticate_user("ada@example.com", "SecurePass123") for _ in range(5)))
+            assert all(r["success"] for r in logins)
+            assert await db.auser_exists("ada@example.com")
+
+        asyncio.run(_run())
+        db.close()
+
+
+def test_last_login_is_batched_into_background_flushes():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteUserStore(Path(tmp) / "users.db", import_from=None)
+        db = Database(store, flush_interval=3600)
+        for name in ("ada", "bob"):
+            db.create_user(f"{name}@example.com", "SecurePass123", name)
+            assert db.authenticate_user(f"{name}@example.com", "SecurePass123")["success"]
+        # not written yet, but visible through the Database
+        assert store.get("ada@example.com")["last_login"] is None
+        assert db.get_user("ada@example.com")["last_login"] is not None
+        assert db.flush() == 2 and db.flush() == 0
+        assert store.get("bob@example.com")["last_login"] == db.get_user("bob@example.com")["last_login"]
+
+        db.authenticate_user("ada@example.com", "SecurePass123")
+        pending = db.get_user("ada@example.com")["last_login"]
+        db.close()  # flushes what is left
+        reopened = SqliteUserStore(Path(tmp) / "users.db", import_from=None)
+        assert reopened.get("ada@example.com")["last_login"] == pending
+        reopened.close()
+
+
+def _conversation_dbs(directory: Path):
+    yield "json", _json_db(directory)
+    yield "sqlite", Database(SqliteUserStore(directory / "users.db", import_from=None))
+
+
+def test_conversation_messages_append_and_page_by_cursor():
+    with tempfile.TemporaryDirectory() as tmp:
+        for engine, db in _conversation_dbs(Path(tmp)):
+            db.create_user("ada@example.com", "SecurePass123", "ada")
+            for i in range(1, 8):
+                result = db.append_message("ada@example.com", "c1", "user" if i % 2 else "assistant", f"m{i}", title="First", meta={"n": i})
+                assert result["success"] and result["seq"] == i, engine
+            assert not db.append_message("bob@example.com", "c1", "user", "hi")["success"]
+            assert not db.append_message("ada@example.com", "c1", "robot", "hi")["success"]
+
+            newest = db.get_conversation_page("ada@example.com", "c1", limit=3)
+            assert [m["content"] for m in newest["messages"]] == ["m5", "m6", "m7"], engine
+            assert newest["messages"][0]["meta"] == {"n": 5} and newest["message_count"] == 7
+            older = db.get_conversation_page("ada@example.com", "c1", before=newest["next_cursor"], limit=3)
+            assert [m["content"] for m in older["messages"]] == ["m2", "m3", "m4"]
+            oldest = db.get_conversation_page("ada@example.com", "c1", before=older["next_cursor"], limit=3)
+            assert [m["seq"] for m in oldest["messages"]] == [1] and oldest["next_cursor"] is None
+
+            since = db.get_conversation_page("ada@example.com", "c1", after=5)
+            assert [m["content"] for m in since["messages"]] == ["m6", "m7"] and since["next_cursor"] is None
+            assert not db.get_conversation_page("ada@example.com", "missing")["success"]
+            db.close()
+
+
+def test_conversation_summaries_are_paged_by_recency():
+    with tempfile.TemporaryDirectory() as tmp:
+        for engine, db in _conversation_dbs(Path(tmp)):
+            db.create_user("ada@example.com", "SecurePass123", "ada")
+            db.create_user("bob@example.com", "SecurePass123", "bob")
+            for i in range(5):
+                db.append_message("ada@example.com", f"c{i}", "user", f"question {i}", title=f"Chat {i}")
+            db.append_message("bob@example.com", "c0", "user", "bob's own c0")
+            db.append_message("ada@example.com", "c1", "assistant", "latest answer")
+
+            first = db.list_conversations("ada@example.com", limit=2)
+            assert [c["id"] for c in first["conversations"]] == ["c1", "c4"], engine
+            assert first["conversations"][0]["preview"] == "latest answer" and first["conversations"][0]["message_count"] == 2
+            rest = db.list_conversations("ada@example.com", before=first["next_cursor"], limit=10)
+            assert [c["id"] for c in rest["conversations"]] == ["c3", "c2", "c0"] and rest["next_cursor"] is None
+
+            assert db.delete_conversation("ada@example.com", "c0")
+            assert not db.delete_conversation("ada@example.com", "c0")
+            assert db.get_conversation_page("bob@example.com", "c0")["messages"][0]["content"] == "bob's own c0"
+            db.close()
+
+
+def test_edited_conversation_is_replaced_and_ids_may_contain_the_cursor_separator():
+    with tempfile.TemporaryDirectory() as tmp:
+        for engine, db in _conversation_dbs(Path(tmp)):
+            db.create_user("ada@example.com", "SecurePass123", "ada")
+            for i in range(4):
+                db.append_message("ada@example.com", "c1", "user" if i % 2 == 0 else "assistant", f"m{i}")
+            # the second answer was deleted and the first one regenerated
+            edited = [{"role": "user", "content": "m0"}, {"role": "assistant", "content": "m1 again", "meta": {"model_used": "qwen"}}, {"role": "user", "content": "m2"}]
+            assert db.replace_messages("ada@example.com", "c1", edited, title="Edited") == {"success": True, "conversation_id": "c1", "message_count": 3}
+            page = db.get_conversation_page("ada@example.com", "c1")
+            assert [(m["seq"], m["content"]) for m in page["messages"]] == [(1, "m0"), (2, "m1 again"), (3, "m2")], engine
+            assert page["messages"][1]["meta"] == {"model_used": "qwen"} and page["message_count"] == 3
+            assert db.append_message("ada@example.com", "c1", "assistant", "m3")["seq"] == 4
+            assert db.list_conversations("ada@example.com")["conversations"][0]["title"] == "Edited"
+            assert not db.replace_messages("ada@example.com", "c1", [{"role": "robot", "content": "hi"}])["success"]
+            assert not db.replace_messages("bob@example.com", "c1", edited)["success"]
+
+            # ids are chosen by the client and may contain the "|" of the summary cursor
+            for conversation_id in ("a|b", "a|c", "a|d"):
+                db.append_message("ada@example.com", conversation_id, "user", "hi")
+            seen = []
+            cursor = None
+            while True:
+                page = db.list_conversations("ada@example.com", before=cursor, limit=1)
+                seen += [c["id"] for c in page["conversations"]]
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    break
+            assert seen == ["a|d", "a|c", "a|b", "c1"], engine
+            db.close()
+
+
+def test_conversation_endpoints_need_a_session():
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    import main
+
+    client = TestClient(main.app)
+    requests = [
+        ("get", "/conversations", None),
+        ("get", "/conversations/c1/messages", None),
+        ("post", "/conversations/c1/messages", {"role": "user", "content": "hi"}),
+        ("put", "/conversations/c1/messages", {"messages": []}),
+        ("delete", "/conversations/c1", None),
+    ]
+    for method, path, body in requests:
+        for headers in ({}, {"Authorization": "Bearer not-a-token"}):
+            response = client.request(method, path, json=body, headers=headers)
+            assert response.status_code == 401, (method, path, headers)
+
+
+def test_whole_list_conversations_are_split_into_messages():
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = [{"id": "c1", "title": "Old", "createdAt": "2026-01-01T00:00:00", "messages": [{"role": "user", "text": "hi"}, {"role": "assistant", "text": "hello", "model_used": "qwen"}]}]
+        db = Database(SqliteUserStore(Path(tmp) / "users.db", import_from=None))
+        db.create_user("ada@example.com", "SecurePass123", "ada")
+        assert db.update_user_conversations("ada@example.com", legacy)
+        page = db.get_conversation_page("ada@example.com", "c1")
+        assert [(m["role"], m["content"]) for m in page["messages"]] == [("user", "hi"), ("assistant", "hello")]
+        assert page["messages"][1]["meta"] == {"model_used": "qwen"}
+        assert db.append_message("ada@example.com", "c1", "user", "again")["seq"] == 3
+        assert [c["id"] for c in db.get_user("ada@example.com")["conversations"]] == ["c1"]
+        db.close()
+
+
+if __name__ == "__main__":
+    test_sqlite_engine_matches_json_behaviour()
+    test_new_sqlite_database_imports_users_json()
+    test_concurrent_signups_from_two_connections()
+    test_async_access_path()
+    test_last_login_is_batched_into_background_flushes()
+    test_conversation_messages_append_and_page_by_cursor()
+    test_conversation_summaries_are_paged_by_recency()
+    test_edited_conversation_is_replaced_and_ids_may_contain_the_cursor_separator()
+    test_conversation_endpoints_need_a_session()
+    test_whole_list_conversations_are_split_into_messages()
+    print("✅ All database tests passed!")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Tests for the bounded executors and disconnect cancellation in executor.py
+Run this from the backend directory: python test_executor.py
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import executor
+from executor import BoundedExecutor, ExecutorBusy, run_generation, watch_disconnect
+
+
+class _Request:
+    """Stand-in for a Starlette request whose client disconnects after `connected_for` checks."""
+
+    def __init__(self, connected_for=None):
+        self.connected_for = connected_for
+        self.checks = 0
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.connected_for is not None and self.checks > self.connected_for
+
+
+def _until_stopped(stop_event, started=None):
+    """A generation that runs until it is told to stop."""
+    if started is not None:
+        started.set()
+    deadline = time.monotonic() + 10
+    while not stop_event.is_set():
+        if time.monotonic() > deadline:
+            return "never stopped"
+        time.sleep(0.005)
+    return "stopped"
+
+
+def test_pool_refuses_work_beyond_workers_plus_queue():
+    pool = BoundedExecutor("test-bounded", max_workers=1, max_pending=1)
+    release = threading.Event()
+    try:
+        running = pool.submit(release.wait, 10)
+        queued = pool.submit(lambda: threading.current_thread().name)
+        with pytest.raises(ExecutorBusy):
+            pool.submit(time.sleep, 0)
+        release.set()
+        assert running.result(5) is True
+        assert queued.result(5).startswith("test-bounded")
+        # finished jobs give their slots back
+        assert asyncio.run(pool.run(lambda a, b: a + b, 2, b=3)) == 5
+    finally:
+        release.set()
+        pool.shutdown(wait=True)
+
+
+def test_busy_executor_is_answered_with_503():
+    pytest.importorskip("fastapi")
+    import main
+
+    response = asyncio.run(main.executor_busy_handler(None, ExecutorBusy("sofai-infer executor is at capacity")))
+    assert response.status_code == 503 and response.headers["Retry-After"] == "2"
+
+
+def test_iterate_streams_on_a_worker_and_closes_early():
+    pool = BoundedExecutor("test-iterate", max_workers=1, max_pending=0)
+    closed = []
+    stop_event = threading.Event()
+
+    def numbers():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+                time.sleep(0.001)
+        finally:
+            closed.append(threading.current_thread().name)
+
+    async def consume():
+        stream = pool.iterate(numbers(), stop_event)
+        items = [await stream.__anext__() for _ in range(3)]
+        await stream.aclose()  # the consumer stops early, e.g. the client went away
+        return items
+
+    try:
+        assert asyncio.run(consume()) == [0, 1, 2]
+        assert stop_event.is_set()
+        # the iterator is closed on the worker thread, which then frees the only slot
+        deadline = time.monotonic() + 5
+        while not closed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert closed and closed[0].startswith("test-iterate")
+        assert pool.submit(lambda: "free").result(5) == "free"
+    finally:
+        pool.shutdown(wait=True)
+
+
+def test_iterate_raises_the_iterators_error():
+    pool = BoundedExecutor("test-iterate-error", max_workers=1, max_pending=0)
+
+    def failing():
+        yield "partial"
+        raise ValueError("generation failed")
+
+    async def consume():
+        items = []
+        with pytest.raises(ValueError, match="generation failed"):
+            async for item in pool.iterate(failing()):
+                items.append(item)
+        return items
+
+    try:
+        assert asyncio.run(consume()) == ["partial"]
+    finally:
+        pool.shutdown(wait=True)
+
+
+def test_generation_stops_when_the_client_disconnects():
+    pool = BoundedExecutor("test-generation", max_workers=1, max_pending=0)
+    with mock.patch.object(executor, "inference_executor", pool):
+        try:
+            assert asyncio.run(run_generation(_Request(connected_for=2), _until_stopped)) == "stopped"
+        finally:
+            pool.shutdown(wait=True)
+
+
+def test_generation_stops_when_its_task_is_cancelled():
+    pool = BoundedExecutor("test-cancel", max_workers=1, max_pending=0)
+    started = threading.Event()
+    stop_events = []
+
+    def generate(started, stop_event):
+        stop_events.append(stop_event)
+        return _until_stopped(stop_event, started)
+
+    async def cancel_midway():
+        task = asyncio.create_task(run_generation(_Request(), generate, started))
+        while not started.is_set():
+            await asyncio.sleep(0.005)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with mock.patch.object(executor, "inference_executor", pool):
+        try:
+            asyncio.run(cancel_midway())
+            assert stop_events[0].is_set()
+        finally:
+            pool.shutdown(wait=True)
+
+
+def test_disconnect_watcher_ends_once_stopped():
+    stop_event = threading.Event()
+    request = _Request()
+
+    async def watch():
+        watcher = asyncio.create_task(watch_disconnect(request, stop_event, interval=0.01))
+        await asyncio.sleep(0.05)
+        assert not watcher.done() and not stop_event.is_set()
+        stop_event.set()  # the generation finished on its own
+        await asyncio.wait_for(watcher, 1)
+
+    asyncio.run(watch())
+    assert request.checks >= 2
+
+
+if __name__ == "__main__":
+    test_pool_refuses_work_beyond_workers_plus_queue()
+    test_busy_executor_is_answered_with_503()
+    test_iterate_streams_on_a_worker_and_closes_early()
+    test_iterate_raises_the_iterators_error()
+    test_generation_stops_when_the_client_disconnects()
+    test_generation_stops_when_its_task_is_cancelled()
+    test_disconnect_watcher_ends_once_stopped()
+    print("✅ All executor tests passed!")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for reusable KV caches in kv_cache.py
+Run this from the backend directory: python test_kv_cache.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from fixtures.tiny_models import prompt, tiny_wrapper
+from kv_cache import PREFIX_CACHE_MIN_TOKENS, PrefixCache, SessionKVCache, cache_len, cache_nbytes, to_legacy
+
+
+def _greedy(wrapper, text, **kwargs):
+    return wrapper.generate_response(text, max_new_tokens=20, do_sample=False, use_cache=False, **kwargs)
+
+
+def test_prefix_cache_hit_gives_identical_tokens():
+    wrapper = tiny_wrapper()
+    system = prompt(24)
+    text = system + " " + prompt(6, start=50)
+    expected = _greedy(wrapper, text)
+
+    assert wrapper.register_prefix(system) == 24
+    ids = wrapper.tokenizer(text)["input_ids"]
+    cached, past = wrapper.cached_prefix(ids)
+    assert cached == 24 and cache_len(past) == 24
+    assert _greedy(wrapper, text) == expected
+
+    # a prompt that is the prefix itself still leaves its last token to prefill
+    assert wrapper.cached_prefix(wrapper.tokenizer(system)["input_ids"])[0] == 23
+    # unrelated prompts and too-short overlaps miss
+    assert wrapper.cached_prefix(wrapper.tokenizer(prompt(30, start=60))["input_ids"]) == (0, None)
+    short = wrapper.tokenizer(prompt(PREFIX_CACHE_MIN_TOKENS - 1) + " w90 w91")["input_ids"]
+    assert wrapper.cached_prefix(short) == (0, None)
+
+
+def test_prefix_cache_is_persisted_and_reloaded():
+    wrapper = tiny_wrapper()
+    system = prompt(16)
+    with tempfile.TemporaryDirectory() as tmp:
+        first = PrefixCache(wrapper.model_name, persist_dir=tmp)
+        first.register(wrapper, system)
+        files = list(Path(tmp).glob("prefix-*.pt"))
+        assert len(files) == 1
+
+        # loading the saved cache must not run the model again
+        reloaded = tiny_wrapper()
+        reloaded.model = None
+        second = PrefixCache(wrapper.model_name, persist_dir=tmp)
+        second.register(reloaded, system)
+        ids = wrapper.tokenizer(system + " w80")["input_ids"]
+        (n1, a), (n2, b) = first.lookup(ids), second.lookup(ids)
+        assert n1 == n2 == 16
+        assert all(torch.equal(ka, kb) and torch.equal(va, vb) for (ka, va), (kb, vb) in zip(a, b))
+
+
+def test_session_cache_follow_up_turn_gives_identical_tokens():
+    wrapper = tiny_wrapper()
+    turn1 = prompt(14)
+    reply1 = wrapper.generate_response(turn1, max_new_tokens=10, do_sample=False, use_cache=False, session_id="s1")
+    assert len(wrapper.session_cache) == 1
+
+    turn2 = turn1 + " " + reply1 + " " + prompt(4, start=70)
+    ids = wrapper.tokenizer(turn2)["input_ids"]
+    cached, _ = wrapper.cached_prefix(ids, session_id="s1")
+    assert cached >= 14 + len(reply1.split()) - 1
+    # another session (or none) gets nothing from it
+    assert wrapper.cached_prefix(ids, session_id="s2") == (0, None)
+    assert _greedy(wrapper, turn2, session_id="s1") == _greedy(tiny_wrapper(), turn2)
+
+    # an edited history only reuses the part that still matches
+    edited = wrapper.tokenizer(prompt(10) + " w90 " + prompt(8, start=30))["input_ids"]
+    assert wrapper.cached_prefix(edited, session_id="s1")[0] == 10
+
+
+def test_session_cache_evicts_least_recently_used_under_budget():
+    wrapper = tiny_wrapper()
+    ids = wrapper.tokenizer(prompt(12))["input_ids"]
+    with torch.inference_mode():
+        out = wrapper.model(input_ids=torch.tensor([ids]), use_cache=True)
+    entry = to_legacy(out.past_key_values)
+    size = cache_nbytes(entry)
+    sessions = SessionKVCache(budget_bytes=int(size * 2.5))
+    sessions.store("a", ids, entry)
+    sessions.store("b", ids, entry)
+    sessions.lookup("a", ids)  # "a" is now the most recently used
+    sessions.store("c", ids, entry)
+    assert len(sessions) == 2 and sessions.used_bytes == 2 * size
+    assert sessions.lookup("b", ids) == (0, None)
+    assert sessions.lookup("a", ids)[0] == 11 and sessions.lookup("c", ids)[0] == 11
+    # stored caches own their memory, so a view into a larger cache does not pin it
+    assert sessions._entries["a"][1][0][0].data_ptr() != entry[0][0].data_ptr()
+
+    sessions.drop("a")
+    assert len(sessions) == 1 and sessions.used_bytes == size
+    # a cache larger than the whole budget is not kept
+    small = SessionKVCache(budget_bytes=size - 1)
+    small.store("x", ids, entry)
+    assert len(small) == 0 and small.used_bytes == 0
+
+
+if __name__ == "__main__":
+    test_prefix_cache_hit_gives_identical_tokens()
+    test_prefix_cache_is_persisted_and_reloaded()
+    test_session_cache_follow_up_turn_gives_identical_tokens()
+    test_session_cache_evicts_least_recently_used_under_budget()
+    print("✅ All KV cache tests passed!")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Tests for lazy model loading and budget eviction in model_manager.py
+Run this from the backend directory: python test_model_manager.py
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import pytest
+
+import model_manager
+from model_manager import ModelManager, ModelLoading, ModelNotFound, ModelSpec, ModelUnavailable
+
+
+class _FakeModel:
+    def __init__(self, name, nbytes):
+        self.name = name
+        self.nbytes = nbytes
+        self.prefixes = []
+
+    def resident_bytes(self):
+        return self.nbytes
+
+    def register_prefix(self, text):
+        self.prefixes.append(text)
+
+
+def _manager(budget, sizes, load_delay=0.0):
+    manager = ModelManager(budget_bytes=budget)
+    events = []
+
+    def spec(name):
+        def load():
+            events.append(("load", name))
+            time.sleep(load_delay)
+            return _FakeModel(name, sizes[name])
+        return ModelSpec(name=name, load=load, unload=lambda m: events.append(("unload", m.name)), aliases=(name[0],), prefixes=("System: hi",))
+
+    for name in sizes:
+        manager.register(spec(name))
+    return manager, events
+
+
+def test_models_load_on_first_use():
+    manager, events = _manager(0, {"alpha": 10, "beta": 20})
+    assert events == [] and not manager.is_loaded("alpha")
+    assert "alpha" in manager and "a" in manager and "gamma" not in manager
+    model = manager["a"]
+    assert model.name == "alpha" and model.prefixes == ["System: hi"]
+    assert manager["alpha"] is model
+    assert events == [("load", "alpha")]
+    assert manager.get("gamma") is None
+    try:
+        manager.resolve("gamma")
+        assert False, "unknown model should raise"
+    except ModelNotFound:
+        pass
+    assert manager.resolve("gamma", default="beta") == "beta"
+
+
+def test_least_recently_used_model_is_evicted_over_budget():
+    manager, events = _manager(100, {"alpha": 40, "beta": 40, "gamma": 40})
+    manager.load("alpha")
+    manager.load("beta")
+    manager.load("alpha")  # beta is now least recently used
+    manager.load("gamma")
+    assert manager.is_loaded("alpha") and manager.is_loaded("gamma")
+    assert not manager.is_loaded("beta")
+    assert ("unload", "beta") in events and manager.evictions == 1
+    assert manager.resident_bytes() == 80
+
+    # the measured size is used to make room before the next load
+    events.clear()
+    manager.load("beta")
+    assert events[0] == ("unload", "alpha") and events[1] == ("load", "beta")
+
+    assert manager.unload("gamma") and not manager.unload("gamma")
+    assert set(manager.loaded()) == {"beta"}
+
+
+def test_concurrent_requests_share_one_load():
+    manager, events = _manager(0, {"alpha": 10}, load_delay=0.1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.load("alpha"))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert events == [("load", "alpha")]
+    assert all(r is results[0] for r in results)
+
+
+def test_get_without_wait_loads_in_background():
+    manager, events = _manager(0, {"alpha": 10}, load_delay=0.2)
+
+    async def request():
+        return await manager.aget("alpha", wait=False)
+
+    try:
+        asyncio.run(request())
+        assert False, "a model that is not resident should not block the request"
+    except ModelLoading as e:
+        assert e.name == "alpha" and e.retry_after >= 1
+    assert manager.state("alpha") == "loading"
+    try:
+        asyncio.run(request())  # a second request does not start a second load
+    except ModelLoading:
+        pass
+    time.sleep(0.4)
+    assert manager.state("alpha") == "ready"
+    assert asyncio.run(request()).name == "alpha"
+    assert events == [("load", "alpha")]
+
+
+def test_failed_load_backs_off_before_retrying():
+    manager = ModelManager()
+    attempts = []
+
+    def load():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise OSError("hub unreachable")
+        return _FakeModel("alpha", 10)
+
+    manager.register(ModelSpec(name="alpha", load=load))
+    original = model_manager.MODEL_LOAD_BACKOFF
+    model_manager.MODEL_LOAD_BACKOFF = 0.1
+    try:
+        try:
+            manager.load("alpha")
+            assert False, "the first load fails"
+        except OSError:
+            pass
+        # within the backoff no request touches the loader again
+        for _ in range(3):
+            try:
+                asyncio.run(manager.aget("alpha", wait=False))
+                assert False, "a failed model should not be loaded again at once"
+            except ModelUnavailable as e:
+                assert e.name == "alpha" and e.retry_after >= 1 and "hub unreachable" in e.error
+        manager.load_in_background("alpha")
+        assert len(attempts) == 1 and manager.state("alpha") == "failed"
+        assert manager.status()[0]["retry_in"] > 0
+
+        time.sleep(0.12)
+        try:
+            manager.load("alpha")
+        except OSError:
+            pass
+        # the second failure doubles the backoff
+        time.sleep(0.12)
+        try:
+            manager.load("alpha")
+            assert False, "still backing off"
+        except ModelUnavailable:
+            pass
+        time.sleep(0.1)
+        assert manager.load("alpha").name == "alpha" and len(attempts) == 3
+        assert manager.status()[0]["retry_in"] is None
+    finally:
+        model_manager.MODEL_LOAD_BACKOFF = original
+
+
+def test_startup_preloads_both_builtin_models():
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    import main
+
+    if "MODEL_PRELOAD" in os.environ:
+        pytest.skip("MODEL_PRELOAD is set in the environment")
+    with mock.patch.dict(os.environ, {"SKIP_MODEL_LOAD": "1"}), TestClient(main.app) as client:
+        deadline = time.time() + 30
+        response = client.get("/ready")
+        while response.status_code != 200 and time.time() < deadline:
+            time.sleep(0.05)
+            response = client.get("/ready")
+    # the /predict fallback model is resident before the first request needs it
+    assert response.json() == {"ready": True, "models": {"qwen": "ready", "TinyLlama/TinyLlama-1.1B-Chat-v1.0": "ready"}}
+
+
+if __name__ == "__main__":
+    test_models_load_on_first_use()
+    test_least_recently_used_model_is_evicted_over_budget()
+    test_concurrent_requests_share_one_load()
+    test_get_without_wait_loads_in_background()
+    test_failed_load_backs_off_before_retrying()
+    test_startup_preloads_both_builtin_models()
+    print("✅ All model manager tests passed!")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for the ONNX Runtime backend of model_loader.py (MODEL_BACKEND=onnx)
+Run this from the backend directory: python test_onnx_backend.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("optimum.onnxruntime")
+
+import model_loader
+from fixtures.tiny_models import prompt, tiny_model, tiny_tokenizer, tiny_wrapper
+from model_loader import ModelWrapper
+
+
+def test_onnx_backend_matches_torch_and_reuses_its_export():
+    text = prompt(12, start=5)
+    expected = tiny_wrapper().generate_response(text, max_new_tokens=16, do_sample=False, use_cache=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir, onnx_dir = Path(tmp) / "tiny-llama", Path(tmp) / "onnx"
+        tiny_model().save_pretrained(model_dir)
+        tiny_tokenizer().save_pretrained(model_dir)
+        with mock.patch.object(model_loader, "MODEL_ONNX_DIR", str(onnx_dir)):
+            wrapper = ModelWrapper._load_model(str(model_dir), backend="onnx")
+            assert wrapper.backend == "onnx"
+            exported = list(onnx_dir.rglob("*.onnx"))
+            assert exported and wrapper.resident_bytes() > 0
+
+            reply = wrapper.generate_response(text, max_new_tokens=16, do_sample=False, use_cache=False)
+            assert reply == expected
+            streamed = "".join(wrapper.stream_response(text, max_new_tokens=16, do_sample=False, use_cache=False))
+            assert streamed == reply
+
+            # a second load reads the saved graph instead of exporting again
+            with mock.patch("optimum.onnxruntime.ORTModelForCausalLM.from_pretrained", wraps=type(wrapper.model).from_pretrained) as load:
+                ModelWrapper._load_model(str(model_dir), backend="onnx")
+            assert load.call_args.args[0] == exported[0].parent and "export" not in load.call_args.kwargs
+
+
+if __name__ == "__main__":
+    test_onnx_backend_matches_torch_and_reuses_its_export()
+    print("✅ All ONNX backend tests passed!")
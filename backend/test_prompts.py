@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Tests for per-model, token-budgeted prompt building in prompts.py
+Run this from the backend directory: python test_prompts.py
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from prompts import PromptBuilder, PromptBuilderRegistry, assemble_prompt, chat_template_markers, prompt_budget, reply_budget
+
+
+class _WordTokenizer:
+    """One token per whitespace-separated word; a ChatML template when `chat=True`."""
+
+    def __init__(self, chat=False):
+        self.vocab = {}
+        self.calls = 0
+        self.chat_template = "chatml" if chat else None
+
+    def __call__(self, text, add_special_tokens=True):
+        self.calls += 1
+        ids = [self.vocab.setdefault(word, len(self.vocab) + 1) for word in text.split()]
+        return {"input_ids": ([0] if add_special_tokens else []) + ids}
+
+    def decode(self, ids, skip_special_tokens=True):
+        words = {i: w for w, i in self.vocab.items()}
+        return " ".join(words[i] for i in ids if i in words)
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        text = "".join(f"<|im_start|> {m['role']} {m['content']} <|im_end|> " for m in messages)
+        return text + ("<|im_start|> assistant " if add_generation_prompt else "")
+
+
+def _sentencepiece_tokenizer():
+    """Small BPE with a Metaspace pre-tokenizer (a "▁" in front of every string it tokenizes) and ChatML."""
+    transformers = pytest.importorskip("transformers")
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+    tok = Tokenizer(models.BPE(unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.Metaspace(replacement="▁", prepend_scheme="first")
+    tok.decoder = decoders.Metaspace(replacement="▁", prepend_scheme="first")
+    corpus = ["you are a helpful assistant", "hello there how are you", "be brief", "user assistant system", "hi again"] * 20
+    trainer = trainers.BpeTrainer(vocab_size=200, special_tokens=["<unk>", "<|im_start|>", "<|im_end|>"], initial_alphabet=list("abcdefghijklmnopqrstuvwxyzASU:\n"))
+    tok.train_from_iterator(corpus, trainer)
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=tok, unk_token="<unk>")
+    tokenizer.chat_template = (
+        "{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n{% endfor %}"
+        "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+    )
+    return tokenizer
+
+
+def _context(results):
+    return " ".join(r["snippet"] for r in results)
+
+
+def test_plain_format_is_unchanged():
+    builder = PromptBuilder.plain(_WordTokenizer())
+    turns = [("user", "hi"), ("bot", "hello there"), ("user", "how are you")]
+    assembled = assemble_prompt(builder, "be brief", turns, 100, [{"snippet": "fine weather"}], _context)
+    assert assembled.prompt == (
+        "System: be brief\n\nWeb Search Results:\nfine weather\n"
+        "User: hi\nAssistant: hello there\nUser: how are you\nAssistant:"
+    )
+    assert assembled.ids[0] == 0  # BOS of the plain format
+    assert assembled.tokens == len(assembled.ids) == len(assembled.prompt.split()) + 1
+    assert assembled.dropped_turns == 0 and assembled.dropped_results == 0 and not assembled.truncated_turn
+    assert builder.stop_sequences == ["\nSystem:", "\nUser:", "\nAssistant:"]
+
+
+def test_chat_template_markers_and_cached_segments():
+    tokenizer = _WordTokenizer(chat=True)
+    assert chat_template_markers(tokenizer)["user_open"] == "<|im_start|> user "
+    builder = PromptBuilder.for_tokenizer(tokenizer)
+    assert builder.uses_chat_template and builder.leading_ids == []
+
+    turns = [("user", "hi"), ("assistant", "hello")]
+    text, ids = builder.build(["be brief"], turns)
+    expected = tokenizer.apply_chat_template(
+        [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}],
+        add_generation_prompt=True,
+    )
+    assert text == expected
+    assert ids == tokenizer(expected, add_special_tokens=False)["input_ids"]
+    assert builder.system_ids("be brief") == ids[:len(builder.system_ids("be brief"))]
+    assert builder.stop_sequences == ["<|im_start|> system", "<|im_start|> user", "<|im_start|> assistant"]
+
+    # the same conversation one turn later only tokenizes the new segments
+    calls = tokenizer.calls
+    builder.build(["be brief"], turns + [("user", "again")])
+    assert tokenizer.calls - calls == 1
+
+
+def test_sentencepiece_segments_do_not_gain_a_leading_space():
+    tokenizer = _sentencepiece_tokenizer()
+    # tokenized on its own, a segment starts with the "▁" (space) the tokenizer prepends
+    assert tokenizer.convert_ids_to_tokens(tokenizer("hello", add_special_tokens=False)["input_ids"])[0].startswith("▁")
+    messages = [
+        {"role": "system", "content": "be brief"}, {"role": "user", "content": "hello there"},
+        {"role": "assistant", "content": "hi"}, {"role": "user", "content": "how are you"},
+    ]
+    builder = PromptBuilder.for_tokenizer(tokenizer)
+    text, ids = builder.build(["be brief"], [(m["role"], m["content"]) for m in messages[1:]])
+    assert text == tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+    assert tokenizer.decode(ids) == text
+    assert ids == tokenizer(text, add_special_tokens=False)["input_ids"]
+    assert builder.system_ids("be brief") == ids[:len(builder.system_ids("be brief"))]
+
+    # the plain format still starts like the whole prompt tokenized at once
+    text, ids = PromptBuilder.plain(tokenizer).build(["be brief"], [("user", "hello there")])
+    assert ids[:3] == tokenizer(text)["input_ids"][:3] and tokenizer.decode(ids) == text
+
+
+def test_old_turns_are_dropped_or_truncated_to_fit():
+    builder = PromptBuilder.plain(_WordTokenizer())
+    old = [("user", f"question {i} " + "word " * 40) for i in range(10)]
+    turns = old + [("user", "latest question")]
+    assembled = assemble_prompt(builder, "be brief", turns, 260)
+    assert assembled.tokens <= 260
+    assert assembled.turns[-1] == ("user", "latest question")
+    assert assembled.turns[-2] == old[-1]  # newest history turn is kept whole
+    assert assembled.truncated_turn
+    assert assembled.dropped_turns == len(old) - (len(assembled.turns) - 1)
+    assert "question 0" not in assembled.prompt
+
+
+def test_low_ranked_search_results_are_dropped_first():
+    builder = PromptBuilder.plain(_WordTokenizer())
+    results = [{"snippet": f"rank{i} " + "fact " * 20} for i in range(5)]
+    assembled = assemble_prompt(builder, "be brief", [("user", "tell me the facts")], 60, results, _context)
+    assert assembled.tokens <= 60
+    assert [r["snippet"].split()[0] for r in assembled.results] == ["rank0", "rank1"]
+    assert assembled.dropped_results == 3
+    assert assembled.prompt.endswith("User: tell me the facts\nAssistant:")
+
+
+def test_registry_rebuilds_on_reload_and_honours_plain_override():
+    registry = PromptBuilderRegistry({"qwen": "plain"})
+    model = SimpleNamespace(tokenizer=_WordTokenizer(chat=True))
+    assert not registry.get("qwen", model).uses_chat_template
+    builder = registry.get("phi", model)
+    assert builder.uses_chat_template and registry.get("phi", model) is builder
+    model.tokenizer = _WordTokenizer(chat=True)
+    assert registry.get("phi", model) is not builder
+
+
+def test_budget_leaves_room_for_new_tokens():
+    model = SimpleNamespace(model=SimpleNamespace(config=SimpleNamespace(max_position_embeddings=2048)))
+    assert prompt_budget(model, 256, budget=4096) == 2048 - 256
+    assert prompt_budget(model, 2048, budget=4096) == 1024  # at most half the window goes to the reply
+    assert prompt_budget(model, 256, budget=1000) == 1000
+    assert prompt_budget(SimpleNamespace(), 256, budget=1000) == 1000
+
+
+def test_reply_is_clamped_to_the_rest_of_the_window():
+    model = SimpleNamespace(model=SimpleNamespace(config=SimpleNamespace(max_position_embeddings=2048)))
+    assert reply_budget(model, 500, 256) == 256
+    assert reply_budget(model, 1024, 2048) == 1024
+    assert reply_budget(model, 2048, 256) == 1
+    assert reply_budget(SimpleNamespace(), 5000, 256) == 256
+
+
+if __name__ == "__main__":
+    test_plain_format_is_unchanged()
+    test_chat_template_markers_and_cached_segments()
+    test_sentencepiece_segments_do_not_gain_a_leading_space()
+    test_old_turns_are_dropped_or_truncated_to_fit()
+    test_low_ranked_search_results_are_dropped_first()
+    test_registry_rebuilds_on_reload_and_honours_plain_override()
+    test_budget_leaves_room_for_new_tokens()
+    test_reply_is_clamped_to_the_rest_of_the_window()
+    print("✅ All prompt building tests passed!")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for CPU weight quantization in quantization.py
+Run this from the backend directory: python test_quantization.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+torch = pytest.importorskip("torch")
+
+from quantization import checkpoint_path, load_checkpoint, module_nbytes, normalize_mode, quantize_model, save_checkpoint
+
+
+def _model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(256, 256), torch.nn.ReLU(), torch.nn.Linear(256, 64))
+
+
+def test_normalize_mode():
+    assert normalize_mode(None) is None and normalize_mode("none") is None
+    assert normalize_mode(" INT8 ") == "int8"
+    with pytest.raises(ValueError):
+        normalize_mode("int3")
+
+
+def test_int8_quantization_shrinks_weights_and_roundtrips_through_cache():
+    x = torch.randn(4, 256)
+    reference = _model()
+    expected = reference(x)
+    fp32_bytes = module_nbytes(reference)
+
+    quantized = quantize_model(_model().eval(), "int8")
+    assert module_nbytes(quantized) < fp32_bytes / 3
+    assert torch.allclose(quantized(x), expected, atol=0.05)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = checkpoint_path("org/Some Model", None, "int8", cache_dir=tmp)
+        assert path.name.startswith("org--Some--Model@main-int8-")
+        # an upgraded torch or transformers must not unpickle an old checkpoint
+        import transformers
+        assert f"-transformers{transformers.__version__}" in path.name
+        assert load_checkpoint(path) is None
+        save_checkpoint(quantized, path)
+        restored = load_checkpoint(path)
+        assert torch.equal(restored(x), quantized(x))
+
+
+def test_int4_quantization_with_torchao():
+    pytest.importorskip("torchao")
+    x = torch.randn(4, 256)
+    reference = _model()
+    quantized = quantize_model(_model().eval(), "int4")
+    assert module_nbytes(quantized) < module_nbytes(reference) / 3
+    assert torch.allclose(quantized(x), reference(x), atol=0.1)
+
+
+if __name__ == "__main__":
+    test_normalize_mode()
+    test_int8_quantization_shrinks_weights_and_roundtrips_through_cache()
+    test_int4_quantization_with_torchao()
+    print("✅ All quantization tests passed!")
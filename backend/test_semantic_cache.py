@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for the semantic reply cache in semantic_cache.py
+Run this from the backend directory: python test_semantic_cache.py
+"""
+
+import sys
+import tempfile
+import zlib
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+np = pytest.importorskip("numpy")
+
+from semantic_cache import SemanticCache, SentenceEmbedder, conflicts, normalize
+
+# (cached question, new question, should the cached reply be served)
+PAIRS = [
+    ("what's sofai", "tell me about SofAi", True),
+    ("What's Python?", "what is python", True),
+    ("how do I convert a list to a string in python", "how do I convert a string to a list in python", False),
+    ("is it safe to eat raw chicken", "is it not safe to eat raw chicken", False),
+    ("is it safe to eat raw chicken", "isn't it safe to eat raw chicken", False),
+]
+
+
+def _bag_of_words(text):
+    """Word-overlap embedding: near-identical scores for negated or reordered questions."""
+    vec = np.zeros(256, dtype=np.float32)
+    for word in normalize(text).split():
+        vec[zlib.crc32(word.encode()) % 256] += 1
+    return vec / np.linalg.norm(vec)
+
+
+def test_guard_rejects_negation_and_swapped_words():
+    assert conflicts("is it safe to eat raw chicken", "is it not safe to eat raw chicken")
+    assert conflicts("do I need a visa", "don't I need a visa")
+    assert conflicts("convert a list to a string", "convert a string to a list")
+    assert not conflicts("what's sofai", "tell me about SofAi")
+    assert not conflicts("What's Python?", "what is python")
+    assert not conflicts("how do I reverse a list", "python: reverse a list")
+
+
+def test_close_embeddings_that_ask_different_things_miss():
+    cache = SemanticCache(max_entries=8, threshold=0.9, embedder=_bag_of_words)
+    for cached, _, _ in PAIRS[1:]:
+        cache.add("predict:qwen", cached, {"reply": cached})
+    assert cache.lookup("predict:qwen", "what is python")["reply"] == "What's Python?"
+    for cached, question, expected in PAIRS[2:]:
+        # the bag-of-words scores are far above the threshold ...
+        assert float(_bag_of_words(cached) @ _bag_of_words(question)) > 0.9
+        # ... but the guard keeps the cache from answering a different question
+        assert cache.lookup("predict:qwen", question) is None
+    assert cache.stats()["rejected"] == 3
+    # other namespaces (models, endpoints) never share replies
+    assert cache.lookup("chat:qwen", "what is python") is None
+
+
+def test_cache_stays_empty_without_an_embedding_model():
+    with tempfile.TemporaryDirectory() as tmp:
+        embedder = SentenceEmbedder(str(Path(tmp) / "missing-model"), local_files_only=True)
+        cache = SemanticCache(embedder=embedder)
+        cache.add("predict:qwen", "what is python", {"reply": "a language"})
+        if embedder._loading is not None:
+            embedder._loading.join(30)
+        assert not embedder.ready() and embedder.error
+        cache.add("predict:qwen", "what is python", {"reply": "a language"})
+        assert cache.lookup("predict:qwen", "what is python") is None
+        assert cache.stats()["entries"] == 0 and not cache.stats()["model_ready"]
+
+
+def test_sentence_embeddings_serve_paraphrases_only():
+    embedder = SentenceEmbedder(local_files_only=True)
+    if not embedder.load():
+        pytest.skip(f"embedding model {embedder.model_name} is not in the local Hugging Face cache")
+    for cached, question, expected in PAIRS:
+        cache = SemanticCache(max_entries=4, embedder=embedder)
+        cache.add("predict:qwen", cached, {"reply": "cached"})
+        hit = cache.lookup("predict:qwen", question)
+        assert (hit is not None) == expected, (cached, question, float(embedder(cached) @ embedder(question)))
+
+
+def test_chat_serves_sampled_replies_only_when_asked():
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    import main
+
+    hit = {"reply": "cached", "sources": []}
+    with mock.patch.object(main.semantic_cache, "lookup", return_value=hit) as lookup, \
+            mock.patch.object(main, "perform_search_async", side_effect=RuntimeError("not cached")):
+        client = TestClient(main.app, raise_server_exceptions=False)
+        # /chat samples at temperature 0.7; by default only greedy replies are cached
+        assert client.post("/chat", json={"message": "what is python"}).status_code == 500
+        assert not lookup.called
+        response = client.post("/chat", json={"message": "what is python", "cache": True})
+        assert response.json() == {"response": "cached", "sources": []}
+
+
+if __name__ == "__main__":
+    test_guard_rejects_negation_and_swapped_words()
+    test_close_embeddings_that_ask_different_things_miss()
+    test_cache_stays_empty_without_an_embedding_model()
+    test_sentence_embeddings_serve_paraphrases_only()
+    test_chat_serves_sampled_replies_only_when_asked()
+    print("✅ All semantic cache tests passed!")
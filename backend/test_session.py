@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for signed session tokens in utils.py
+Run this from the backend directory: python test_session.py
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from utils import issue_session_token, require_session, verify_session_token
+
+SECRET = b"test-secret"
+
+
+def test_token_round_trip():
+    issued = issue_session_token("ada@example.com", ttl=60, secret=SECRET)
+    claims = verify_session_token(issued["token"], secret=SECRET)
+    assert claims["sub"] == "ada@example.com"
+    assert claims["exp"] == issued["expires_at"] and issued["expires_at"] - time.time() <= 60
+
+
+def test_tampered_expired_and_foreign_tokens_are_rejected():
+    token = issue_session_token("ada@example.com", ttl=60, secret=SECRET)["token"]
+    payload, signature = token.split(".")
+    forged = issue_session_token("eve@example.com", ttl=60, secret=SECRET)["token"].split(".")[0]
+    assert verify_session_token(f"{forged}.{signature}", secret=SECRET) is None
+    assert verify_session_token(f"{payload}.{signature[:-2]}xx", secret=SECRET) is None
+    assert verify_session_token(token, secret=b"other-secret") is None
+    assert verify_session_token(issue_session_token("ada@example.com", ttl=-1, secret=SECRET)["token"], secret=SECRET) is None
+    for junk in ("", "abc", ".", "not.base64!", f"{payload}.é{signature[1:]}", "pé.sig"):
+        assert verify_session_token(junk, secret=SECRET) is None
+
+
+def test_require_session_dependency():
+    token = issue_session_token("ada@example.com")["token"]
+    assert require_session(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)) == "ada@example.com"
+    with pytest.raises(HTTPException) as missing:
+        require_session(None)
+    assert missing.value.status_code == 401
+    with pytest.raises(HTTPException):
+        require_session(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token + "x"))
+    # a non-ASCII token is a 401, not a TypeError from the signature check
+    with pytest.raises(HTTPException) as non_ascii:
+        require_session(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token + "é"))
+    assert non_ascii.value.status_code == 401
+
+
+if __name__ == "__main__":
+    test_token_round_trip()
+    test_tampered_expired_and_foreign_tokens_are_rejected()
+    test_require_session_dependency()
+    print("✅ All session token tests passed!")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for the assisted decoding options in speculative.py
+Run this from the backend directory: python test_speculative.py
+"""
+
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import torch
+
+from speculative import SpeculationStats, SpeculationTracker, normalize_speculation
+
+
+def _ids(n):
+    return torch.zeros((1, n), dtype=torch.long)
+
+
+def test_normalize_speculation():
+    assert normalize_speculation(None) is None
+    assert normalize_speculation("off") is None
+    assert normalize_speculation(" Lookup ") == "lookup"
+    assert normalize_speculation("draft") == "draft"
+    try:
+        normalize_speculation("medusa")
+        assert False, "unknown modes should raise"
+    except ValueError:
+        pass
+
+
+def test_stats_count_proposed_and_accepted_tokens():
+    stats = SpeculationStats("lookup", prompt_len=10)
+    # step 1: 5 tokens proposed, 3 accepted + 1 from the model
+    assert not stats(_ids(15), None).any()
+    assert not stats(_ids(14), None).any()
+    # step 2: no n-gram match, the model adds its own token
+    stats(_ids(14), None)
+    stats(_ids(15), None)
+    # step 3: 5 proposed, all accepted + 1
+    stats(_ids(20), None)
+    stats(_ids(21), None)
+    assert (stats.steps, stats.proposed, stats.accepted, stats.generated) == (3, 10, 8, 11)
+
+    tracker = SpeculationTracker()
+    tracker.record("qwen", stats)
+    tracker.record("qwen", stats)
+    [entry] = tracker.stats()["models"]
+    assert entry["model"] == "qwen" and entry["mode"] == "lookup" and entry["requests"] == 2
+    assert entry["acceptance_rate"] == 0.8
+    assert entry["tokens_per_step"] == round(11 / 3, 2)
+
+
+if __name__ == "__main__":
+    test_normalize_speculation()
+    test_stats_count_proposed_and_accepted_tokens()
+    print("✅ All speculative decoding tests passed!")
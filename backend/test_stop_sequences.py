@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for stop sequences enforced during generation (model_loader.py)
+Run this from the backend directory: python test_stop_sequences.py
+"""
+
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import torch
+
+from model_loader import ModelWrapper, StopSequenceCriteria, StopSequenceTrimmer
+
+PIECES = ["<pad>", "Hello", " there", ".", "\n", "User", ":", " Hi", "Us", "er", "<|im_start|>", "user", "<|im_end|>"]
+SPECIAL = ["<pad>", "<|im_start|>", "<|im_end|>"]
+
+
+class _FakeTokenizer:
+    eos_token_id = PIECES.index("<|im_end|>")
+    all_special_tokens = SPECIAL
+    all_special_ids = [PIECES.index(t) for t in SPECIAL]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(PIECES[i] for i in ids if not (skip_special_tokens and PIECES[i] in SPECIAL))
+
+
+class _FakeModel:
+    """Generates `reply` after any prompt, through `streamer` too if one is given."""
+
+    def __init__(self, reply):
+        self.reply = reply
+
+    def generate(self, input_ids, streamer=None, **kwargs):
+        if streamer is not None:
+            streamer.put(input_ids)
+            for token in self.reply:
+                streamer.put(torch.tensor([token]))
+            streamer.end()
+        return torch.cat([input_ids, torch.tensor([self.reply])], dim=1)
+
+
+def _ids(*pieces):
+    return [PIECES.index(p) for p in pieces]
+
+
+def test_criteria_stops_once_a_stop_sequence_is_generated():
+    prompt = _ids("\n", "User", ":", " Hi")  # the prompt itself contains "\nUser:"
+    criteria = StopSequenceCriteria(_FakeTokenizer(), ["\nUser:"], prompt_len=len(prompt))
+    generated = []
+    for piece in ("Hello", " there", ".", "\n", "Us", "er"):
+        generated += _ids(piece)
+        assert not criteria(torch.tensor([prompt + generated]), None).any()
+    generated += _ids(":")  # the stop sequence spans three tokens
+    assert criteria(torch.tensor([prompt + generated]), None).all()
+
+
+def test_criteria_sees_several_tokens_added_in_one_step():
+    criteria = StopSequenceCriteria(_FakeTokenizer(), ["\nUser:"])
+    assert not criteria.matches(_ids("Hello"))
+    # assisted decoding can accept many tokens at once; the window grows with them
+    assert criteria.matches(_ids("Hello", "\n", "User", ":", " Hi", " there", " there", " there", " there", " there"))
+    assert not StopSequenceCriteria(_FakeTokenizer(), []).matches(_ids("\n", "User", ":"))
+
+
+def test_trimmer_cuts_the_stop_sequence_from_streamed_text():
+    trimmer = StopSequenceTrimmer(["\nUser:"])
+    out = [trimmer.push(t) for t in ("Hello", " there.", "\nUs", "er: Hi")]
+    assert "".join(out) + trimmer.flush() == "Hello there."
+    assert trimmer.stopped
+
+
+def test_chatml_stop_sequence_with_a_special_token_is_trimmed():
+    # the model skips <|im_end|> and starts a new user turn itself
+    reply = _ids("Hello", " there", ".", "<|im_start|>", "user", "\n", " Hi")
+    wrapper = ModelWrapper(_FakeTokenizer(), _FakeModel(reply), model_name="fake-chatml")
+    params = dict(prompt_ids=_ids("\n", "User", ":", " Hi"), max_new_tokens=20, do_sample=False, use_cache=False, stop_tokens=["<|im_start|>user"])
+    assert wrapper.generate_response("Hi", **params) == "Hello there."
+    assert "".join(wrapper.stream_response("Hi", **params)) == "Hello there."
+
+    # special tokens that are not part of a stop sequence are still skipped
+    wrapper.model = _FakeModel(_ids("Hello", "<pad>", " there", "<|im_end|>"))
+    assert wrapper.generate_response("Hi", **params) == "Hello there"
+    assert "".join(wrapper.stream_response("Hi", **params)) == "Hello there"
+
+
+def test_trimmer_never_emits_part_of_a_special_token():
+    trimmer = StopSequenceTrimmer(["<|im_start|>user"], ["<|im_start|>"])
+    out = [trimmer.push(t) for t in ("Hello", "<|im_start|>", "assistant", " there")]
+    assert "".join(out) + trimmer.flush() == "Helloassistant there"
+    assert all("<" not in chunk and ">" not in chunk for chunk in out)
+
+
+if __name__ == "__main__":
+    test_criteria_stops_once_a_stop_sequence_is_generated()
+    test_criteria_sees_several_tokens_added_in_one_step()
+    test_trimmer_cuts_the_stop_sequence_from_streamed_text()
+    test_chatml_stop_sequence_with_a_special_token_is_trimmed()
+    test_trimmer_never_emits_part_of_a_special_token()
+    print("✅ All stop sequence tests passed!")
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Tests for the bounded chat history store in storage.py
+Run this from the backend directory: python test_storage.py
+"""
+
+import asyncio
+import multiprocessing
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import pytest
+
+from storage import ChatStore, MemoryChatStore, RedisChatStore, SqliteChatStore, message_size
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _message(i, size=10):
+    return {"role": "user", "text": f"{i:0{size}d}"}
+
+
+def test_sessions_are_ring_buffers():
+    store = MemoryChatStore(max_messages=3, memory_bytes=0)
+    for i in range(5):
+        assert store.add_message("s", _message(i)) == i + 1
+    assert [m["text"] for m in store.get_history("s")] == [f"{i:010d}" for i in (2, 3, 4)]
+    assert store.stats()["dropped_messages"] == 2
+    assert store.stats()["memory_mb"] * 2**20 > 3 * message_size(_message(0))
+
+
+def test_history_pages_by_cursor():
+    store = MemoryChatStore(max_messages=10, memory_bytes=0)
+    for i in range(7):
+        store.add_message("s", _message(i))
+    page = store.get_page("s", limit=3)
+    assert [m["seq"] for m in page["messages"]] == [5, 6, 7] and page["total"] == 7
+    page = store.get_page("s", before=page["next_cursor"], limit=3)
+    assert [m["seq"] for m in page["messages"]] == [2, 3, 4]
+    page = store.get_page("s", before=page["next_cursor"], limit=3)
+    assert [m["seq"] for m in page["messages"]] == [1] and page["next_cursor"] is None
+
+    # cursors stay valid after older messages fall out of the ring buffer
+    for i in range(7, 12):
+        store.add_message("s", _message(i))
+    page = store.get_page("s", before=8, limit=3)
+    assert [m["seq"] for m in page["messages"]] == [5, 6, 7]
+    assert store.get_page("s", before=3)["messages"] == []
+    assert store.get_page("missing") == {"messages": [], "next_cursor": None, "total": 0}
+
+
+def test_idle_sessions_expire():
+    clock = _Clock()
+    store = MemoryChatStore(session_ttl=60, memory_bytes=0, clock=clock)
+    store.add_message("old", _message(0))
+    clock.now = 30
+    store.add_message("recent", _message(1))
+    clock.now = 61
+    assert store.list_sessions() == ["recent"]
+    assert store.get_history("old") == []
+    assert store.stats()["expirations"] == 1
+
+
+def test_memory_budget_evicts_least_recently_used_sessions():
+    per_session = message_size(_message(0, size=1000)) + 400
+    store = MemoryChatStore(memory_bytes=3 * per_session + 500)
+    for name in ("a", "b", "c"):
+        store.add_message(name, _message(0, size=1000))
+    store.get_history("a")  # reads do not count as use; only writes do
+    store.add_message("a", _message(1, size=10))
+    store.add_message("d", _message(0, size=1000))
+    assert store.list_sessions() == ["c", "a", "d"]
+    assert store.stats()["evictions"] == 1
+    assert store.stats()["memory_mb"] * 2**20 <= store.memory_bytes
+
+    # a single session over the whole budget keeps only its newest messages
+    for i in range(10):
+        store.add_message("d", _message(i, size=1000))
+    assert store.list_sessions() == ["d"]
+    assert store.get_history("d")[-1]["text"] == f"{9:01000d}"
+    assert store.stats()["memory_mb"] * 2**20 <= store.memory_bytes
+
+
+def test_max_sessions():
+    store = MemoryChatStore(max_sessions=2, memory_bytes=0)
+    for name in ("a", "b", "c"):
+        store.add_message(name, _message(0))
+    assert store.list_sessions() == ["b", "c"]
+
+
+class _FakeRedis(socketserver.ThreadingTCPServer):
+    """Local stand-in for a Redis server: the RESP commands RedisChatStore uses, in memory."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakeRedisHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.connections = []
+        # failure injection: close the connection after running this many EXECs without replying,
+        # and answer these commands with an error
+        self.drop_after_exec = 0
+        self.fail_commands = set()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close_connections(self):
+        """Close every open connection, like a server dropping idle clients."""
+        for connection in list(self.connections):
+            connection.shutdown(socket.SHUT_RDWR)
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def run(self, name, args):
+        data = self.data
+        if name in self.fail_commands:
+            return f"-ERR injected failure for '{name}'"
+        if name in ("PING", "SELECT", "AUTH"):
+            return "+OK"
+        if name == "RPUSH":
+            data.setdefault(args[0], []).extend(args[1:])
+            return len(data[args[0]])
+        if name == "LTRIM":
+            items = data.get(args[0], [])
+            start, stop = int(args[1]), int(args[2])
+            data[args[0]] = items[start if start >= 0 else max(0, len(items) + start):(stop + 1 if stop >= 0 else len(items) + stop + 1)]
+            return "+OK"
+        if name == "LRANGE":
+            items = data.get(args[0], [])
+            stop = int(args[2])
+            return items[int(args[1]):(stop + 1 if stop >= 0 else len(items) + stop + 1)]
+        if name == "INCRBY":
+            data[args[0]] = str(int(data.get(args[0], 0)) + int(args[1]))
+            return int(data[args[0]])
+        if name == "GET":
+            return data.get(args[0])
+        if name == "EXPIRE":
+            return 1
+        if name == "DEL":
+            return sum(data.pop(key, None) is not None for key in args)
+        if name == "ZADD":
+            data.setdefault(args[0], {})[args[2]] = float(args[1])
+            return 1
+        if name == "ZREM":
+            return int(data.get(args[0], {}).pop(args[1], None) is not None)
+        if name == "ZCARD":
+            return len(data.get(args[0], {}))
+        if name in ("ZRANGEBYSCORE", "ZREMRANGEBYSCORE"):
+            def bound(text):
+                return (float(text[1:]), True) if text.startswith("(") else (float(text), False)
+            (low, low_open), (high, high_open) = bound(args[1]), bound(args[2])
+            zset = data.get(args[0], {})
+            members = [m for m, score in sorted(zset.items(), key=lambda kv: kv[1])
+                       if (low < score if low_open else low <= score) and (score < high if high_open else score <= high)]
+            if name == "ZRANGEBYSCORE":
+                return members
+            for member in members:
+                del zset[member]
+            return len(members)
+        if name == "ZPOPMIN":
+            zset = data.get(args[0], {})
+            popped = sorted(zset.items(), key=lambda kv: kv[1])[:int(args[1])]
+            for member, _ in popped:
+                del zset[member]
+            return [x for member, score in popped for x in (member, str(score))]
+        return f"-ERR unknown command '{name}'"
+
+
+class _FakeRedisHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2].decode())
+        return args
+
+    def _encode(self, reply):
+        if isinstance(reply, str) and reply[:1] in "+-":
+            return reply.encode() + b"\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self._encode(r) for r in reply)
+        data = reply.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def setup(self):
+        super().setup()
+        self.server.connections.append(self.connection)
+
+    def finish(self):
+        self.server.connections.remove(self.connection)
+        super().finish()
+
+    def handle(self):
+        queued = None
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name = args[0].upper()
+            self.server.commands += 1
+            if name == "MULTI":
+                queued, reply = [], "+OK"
+            elif name == "EXEC":
+                with self.server.lock:
+                    reply = [self.server.run(n, a) for n, a in queued]
+                queued = None
+                if self.server.drop_after_exec:
+                    self.server.drop_after_exec -= 1
+                    return
+            elif queued is not None:
+                queued.append((name, args[1:]))
+                reply = "+QUEUED"
+            else:
+                with self.server.lock:
+                    reply = self.server.run(name, args[1:])
+            self.wfile.write(self._encode(reply))
+
+
+def _store_factory(backend, directory, cleanups):
+    def make(**limits):
+        if backend == "memory":
+            return MemoryChatStore(memory_bytes=0, **limits)
+        if backend == "sqlite":
+            return SqliteChatStore(directory / "chat.db", **limits)
+        server = _FakeRedis()
+        cleanups.extend([server.shutdown, server.server_close])
+        return RedisChatStore(server.url, **limits)
+    return make
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def any_store(request, tmp_path):
+    cleanups = []
+    yield _store_factory(request.param, tmp_path, cleanups)
+    for cleanup in cleanups:
+        cleanup()
+
+
+def test_backends_share_behaviour(any_store):
+    store = any_store(max_messages=5, max_sessions=2)
+    for i in range(7):
+        store.add_message("a", _message(i))
+    assert [m["text"] for m in store.get_history("a")] == [f"{i:010d}" for i in range(2, 7)]
+    page = store.get_page("a", limit=2)
+    assert [m["seq"] for m in page["messages"]] == [6, 7] and page["total"] == 5
+    page = store.get_page("a", before=page["next_cursor"], limit=10)
+    assert [m["seq"] for m in page["messages"]] == [3, 4, 5] and page["next_cursor"] is None
+
+    store.add_message("b", _message(0))
+    store.add_message("c", _message(0))  # over max_sessions: "a" is the least recently written
+    assert sorted(store.list_sessions()) == ["b", "c"]
+    assert store.get_history("a") == []
+    store.clear("b")
+    assert store.list_sessions() == ["c"] and store.get_page("b")["total"] == 0
+    assert store.stats()["sessions"] == 1
+    store.close()
+
+
+def test_shared_backends_batch_writes(tmp_path):
+    server = _FakeRedis()
+    try:
+        for store in (SqliteChatStore(tmp_path / "chat.db", flush_interval=3600), RedisChatStore(server.url, flush_interval=3600)):
+            for i in range(10):
+                store.add_message(f"s{i % 3}", _message(i))
+            assert store.stats()["pending_messages"] == 10 and store.flushes == 0
+            commands = server.commands
+            assert len(store.get_history("s0")) == 4  # reads see this worker's queued writes
+            assert store.flushes == 1 and store.flushed_messages == 10
+            if isinstance(store, RedisChatStore):
+                assert server.commands - commands <= 30  # one pipelined batch plus the read
+            store.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_redis_store_expires_and_reconnects(tmp_path):
+    server = _FakeRedis()
+    clock = _Clock()
+    clock.now = 1000.0
+    store = RedisChatStore(server.url, session_ttl=60, flush_interval=0, clock=clock)
+    store.add_message("old", _message(0))
+    clock.now = 1030.0
+    store.add_message("recent", _message(1))
+    clock.now = 1070.0
+    assert store.list_sessions() == ["recent"]
+    store.client.close_socket()
+    store.add_message("recent", _message(2))  # a dropped connection is reopened
+    assert [m["seq"] for m in store.get_page("recent")["messages"]] == [1, 2]
+    store.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_redis_batch_is_written_at_most_once():
+    server = _FakeRedis()
+    store = RedisChatStore(server.url, flush_interval=3600)
+    store.add_message("s", _message(0))
+    server.drop_after_exec = 1  # the batch is stored, then the connection drops before the reply
+    store.flush()
+    assert store.stats()["pending_messages"] == 0 and store.dropped_messages == 1
+    assert [m["text"] for m in store.get_history("s")] == [_message(0)["text"]]
+
+    # a failed eviction after the batch was written does not queue the batch again
+    store.max_sessions = 1
+    server.fail_commands.add("ZPOPMIN")
+    store.add_message("t", _message(1))
+    store.flush()
+    assert store.stats()["pending_messages"] == 0 and store.write_errors == 2
+    server.fail_commands.clear()
+    assert [m["text"] for m in store.get_history("t")] == [_message(1)["text"]]
+
+    # a connection the server closed while idle is replaced before sending, so nothing is lost
+    server.close_connections()
+    store.add_message("t", _message(2))
+    store.flush()
+    assert [m["seq"] for m in store.get_page("t")["messages"]] == [1, 2]
+    assert store.dropped_messages == 1
+    store.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_sqlite_store_takes_the_queue_cap(tmp_path):
+    store = SqliteChatStore(tmp_path / "chat.db", max_pending=5)
+    assert store.stats()["max_pending"] == 5
+    store.close()
+
+
+def test_pending_writes_are_capped_while_the_backend_is_down():
+    server = _FakeRedis()
+    url = server.url
+    server.shutdown()
+    server.server_close()  # nothing listens on the port any more
+    store = RedisChatStore(url, flush_interval=0, max_pending=5)
+    for i in range(8):
+        store.add_message("s", _message(i))  # every write fails and stays queued
+    stats = store._batch_stats()  # stats() would also ask the server
+    assert stats["pending_messages"] == 5 and stats["dropped_messages"] == 3
+    assert stats["write_errors"] == 8
+    assert [m["text"] for _, m in store._pending] == [_message(i)["text"] for i in range(3, 8)]
+
+
+def _append_from_process(path, worker):
+    store = SqliteChatStore(Path(path), flush_interval=0.01, batch_size=7)
+    for i in range(50):
+        store.add_message("shared", {"role": "user", "text": f"{worker}-{i}"})
+    store.close()
+
+
+def test_sqlite_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "chat.db")
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=_append_from_process, args=(path, w)) for w in range(3)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join(60)
+        assert p.exitcode == 0
+    store = SqliteChatStore(Path(path), max_messages=1000)
+    page = store.get_page("shared", limit=1000)
+    assert page["total"] == 150
+    assert [m["seq"] for m in page["messages"]] == list(range(1, 151))
+    for w in range(3):  # each worker's messages keep their order
+        assert [m["text"] for m in page["messages"] if m["text"].startswith(f"{w}-")] == [f"{w}-{i}" for i in range(50)]
+    store.close()
+
+
+def test_classmethod_api():
+    ChatStore.use(MemoryChatStore())
+    ChatStore.add_message("test-classmethod", {"role": "user", "text": "hi"})
+    assert ChatStore.get_history("test-classmethod") == [{"role": "user", "text": "hi"}]
+    assert ChatStore.get_page("test-classmethod")["messages"][0]["seq"] == 1
+    assert "test-classmethod" in ChatStore.list_sessions()
+    assert ChatStore.stats()["sessions"] >= 1
+    ChatStore.clear("test-classmethod")
+    assert ChatStore.get_history("test-classmethod") == []
+
+    async def use_async_api():
+        await ChatStore.aadd_message("test-classmethod", {"role": "user", "text": "hello"})
+        assert (await ChatStore.aget_page("test-classmethod"))["total"] == 1
+        assert (await ChatStore.astats())["sessions"] >= 1
+        await ChatStore.aclear("test-classmethod")
+        assert (await ChatStore.aget_page("test-classmethod"))["total"] == 0
+    asyncio.run(use_async_api())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ChatStore.use(SqliteChatStore(Path(tmp) / "chat.db"))
+        ChatStore.add_message("test-classmethod", {"role": "user", "text": "hi"})
+        assert ChatStore.get_history("test-classmethod") == [{"role": "user", "text": "hi"}]
+        ChatStore.use(MemoryChatStore())
+
+
+if __name__ == "__main__":
+    test_sessions_are_ring_buffers()
+    test_history_pages_by_cursor()
+    test_idle_sessions_expire()
+    test_memory_budget_evicts_least_recently_used_sessions()
+    test_max_sessions()
+    for backend in ("memory", "sqlite", "redis"):
+        with tempfile.TemporaryDirectory() as tmp:
+            cleanups = []
+            test_backends_share_behaviour(_store_factory(backend, Path(tmp), cleanups))
+            for cleanup in cleanups:
+                cleanup()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_shared_backends_batch_writes(Path(tmp))
+        test_redis_store_expires_and_reconnects(Path(tmp))
+        test_redis_batch_is_written_at_most_once()
+        test_pending_writes_are_capped_while_the_backend_is_down()
+        test_sqlite_store_is_shared_between_processes(Path(tmp))
+        test_sqlite_store_takes_the_queue_cap(Path(tmp))
+    test_classmethod_api()
+    print("✅ All chat store tests passed!")
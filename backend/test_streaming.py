@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for streamed generation (IncrementalDetokenizer, StopSequenceTrimmer, stream_response)
+Run this from the backend directory: python test_streaming.py
+"""
+
+import sys
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import transformers
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+
+from fixtures.tiny_models import prompt, tiny_wrapper
+from model_loader import IncrementalDetokenizer, StopSequenceTrimmer
+
+
+def _byte_tokenizer():
+    """Byte-level BPE without merges: every UTF-8 byte is one token."""
+    alphabet = sorted(pre_tokenizers.ByteLevel.alphabet())
+    tok = Tokenizer(models.BPE({c: i for i, c in enumerate(alphabet)}, merges=[]))
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tok)
+
+
+def test_detokenizer_never_emits_half_characters():
+    tokenizer = _byte_tokenizer()
+    text = "Grüße, 世界 👋!"
+    ids = tokenizer(text)["input_ids"]
+    assert len(ids) == len(text.encode("utf-8"))
+
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    deltas = [detokenizer.push([i]) for i in ids]
+    assert "".join(deltas) == text
+    assert not any("�" in d for d in deltas)
+    # the four bytes of the emoji arrive as one delta, after its last byte
+    assert "👋" in deltas
+
+
+def test_trimmer_holds_back_a_possible_stop_sequence():
+    trimmer = StopSequenceTrimmer(["\nUser:"])
+    assert trimmer.push("  ") == ""  # leading whitespace is dropped
+    assert trimmer.push("Hi") == ""  # could still be followed by "\nUser:"
+    # the last len("\nUser:") - 1 characters are held back
+    assert trimmer.push(" there, how are you") == "Hi there, how ar"
+    assert trimmer.push("?\nUs") == "e yo"
+    # not a stop sequence after all: the rest is released by flush()
+    assert trimmer.push("e it") == "u?\nU"
+    assert trimmer.flush() == "se it"
+    assert not trimmer.stopped
+
+    assert StopSequenceTrimmer().push(" word") == "word"
+
+
+def test_streamed_reply_matches_generate_response():
+    wrapper = tiny_wrapper()
+    text = prompt(12)
+    expected = wrapper.generate_response(text, max_new_tokens=30, do_sample=False, use_cache=False)
+    assert len(expected.split()) > 10
+    assert "".join(wrapper.stream_response(text, max_new_tokens=30, do_sample=False)) == expected
+
+    # with a stop sequence from the middle of the reply, both stop at the same place
+    stop = " " + expected.split()[5]
+    trimmed = wrapper.generate_response(text, max_new_tokens=30, do_sample=False, use_cache=False, stop_tokens=[stop])
+    assert trimmed and expected.startswith(trimmed) and len(trimmed) < len(expected)
+    assert "".join(wrapper.stream_response(text, max_new_tokens=30, do_sample=False, stop_tokens=[stop])) == trimmed
+
+
+def test_streamed_reply_shares_the_response_cache():
+    from cache import ResponseCache
+
+    wrapper = tiny_wrapper()
+    wrapper.model_name = "tiny-llama-stream-cache"
+    text = prompt(10, start=20)
+    params = dict(max_new_tokens=12, do_sample=False)
+    with patch("model_loader.response_cache", ResponseCache(disk_dir=None)) as cache:
+        # a stream stopped from outside is partial and not stored
+        stop = threading.Event()
+        for _ in wrapper.stream_response(text, stop_event=stop, **params):
+            stop.set()
+        assert len(cache.memory) == 0
+
+        streamed = "".join(wrapper.stream_response(text, **params))
+        assert len(cache.memory) == 1
+        # both paths now answer from the cache without running the model
+        wrapper.model = None
+        assert wrapper.generate_response(text, **params) == streamed
+        assert list(wrapper.stream_response(text, **params)) == [streamed]
+
+
+if __name__ == "__main__":
+    test_detokenizer_never_emits_half_characters()
+    test_trimmer_holds_back_a_possible_stop_sequence()
+    test_streamed_reply_matches_generate_response()
+    test_streamed_reply_shares_the_response_cache()
+    print("✅ All streaming tests passed!")
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Tests for the web search service against a local stub server
+Run this from the backend directory: python test_web_search.py
+"""
+
+import asyncio
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+# Add backend directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+pytest.importorskip("requests")
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Answers /search.json like SerpAPI and records which connection each request used."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    requests_seen = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query).get("q", [""])[0]
+        type(self).requests_seen.append((query, self.client_address))
+        body = json.dumps({"organic_results": [
+            {"title": f"{query} result {i}", "snippet": f"About {query}", "link": f"https://example.com/{query}/{i}"}
+            for i in range(3)
+        ]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_stub():
+    _StubHandler.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _service(server):
+    from web_search import WebSearchService
+    service = WebSearchService("serpapi", serpapi_url=f"http://127.0.0.1:{server.server_port}/search.json")
+    service.serpapi_key = "test-key"
+    return service
+
+
+def test_async_search_reuses_pooled_connection():
+    pytest.importorskip("httpx")
+    server = _start_stub()
+    service = _service(server)
+
+    async def run():
+        first = await service.asearch("python", num_results=2)
+        second = await service.asearch("fastapi", num_results=2)
+        cached = await service.asearch("Python?", num_results=2)
+        await service.aclose()
+        return first, second, cached
+
+    try:
+        first, second, cached = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    assert [r["title"] for r in first] == ["python result 0", "python result 1"]
+    assert second[0]["source"] == "SerpAPI"
+    assert cached == first, "normalized repeat query should come from the cache"
+    assert len(_StubHandler.requests_seen) == 2
+    connections = {addr for _, addr in _StubHandler.requests_seen}
+    assert len(connections) == 1, "both searches should share one keep-alive connection"
+
+
+def test_concurrent_identical_async_searches_are_coalesced():
+    pytest.importorskip("httpx")
+    server = _start_stub()
+    service = _service(server)
+
+    async def run():
+        results = await asyncio.gather(*[service.asearch("bitcoin price") for _ in range(5)])
+        await service.aclose()
+        return results
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    assert all(r == results[0] for r in results)
+    assert len(_StubHandler.requests_seen) == 1
+    assert service.cache_stats()["coalesced"] == 4
+
+
+def test_blocking_search_uses_session():
+    server = _start_stub()
+    service = _service(server)
+    try:
+        results = service.search("weather lagos", num_results=3)
+    finally:
+        service.session.close()
+        server.shutdown()
+    assert len(results) == 3
+    assert results[0]["link"] == "https://example.com/weather lagos/0"
+
+
+class _FakeProviders:
+    """Provider latencies/results for the multi-provider tests (seconds, result links)."""
+
+    def __init__(self, **providers):
+        self.providers = providers
+        self.started = []
+        self.cancelled = []
+
+    async def __call__(self, provider, query, num_results):
+        self.started.append(provider)
+        delay, links = self.providers[provider]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(provider)
+            raise
+        return [{"title": link, "snippet": "", "link": link, "source": provider} for link in links]
+
+
+def test_fanout_merges_and_deduplicates_by_canonical_url():
+    from web_search import WebSearchService, canonical_url
+    assert canonical_url("https://www.Example.com/a/?utm_source=x&b=2&a=1#top") == canonical_url("http://example.com/a?a=1&b=2")
+
+    service = WebSearchService(providers=["duckduckgo", "serpapi"], mode="fanout")
+    service.serpapi_key = "test-key"
+    fake = _FakeProviders(
+        duckduckgo=(0.01, ["https://example.com/a", "https://example.com/b"]),
+        serpapi=(0.02, ["https://www.example.com/a/", "https://example.com/c"]),
+    )
+    service._asearch_uncached = fake
+    results = asyncio.run(service.asearch("merge me", num_results=5))
+    assert [r["link"] for r in results] == ["https://example.com/a", "https://example.com/b", "https://example.com/c"]
+    assert sorted(fake.started) == ["duckduckgo", "serpapi"]
+
+
+def test_hedged_search_returns_fast_provider_and_cancels_slow_one():
+    import time
+    import web_search
+
+    service = web_search.WebSearchService(providers=["duckduckgo", "serpapi"], mode="hedge")
+    service.serpapi_key = "test-key"
+    fake = _FakeProviders(
+        duckduckgo=(2.0, ["https://slow.example.com/1"]),
+        serpapi=(0.01, ["https://fast.example.com/1", "https://fast.example.com/2"]),
+    )
+    service._asearch_uncached = fake
+    original_delay = web_search.SEARCH_HEDGE_DEFAULT_DELAY
+    web_search.SEARCH_HEDGE_DEFAULT_DELAY = 0.05
+    try:
+        started = time.monotonic()
+        results = asyncio.run(service.asearch("hedge me", num_results=2))
+        elapsed = time.monotonic() - started
+    finally:
+        web_search.SEARCH_HEDGE_DEFAULT_DELAY = original_delay
+    assert [r["source"] for r in results] == ["serpapi", "serpapi"]
+    assert elapsed < 1.0, "hedged request should not wait for the slow provider"
+    assert fake.cancelled == ["duckduckgo"]
+
+
+def test_fallback_tries_providers_in_order_until_one_succeeds():
+    from web_search import WebSearchService
+
+    service = WebSearchService(providers=["serpapi", "duckduckgo"], mode="fallback")
+    service.serpapi_key = "test-key"
+    fake = _FakeProviders(serpapi=(0.01, []), duckduckgo=(0.01, ["https://example.com/a"]))
+    service._asearch_uncached = fake
+    results = asyncio.run(service.asearch("fall back", num_results=3))
+    assert [r["source"] for r in results] == ["duckduckgo"]
+    assert fake.started == ["serpapi", "duckduckgo"]
+
+    # the first provider that answers ends the search
+    fake = _FakeProviders(serpapi=(0.01, ["https://example.com/b"]), duckduckgo=(0.01, ["https://example.com/a"]))
+    service._asearch_uncached = fake
+    assert [r["source"] for r in asyncio.run(service.asearch("first wins", num_results=3))] == ["serpapi"]
+    assert fake.started == ["serpapi"]
+
+
+def test_duckduckgo_parser_extracts_organic_results():
+    from web_search import parse_duckduckgo_html
+    html = (FIXTURES / "duckduckgo_python_programming.html").read_text(encoding="utf-8")
+    results = parse_duckduckgo_html(html)
+    assert len(results) == 10, "the sponsored result should be skipped"
+    assert results[0] == {
+        "title": "Welcome to Python.org",
+        "snippet": "The official home of the Python Programming Language. ... Python knows the usual control flow "
+                   "statements that other languages speak \u2014 if, for, while and range \u2014 with some of its own twists, of course.",
+        "link": "https://www.python.org/",
+        "source": "DuckDuckGo",
+    }
+    assert results[1]["link"] == "https://en.wikipedia.org/wiki/Python_(programming_language)"
+    assert results[7]["title"] == "What Is Python Used For? A Beginner's Guide | Coursera"
+    assert not any("duckduckgo.com" in r["link"] for r in results)
+
+
+def test_duckduckgo_parser_stops_after_num_results():
+    from web_search import DuckDuckGoResultParser, parse_duckduckgo_html
+    html = (FIXTURES / "duckduckgo_python_programming.html").read_text(encoding="utf-8")
+    parser = DuckDuckGoResultParser(limit=3)
+    results = parser.parse(html)
+    assert [r["link"] for r in results] == [r["link"] for r in parse_duckduckgo_html(html)[:3]]
+    assert parser.getpos()[0] < html.count("\n") // 2, "parsing should stop early"
+    assert parse_duckduckgo_html((FIXTURES / "duckduckgo_no_results.html").read_text(encoding="utf-8")) == []
+
+
+if __name__ == "__main__":
+    test_async_search_reuses_pooled_connection()
+    test_concurrent_identical_async_searches_are_coalesced()
+    test_blocking_search_uses_session()
+    test_fanout_merges_and_deduplicates_by_canonical_url()
+    test_hedged_search_returns_fast_provider_and_cancels_slow_one()
+    test_fallback_tries_providers_in_order_until_one_succeeds()
+    test_duckduckgo_parser_extracts_organic_results()
+    test_duckduckgo_parser_stops_after_num_results()
+    print("✅ All web search tests passed!")
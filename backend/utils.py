@@ -1,10 +1,23 @@
+import base64
+import hashlib
+import hmac
+import json
 import os
+import secrets
+import time
+from typing import Optional
 from fastapi import Depends, HTTPException
-from fastapi.security import APIKeyHeader
+from fastapi.security import APIKeyHeader, HTTPAuthorizationCredentials, HTTPBearer
 
 API_KEY_HEADER = "x-api-key"
 api_key_header = APIKeyHeader(name=API_KEY_HEADER, auto_error=False)
 
+# HMAC key for session tokens. Set it for multi-worker deployments and so tokens
+# survive restarts; without it each process signs with a random key.
+SESSION_SECRET = os.getenv("SESSION_SECRET", "").encode() or secrets.token_bytes(32)
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+session_bearer = HTTPBearer(auto_error=False)
+
 def verify_api_key(api_key: str = Depends(api_key_header)):
     # Simple API key check; replace with a robust auth system when ready.
     allowed = os.getenv("API_KEYS", "").split(",") if os.getenv("API_KEYS") else []
@@ -13,3 +26,49 @@ def verify_api_key(api_key: str = Depends(api_key_header)):
     if not api_key or api_key not in allowed:
         raise HTTPException(status_code=401, detail="Invalid or missing API key")
     return api_key
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str, secret: bytes) -> str:
+    return _b64encode(hmac.new(secret, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_session_token(email: str, ttl: Optional[int] = None, secret: Optional[bytes] = None) -> dict:
+    """Signed session token for `email`: `<base64 claims>.<base64 HMAC-SHA256>`.
+
+    Verifying it needs only the secret, no database access.
+    """
+    now = int(time.time())
+    claims = {"sub": email, "iat": now, "exp": now + (ttl if ttl is not None else SESSION_TTL_SECONDS)}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return {"token": f"{payload}.{_sign(payload, secret or SESSION_SECRET)}", "expires_at": claims["exp"]}
+
+
+def verify_session_token(token: str, secret: Optional[bytes] = None) -> Optional[dict]:
+    """The token's claims if the signature is valid and it has not expired, else None."""
+    payload, _, signature = (token or "").partition(".")
+    # compared as bytes: compare_digest raises TypeError for non-ASCII str
+    if not payload or not signature or not hmac.compare_digest(signature.encode(), _sign(payload, secret or SESSION_SECRET).encode()):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) <= time.time():
+        return None
+    return claims
+
+
+def require_session(credentials: Optional[HTTPAuthorizationCredentials] = Depends(session_bearer)) -> str:
+    """Email of the signed-in user from `Authorization: Bearer <token>`; 401 otherwise."""
+    claims = verify_session_token(credentials.credentials) if credentials else None
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session", headers={"WWW-Authenticate": "Bearer"})
+    return claims["sub"]
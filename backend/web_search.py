@@ -3,22 +3,277 @@ Web Search Integration for SofAi
 Uses DuckDuckGo (free) or SerpAPI (better results)
 """
 
+import asyncio
+import importlib.util
+import re
+import time
 import requests
+from collections import deque
+from html.parser import HTMLParser
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Optional
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit
 import os
 
+try:
+    import httpx
+except Exception:  # pragma: no cover - the async client is optional
+    httpx = None
+
+try:
+    from .cache import LRUCache, SingleFlight, AsyncSingleFlight
+    from .executor import search_executor
+except Exception:
+    from cache import LRUCache, SingleFlight, AsyncSingleFlight
+    from executor import search_executor
+
+# Provider endpoints (overridable, e.g. to point tests at a local stub server)
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search.json")
+DUCKDUCKGO_URL = os.getenv("DUCKDUCKGO_URL", "https://html.duckduckgo.com/")
+DUCKDUCKGO_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+}
+
+# Connection pool shared by all searches: keep-alive avoids a DNS lookup,
+# TCP connect and TLS handshake per search.
+SEARCH_MAX_CONNECTIONS = int(os.getenv("SEARCH_MAX_CONNECTIONS", "20"))
+SEARCH_MAX_KEEPALIVE = int(os.getenv("SEARCH_MAX_KEEPALIVE", "10"))
+SEARCH_KEEPALIVE_EXPIRY = float(os.getenv("SEARCH_KEEPALIVE_EXPIRY", "30"))
+# hosts the blocking session talks to: the search providers, plus room for redirects
+_POOL_HOSTS = 4
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+SEARCH_HTTP2 = os.getenv("SEARCH_HTTP2", "true").lower() in ("1", "true", "yes") and importlib.util.find_spec("h2") is not None
+
+# Multi-provider search (async path):
+# - "fallback": one provider at a time, the next only after a failure (default)
+# - "fanout": query every provider at once
+# - "hedge": start the next provider once the current one is slower than
+#   SEARCH_HEDGE_PERCENTILE of its recent latencies
+SEARCH_PROVIDERS = [p.strip().lower() for p in os.getenv("SEARCH_PROVIDERS", "").split(",") if p.strip()]
+SEARCH_MODE = os.getenv("SEARCH_MODE", "fallback").lower()
+SEARCH_HEDGE_PERCENTILE = float(os.getenv("SEARCH_HEDGE_PERCENTILE", "0.9"))
+SEARCH_HEDGE_MIN_DELAY = float(os.getenv("SEARCH_HEDGE_MIN_DELAY", "0.2"))
+# hedge delay used until a provider has enough latency samples
+SEARCH_HEDGE_DEFAULT_DELAY = float(os.getenv("SEARCH_HEDGE_DEFAULT_DELAY", "1.0"))
+
+_TRACKING_PARAMS = ("utm_", "gclid", "fbclid", "mc_cid", "mc_eid", "ref", "ref_src")
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2048"))
+# TTLs (seconds) per query class: fast-moving data, recent events, everything else
+SEARCH_TTL_VOLATILE = float(os.getenv("SEARCH_TTL_VOLATILE", "120"))
+SEARCH_TTL_RECENT = float(os.getenv("SEARCH_TTL_RECENT", "900"))
+SEARCH_TTL_EVERGREEN = float(os.getenv("SEARCH_TTL_EVERGREEN", "21600"))
+
+VOLATILE_KEYWORDS = ("price", "prices", "stock", "stocks", "weather", "score", "scores", "live", "today", "now", "breaking", "exchange rate")
+RECENT_KEYWORDS = ("latest", "news", "current", "recent", "update", "updates", "trending", "new", "this week")
+_VOLATILE_RE = re.compile(r"\b(?:" + "|".join(VOLATILE_KEYWORDS) + r")\b")
+_RECENT_RE = re.compile(r"\b(?:" + "|".join(RECENT_KEYWORDS) + r")\b")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for cache keys: case, whitespace and trailing punctuation."""
+    return re.sub(r"\s+", " ", query.lower()).strip(" ?!.,;:")
+
+
+def search_ttl(query: str) -> float:
+    """How long results for `query` stay fresh, based on its query class."""
+    q = normalize_query(query)
+    if _VOLATILE_RE.search(q):
+        return SEARCH_TTL_VOLATILE
+    if _RECENT_RE.search(q):
+        return SEARCH_TTL_RECENT
+    return SEARCH_TTL_EVERGREEN
+
+
+def canonical_url(link: str) -> str:
+    """Canonical form of a result URL used to de-duplicate results across providers.
+
+    Drops the scheme, a leading "www.", trailing slashes, fragments and
+    tracking parameters, and sorts the remaining query parameters.
+    """
+    parts = urlsplit(link.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/") or "/"
+    params = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not k.lower().startswith(_TRACKING_PARAMS))
+    query = urlencode(params)
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+class LatencyTracker:
+    """Recent per-provider latencies, used to decide when to hedge."""
+
+    def __init__(self, window: int = 100, min_samples: int = 5):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+
+    def record(self, provider: str, seconds: float) -> None:
+        self._samples.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, provider: str, q: float) -> Optional[float]:
+        samples = self._samples.get(provider)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class DuckDuckGoResultParser(HTMLParser):
+    """Event-based parser for html.duckduckgo.com result pages.
+
+    Collects title, link and snippet from each `div.result` as the tags
+    stream past, without building a DOM, and stops as soon as `limit`
+    organic results are complete. Ads (`result--ad`, `y.js` links) are
+    skipped and `//duckduckgo.com/l/?uddg=...` redirects are unwrapped.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.results: List[Dict[str, str]] = []
+        self._current: Optional[Dict[str, str]] = None
+        self._field: Optional[str] = None
+        self._field_tag: Optional[str] = None
+        self._text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ("div", "a"):
+            return
+        classes = ""
+        href = ""
+        for name, value in attrs:
+            if name == "class":
+                classes = value or ""
+            elif name == "href":
+                href = value or ""
+        if not classes:
+            return
+        if tag == "div" and "result" in classes.split():
+            self._finish_result()
+            ad = "result--ad" in classes
+            self._current = None if ad else {"title": "", "snippet": "", "link": "", "source": "DuckDuckGo"}
+        elif self._current is None or self._field is not None:
+            return
+        elif tag == "a" and "result__a" in classes:
+            link = duckduckgo_target_url(href)
+            if not link:  # sponsored result without the result--ad class
+                self._current = None
+                return
+            self._current["link"] = link
+            self._start_field("title", tag)
+        elif "result__snippet" in classes:
+            self._start_field("snippet", tag)
+
+    def handle_endtag(self, tag):
+        if self._field is None or tag != self._field_tag:
+            return
+        self._current[self._field] = " ".join("".join(self._text).split())
+        finished = self._field == "snippet"
+        self._field = self._field_tag = None
+        if finished:
+            self._finish_result()
+
+    def handle_data(self, data):
+        if self._field is not None:
+            self._text.append(data)
+
+    def _start_field(self, field: str, tag: str):
+        self._field, self._field_tag = field, tag
+        self._text = []
+
+    def _finish_result(self):
+        current, self._current = self._current, None
+        self._field = self._field_tag = None
+        if current and current["title"] and current["link"]:
+            self.results.append(current)
+            if self.limit is not None and len(self.results) >= self.limit:
+                raise _StopParsing
+
+    def parse(self, html: str) -> List[Dict[str, str]]:
+        # everything before the first result is header, form and region list
+        start = html.find('<div class="result')
+        if start < 0:
+            return []
+        try:
+            self.feed(html[start:])
+            self._finish_result()
+        except _StopParsing:
+            pass
+        return self.results
+
+
+def duckduckgo_target_url(href: str) -> str:
+    """Return the destination of a DuckDuckGo result link, or "" for ad links."""
+    if "duckduckgo.com/y.js" in href:
+        return ""
+    if "duckduckgo.com/l/" in href:
+        target = parse_qs(urlsplit(href).query).get("uddg")
+        return target[0] if target else ""
+    return "https:" + href if href.startswith("//") else href
+
+
+def parse_duckduckgo_html(html: str, num_results: Optional[int] = None) -> List[Dict[str, str]]:
+    """Extract organic results from a DuckDuckGo HTML page"""
+    if num_results is not None and num_results <= 0:
+        return []
+    return DuckDuckGoResultParser(num_results).parse(html)
+
+
 class WebSearchService:
     """Handles web search queries using multiple backends"""
     
-    def __init__(self, api_provider: str = "duckduckgo"):
+    def __init__(self, api_provider: str = "duckduckgo", cache_max_entries: int = SEARCH_CACHE_MAX_ENTRIES, serpapi_url: str = SERPAPI_URL, duckduckgo_url: str = DUCKDUCKGO_URL, providers: Optional[List[str]] = None, mode: str = SEARCH_MODE):
         self.api_provider = api_provider.lower()
+        self.providers = [p.lower() for p in (providers or SEARCH_PROVIDERS)] or [self.api_provider]
+        self.mode = mode
+        self.latency = LatencyTracker()
         self.serpapi_key = os.getenv("SERPAPI_KEY", "")
+        self.serpapi_url = serpapi_url
+        self.duckduckgo_url = duckduckgo_url
         self.timeout = 10
+        self.cache = LRUCache(max_entries=cache_max_entries)
+        self.flight = SingleFlight()
+        self.async_flight = AsyncSingleFlight()
+        # pooled keep-alive session for the blocking path
+        self.session = requests.Session()
+        # pool_connections is the number of per-host pools (one per search provider host);
+        # pool_maxsize is how many connections each of them keeps open for reuse
+        adapter = HTTPAdapter(pool_connections=_POOL_HOSTS, pool_maxsize=SEARCH_MAX_CONNECTIONS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._async_client = None
+        self._async_client_loop = None
+
+    def _provider(self) -> str:
+        return "serpapi" if self.api_provider == "serpapi" and self.serpapi_key else "duckduckgo"
+
+    def _active_providers(self) -> List[str]:
+        """Configured providers that can actually be queried, in priority order."""
+        active = [p for p in self.providers if p != "serpapi" or self.serpapi_key]
+        return active or ["duckduckgo"]
+
+    def _cache_key(self, provider: str, query: str, num_results: int):
+        return (provider, normalize_query(query), num_results)
+
+    def _remember(self, key, query: str, results: List[Dict[str, str]]) -> None:
+        # fallback placeholders and empty answers are retried next time
+        if results and all(r.get("source") != "Fallback" for r in results):
+            self.cache.set(key, results, ttl=search_ttl(query))
     
     def search(self, query: str, num_results: int = 5) -> List[Dict[str, str]]:
         """
         Perform web search and return results
         
+        Results are cached per normalized query and provider with a TTL that
+        depends on the query class, and concurrent identical searches share
+        one network request.
+        
         Args:
             query: Search query string
             num_results: Number of results to return
@@ -26,32 +281,194 @@ class WebSearchService:
         Returns:
             List of search results with title, snippet, and link
         """
+        provider = self._provider()
+        key = self._cache_key(provider, query, num_results)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        def _fetch():
+            results = self._search_uncached(provider, query, num_results)
+            self._remember(key, query, results)
+            return results
+
+        results, _ = self.flight.do(key, _fetch)
+        return list(results)
+
+    async def asearch(self, query: str, num_results: int = 5) -> List[Dict[str, str]]:
+        """
+        Awaitable version of `search` using the pooled async HTTP client
+        
+        Shares the result cache with `search`. Without httpx installed the
+        blocking search runs on the search executor instead. With several
+        providers and SEARCH_MODE "fanout" or "hedge", they are queried
+        concurrently and their results merged; in "fallback" mode they are
+        tried in order until one returns results.
+        """
+        providers = self._active_providers()
+        multi = len(providers) > 1
+        provider = "+".join(providers) if multi else self._provider()
+        key = self._cache_key(provider, query, num_results)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        async def _fetch():
+            if multi and self.mode in ("fanout", "hedge"):
+                results = await self._asearch_multi(query, num_results, providers, hedge=self.mode == "hedge")
+            elif multi:
+                results = await self._asearch_fallback(query, num_results, providers)
+            else:
+                results = await self._asearch_uncached(provider, query, num_results)
+            self._remember(key, query, results)
+            return results
+
+        results, _ = await self.async_flight.do(key, _fetch)
+        return list(results)
+
+    async def _asearch_uncached(self, provider: str, query: str, num_results: int) -> List[Dict[str, str]]:
+        if httpx is None:
+            return await search_executor.run(self._search_uncached, provider, query, num_results)
+        try:
+            if provider == "serpapi":
+                return await self._asearch_serpapi(query, num_results)
+            else:
+                return await self._asearch_duckduckgo(query, num_results)
+        except Exception as e:
+            print(f"Web search error: {e}")
+            return []
+
+    async def _timed_search(self, provider: str, query: str, num_results: int) -> List[Dict[str, str]]:
+        started = time.monotonic()
+        results = await self._asearch_uncached(provider, query, num_results)
+        if any(r.get("source") != "Fallback" for r in results):
+            self.latency.record(provider, time.monotonic() - started)
+        return results
+
+    async def _asearch_fallback(self, query: str, num_results: int, providers: List[str]) -> List[Dict[str, str]]:
+        """Query `providers` one at a time, moving to the next only when one fails or finds nothing."""
+        for provider in providers:
+            results = await self._timed_search(provider, query, num_results)
+            if any(r.get("source") != "Fallback" for r in results):
+                return results
+        return self._get_fallback_results(query)
+
+    def _hedge_delay(self, provider: str) -> float:
+        observed = self.latency.percentile(provider, SEARCH_HEDGE_PERCENTILE)
+        if observed is None:
+            return SEARCH_HEDGE_DEFAULT_DELAY
+        return max(SEARCH_HEDGE_MIN_DELAY, observed)
+
+    async def _asearch_multi(self, query: str, num_results: int, providers: List[str], hedge: bool) -> List[Dict[str, str]]:
+        """
+        Query several providers concurrently and merge their results
+        
+        In fan-out mode every provider starts at once; in hedge mode the next
+        provider starts when the running one is slower than its usual
+        latency or comes back short. Results are de-duplicated by canonical
+        URL and the search returns as soon as `num_results` real hits exist;
+        still-running providers are cancelled.
+        """
+        waiting = list(providers)
+        running: Dict[asyncio.Task, str] = {}
+        merged: List[Dict[str, str]] = []
+        seen = set()
+
+        def _launch():
+            provider = waiting.pop(0)
+            running[asyncio.ensure_future(self._timed_search(provider, query, num_results))] = provider
+
+        _launch()
+        while waiting and not hedge:
+            _launch()
+
+        try:
+            while running:
+                timeout = self._hedge_delay(next(iter(running.values()))) if hedge and waiting else None
+                done, _ = await asyncio.wait(running.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # the running provider is slower than usual: hedge with the next one
+                    _launch()
+                    continue
+                for task in done:
+                    running.pop(task)
+                    for result in task.result():
+                        if result.get("source") == "Fallback" or not result.get("link"):
+                            continue
+                        url = canonical_url(result["link"])
+                        if url not in seen:
+                            seen.add(url)
+                            merged.append(result)
+                if len(merged) >= num_results:
+                    break
+                if hedge and waiting and not running:
+                    # came back short or failed: move on without waiting for the timer
+                    _launch()
+        finally:
+            for task in running:
+                task.cancel()
+
+        return merged[:num_results] if merged else self._get_fallback_results(query)
+
+    def _get_async_client(self):
+        """Pooled keep-alive client, created once per event loop."""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            limits = httpx.Limits(
+                max_connections=SEARCH_MAX_CONNECTIONS,
+                max_keepalive_connections=SEARCH_MAX_KEEPALIVE,
+                keepalive_expiry=SEARCH_KEEPALIVE_EXPIRY,
+            )
+            self._async_client = httpx.AsyncClient(http2=SEARCH_HTTP2, limits=limits, timeout=self.timeout, follow_redirects=True)
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def aclose(self) -> None:
+        """Close pooled connections (call on application shutdown)."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        self.session.close()
+
+    def _search_uncached(self, provider: str, query: str, num_results: int) -> List[Dict[str, str]]:
         try:
-            if self.api_provider == "serpapi" and self.serpapi_key:
+            if provider == "serpapi":
                 return self._search_serpapi(query, num_results)
             else:
                 return self._search_duckduckgo(query, num_results)
         except Exception as e:
             print(f"Web search error: {e}")
             return []
+
+    def cache_stats(self) -> Dict[str, object]:
+        stats = self.cache.stats()
+        # searches that shared an in-flight request, on the blocking and the async path
+        stats["coalesced"] = self.flight.coalesced + self.async_flight.coalesced
+        return stats
     
     def _search_serpapi(self, query: str, num_results: int) -> List[Dict[str, str]]:
         """
         Search using SerpAPI (Google results)
         Requires SERPAPI_KEY environment variable
         """
-        url = "https://serpapi.com/search.json"
-        
-        params = {
+        response = self.session.get(self.serpapi_url, params=self._serpapi_params(query, num_results), timeout=self.timeout)
+        response.raise_for_status()
+        return self._parse_serpapi_results(response.json(), num_results)
+
+    async def _asearch_serpapi(self, query: str, num_results: int) -> List[Dict[str, str]]:
+        """Async SerpAPI search over the pooled client"""
+        response = await self._get_async_client().get(self.serpapi_url, params=self._serpapi_params(query, num_results))
+        response.raise_for_status()
+        return self._parse_serpapi_results(response.json(), num_results)
+
+    def _serpapi_params(self, query: str, num_results: int) -> Dict[str, object]:
+        return {
             "q": query,
             "api_key": self.serpapi_key,
             "num": num_results
         }
-        
-        response = requests.get(url, params=params, timeout=self.timeout)
-        response.raise_for_status()
-        data = response.json()
-        
+
+    def _parse_serpapi_results(self, data: dict, num_results: int) -> List[Dict[str, str]]:
         results = []
         
         for item in data.get("organic_results", [])[:num_results]:
@@ -69,37 +486,42 @@ class WebSearchService:
         Search using DuckDuckGo (free, no API key needed)
         """
         # Using unofficial DuckDuckGo API endpoint
-        url = "https://html.duckduckgo.com/"
-        
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+        params = {
+            "q": query,
+            "t": "sofai"
         }
         
+        try:
+            response = self.session.get(self.duckduckgo_url, params=params, headers=DUCKDUCKGO_HEADERS, timeout=self.timeout)
+            response.raise_for_status()
+            
+            return self._parse_duckduckgo_results(response.text, num_results)
+            
+        except Exception as e:
+            print(f"DuckDuckGo search failed: {e}")
+            return self._get_fallback_results(query)
+
+    async def _asearch_duckduckgo(self, query: str, num_results: int) -> List[Dict[str, str]]:
+        """Async DuckDuckGo search over the pooled client"""
         params = {
             "q": query,
             "t": "sofai"
         }
         
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=self.timeout)
+            response = await self._get_async_client().get(self.duckduckgo_url, params=params, headers=DUCKDUCKGO_HEADERS)
             response.raise_for_status()
-            
-            # Parse results from HTML (simplified parsing)
-            results = self._parse_duckduckgo_results(response.text)
-            return results[:num_results]
+            return self._parse_duckduckgo_results(response.text, num_results)
             
         except Exception as e:
             print(f"DuckDuckGo search failed: {e}")
             return self._get_fallback_results(query)
     
-    def _parse_duckduckgo_results(self, html: str) -> List[Dict[str, str]]:
+    def _parse_duckduckgo_results(self, html: str, num_results: Optional[int] = None) -> List[Dict[str, str]]:
         """
-        Parse DuckDuckGo HTML results
-        This is a simplified parser - a real implementation would use BeautifulSoup
+        Parse DuckDuckGo HTML results, stopping after `num_results` hits
         """
-        # For now, return empty list - implement proper HTML parsing with BeautifulSoup
-        # or use the official API wrapper
-        return []
+        return parse_duckduckgo_html(html, num_results)
     
     def _get_fallback_results(self, query: str) -> List[Dict[str, str]]:
         """
@@ -144,6 +566,38 @@ def perform_search(query: str, num_results: int = 5) -> List[Dict[str, str]]:
     return search_service.search(query, num_results)
 
 
+async def perform_search_async(query: str, num_results: int = 5) -> List[Dict[str, str]]:
+    """
+    Awaitable web search over pooled keep-alive connections
+    
+    Args:
+        query: Search query
+        num_results: Number of results to return
+        
+    Returns:
+        List of search results
+    """
+    global search_service
+    if search_service is None:
+        search_service = initialize_search_service()
+    
+    return await search_service.asearch(query, num_results)
+
+
+async def close_search_service() -> None:
+    """Release pooled search connections"""
+    if search_service is not None:
+        await search_service.aclose()
+
+
+def search_cache_stats() -> Dict[str, object]:
+    """Hit/miss counters of the search-result cache."""
+    global search_service
+    if search_service is None:
+        search_service = initialize_search_service()
+    return search_service.cache_stats()
+
+
 def needs_search(query: str) -> bool:
     """
     Determine if a query requires web search
@@ -1,6 +1,6 @@
 import { useState, useRef, useEffect } from 'react';
 import ReactMarkdown from 'react-markdown';
-import { sendMessage, login, signup, checkEmail } from './api';
+import { sendMessage, login, signup, checkEmail, appendMessage, replaceMessages, getConversationMessages, listConversations, deleteConversation as deleteRemoteConversation, clearSession } from './api';
 import CommandControl from './CommandControl';
 import './Chat.css';
 
@@ -37,6 +37,8 @@ export default function Chat() {
   const inputRef = useRef(null);
   const recognitionRef = useRef(null);
   const wakeWordRecognitionRef = useRef(null);
+  // conversation saves to the server, chained so they arrive in order
+  const saveQueue = useRef(Promise.resolve());
   const [wakeWordActive, setWakeWordActive] = useState(false);
 
   const getModelName = (model) => {
@@ -128,6 +130,7 @@ export default function Chat() {
     setIsLoggedIn(false);
     setUser(null);
     localStorage.removeItem('user');
+    clearSession();
     // Clear conversations when logging out
     setConversations([]);
     setMessages([]);
@@ -156,22 +159,36 @@ export default function Chat() {
     }
   };
 
-  const switchConversation = (conversationId) => {
+  const fromServerMessage = ({ role, content, meta }) => ({ ...(meta || {}), role, text: content });
+
+  const switchConversation = async (conversationId) => {
     const conversation = conversations.find(c => c.id === conversationId);
     if (conversation) {
       setCurrentConversationId(conversationId);
       setMessages(conversation.messages);
       setSidebarOpen(false);
+      // conversations listed from the server load their newest page when opened
+      if (conversation.remote && isLoggedIn) {
+        const page = await getConversationMessages(conversationId);
+        if (page.success) {
+          const loaded = page.messages.map(fromServerMessage);
+          setMessages(loaded);
+          setConversations(prev => prev.map(c => c.id === conversationId ? { ...c, messages: loaded, remote: false } : c));
+        }
+      }
     }
   };
 
   const saveCurrentConversation = (updatedMessages) => {
+    const previous = conversations.find(c => c.id === currentConversationId);
+    // error placeholders are shown but never saved
+    const saved = updatedMessages.filter(m => !m.error);
     const updatedConversations = conversations.map(c => {
       if (c.id === currentConversationId) {
-        const title = updatedMessages.length > 0 
-          ? updatedMessages[0].text.substring(0, 30) + '...'
+        const title = saved.length > 0 
+          ? saved[0].text.substring(0, 30) + '...'
           : 'New Conversation';
-        return { ...c, messages: updatedMessages, title };
+        return { ...c, messages: saved, title };
       }
       return c;
     });
@@ -181,6 +198,21 @@ export default function Chat() {
     // Only save to localStorage if user is logged in
     if (isLoggedIn) {
       localStorage.setItem('conversations', JSON.stringify(updatedConversations));
+      if (!previous) return;
+      const conversationId = currentConversationId;
+      const title = updatedConversations.find(c => c.id === conversationId).title;
+      // messages are replaced, never changed in place, so an unchanged one is the same object
+      const appended = saved.length >= previous.messages.length && previous.messages.every((m, i) => saved[i] === m);
+      // saves run one after another so the server sees them in order
+      if (appended) {
+        // send only the messages added since the last save
+        saved.slice(previous.messages.length).forEach(message => {
+          saveQueue.current = saveQueue.current.then(() => appendMessage(conversationId, message, title));
+        });
+      } else {
+        // a message was edited, deleted or regenerated: resend the conversation
+        saveQueue.current = saveQueue.current.then(() => replaceMessages(conversationId, saved, title));
+      }
     }
   };
 
@@ -191,6 +223,7 @@ export default function Chat() {
     // Only save to localStorage if user is logged in
     if (isLoggedIn) {
       localStorage.setItem('conversations', JSON.stringify(updatedConversations));
+      deleteRemoteConversation(conversationId);
     }
     
     if (currentConversationId === conversationId) {
@@ -216,7 +249,7 @@ export default function Chat() {
   const editMessage = (index, newText) => {
     if (!newText.trim()) return;
     const updatedMessages = [...messages];
-    updatedMessages[index].text = newText;
+    updatedMessages[index] = { ...updatedMessages[index], text: newText };
     setMessages(updatedMessages);
     saveCurrentConversation(updatedMessages);
   };
@@ -234,8 +267,10 @@ export default function Chat() {
     try {
       const response = await sendMessage(userMessage, selectedModel, history);
       const updatedMessages = [...messages];
+      // a regenerated reply replaces an error placeholder for good
+      const { error, ...previousReply } = updatedMessages[index];
       updatedMessages[index] = {
-        ...updatedMessages[index],
+        ...previousReply,
         text: response.reply,
         model_used: response.model_used
       };
@@ -427,6 +462,20 @@ export default function Chat() {
         }
       }
 
+      // Add conversations saved from other devices as summaries; their messages load when opened
+      if (savedUser) {
+        listConversations().then(result => {
+          if (!result.success) return;
+          setConversations(prev => {
+            const known = new Set(prev.map(c => c.id));
+            const remote = result.conversations
+              .filter(c => !known.has(c.id))
+              .map(c => ({ id: c.id, title: c.title || 'New Conversation', messages: [], createdAt: c.created_at, remote: true }));
+            return [...prev, ...remote];
+          });
+        });
+      }
+
       // Initialize Web Speech API with error handling
       try {
         const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
@@ -524,7 +573,8 @@ export default function Chat() {
       const updatedMessages = [...newMessages, {
         role: 'assistant',
         text: '❌ Error: Unable to connect to the backend.',
-        model_used: 'error'
+        model_used: 'error',
+        error: true
       }];
       setMessages(updatedMessages);
       saveCurrentConversation(updatedMessages);
@@ -559,7 +609,8 @@ export default function Chat() {
       const updatedMessages = [...newMessages, {
         role: 'assistant',
         text: '❌ System Commander not running. Start it with: python system_commander.py',
-        model_used: 'system'
+        model_used: 'system',
+        error: true
       }];
       setMessages(updatedMessages);
       saveCurrentConversation(updatedMessages);
@@ -45,6 +45,135 @@ export async function getHistory(){
 
 export function getApiBase(){ return API_BASE; }
 
+// ============= Conversation API =============
+// Conversations are synced as deltas: each new message is appended on its own
+// and histories are read back a page at a time. Editing or deleting a message
+// replaces the conversation's messages once. Requests are authenticated
+// with the session token saved by login/signup.
+
+const SESSION_TOKEN_KEY = 'sessionToken';
+
+function authHeaders(headers = {}) {
+  const token = localStorage.getItem(SESSION_TOKEN_KEY);
+  return token ? { ...headers, Authorization: `Bearer ${token}` } : headers;
+}
+
+export function clearSession() {
+  localStorage.removeItem(SESSION_TOKEN_KEY);
+}
+
+/**
+ * Append one message to a conversation (created by its first message)
+ * @param {string} conversationId - Conversation id
+ * @param {Object} message - { role, text|content, ...extra fields kept as meta }
+ * @param {string} title - Conversation title (optional)
+ * @returns {Promise<Object>} - { success, seq, message_count } or { success: false, error }
+ */
+export async function appendMessage(conversationId, message, title) {
+  const { role, text, content, ...meta } = message;
+  try {
+    const response = await fetch(`${API_BASE}/conversations/${encodeURIComponent(conversationId)}/messages`, {
+      method: 'POST',
+      headers: authHeaders({ 'Content-Type': 'application/json' }),
+      body: JSON.stringify({ role, content: content ?? text ?? '', title, meta })
+    });
+    const data = await response.json();
+    if (!response.ok) {
+      return { success: false, error: data.detail || 'Saving message failed' };
+    }
+    return data;
+  } catch (error) {
+    console.error('Append message error:', error);
+    return { success: false, error: error.message || 'Network error' };
+  }
+}
+
+/**
+ * Replace all messages of a conversation (after an edit, delete or regenerate)
+ * @param {string} conversationId - Conversation id
+ * @param {Array<Object>} messages - [{ role, text|content, ...extra fields kept as meta }], oldest first
+ * @param {string} title - Conversation title (optional)
+ * @returns {Promise<Object>} - { success, message_count } or { success: false, error }
+ */
+export async function replaceMessages(conversationId, messages, title) {
+  const body = messages.map(({ role, text, content, ...meta }) => ({ role, content: content ?? text ?? '', meta }));
+  try {
+    const response = await fetch(`${API_BASE}/conversations/${encodeURIComponent(conversationId)}/messages`, {
+      method: 'PUT',
+      headers: authHeaders({ 'Content-Type': 'application/json' }),
+      body: JSON.stringify({ messages: body, title })
+    });
+    const data = await response.json();
+    if (!response.ok) {
+      return { success: false, error: data.detail || 'Saving conversation failed' };
+    }
+    return data;
+  } catch (error) {
+    console.error('Replace messages error:', error);
+    return { success: false, error: error.message || 'Network error' };
+  }
+}
+
+/**
+ * Fetch a page of a conversation's messages, oldest first
+ * @param {string} conversationId - Conversation id
+ * @param {Object} options - { before: next_cursor for older messages, after: last seen seq for new ones, limit }
+ * @returns {Promise<Object>} - { success, messages, next_cursor, message_count }
+ */
+export async function getConversationMessages(conversationId, { before, after, limit } = {}) {
+  const params = new URLSearchParams();
+  if (before != null) params.set('before', before);
+  if (after != null) params.set('after', after);
+  if (limit != null) params.set('limit', limit);
+  try {
+    const response = await fetch(`${API_BASE}/conversations/${encodeURIComponent(conversationId)}/messages?${params}`, { headers: authHeaders() });
+    const data = await response.json();
+    if (!response.ok) {
+      return { success: false, error: data.detail || 'Loading messages failed' };
+    }
+    return data;
+  } catch (error) {
+    console.error('Load messages error:', error);
+    return { success: false, error: error.message || 'Network error' };
+  }
+}
+
+/**
+ * List conversation summaries (id, title, message_count, preview), most recent first
+ * @param {Object} options - { cursor: next_cursor of the previous page, limit }
+ * @returns {Promise<Object>} - { success, conversations, next_cursor }
+ */
+export async function listConversations({ cursor, limit } = {}) {
+  const params = new URLSearchParams();
+  if (cursor != null) params.set('cursor', cursor);
+  if (limit != null) params.set('limit', limit);
+  try {
+    const response = await fetch(`${API_BASE}/conversations?${params}`, { headers: authHeaders() });
+    const data = await response.json();
+    if (!response.ok) {
+      return { success: false, error: data.detail || 'Loading conversations failed' };
+    }
+    return data;
+  } catch (error) {
+    console.error('List conversations error:', error);
+    return { success: false, error: error.message || 'Network error' };
+  }
+}
+
+/**
+ * Delete a conversation and its messages
+ * @param {string} conversationId - Conversation id
+ */
+export async function deleteConversation(conversationId) {
+  try {
+    const response = await fetch(`${API_BASE}/conversations/${encodeURIComponent(conversationId)}`, { method: 'DELETE', headers: authHeaders() });
+    return { success: response.ok };
+  } catch (error) {
+    console.error('Delete conversation error:', error);
+    return { success: false, error: error.message || 'Network error' };
+  }
+}
+
 // ============= Authentication API =============
 
 /**
@@ -78,6 +207,7 @@ export async function signup(userData) {
       };
     }
 
+    localStorage.setItem(SESSION_TOKEN_KEY, data.token);
     return {
       success: true,
       message: data.message,
@@ -115,6 +245,7 @@ export async function login(email, password) {
       };
     }
 
+    localStorage.setItem(SESSION_TOKEN_KEY, data.token);
     return {
       success: true,
       message: data.message,
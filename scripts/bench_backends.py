@@ -0,0 +1,91 @@
+"""Compare the torch and onnx inference backends of ModelWrapper.
+
+Every backend runs in its own subprocess (cold start included). Reports
+load time, time to first token, greedy decode tokens/sec and whether the
+outputs match the torch backend.
+
+    python scripts/bench_backends.py --model Qwen/Qwen2.5-0.5B-Instruct
+    python scripts/bench_backends.py --backends onnx --new-tokens 64
+
+The first onnx run includes the export; later runs load the exported
+graph from MODEL_ONNX_DIR.
+"""
+
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+PROMPTS = [
+    'System: You are a helpful assistant.\nUser: What is the capital of Nigeria?\nAssistant:',
+    'System: You are a helpful assistant.\nUser: Explain what a Python list comprehension is.\nAssistant:',
+    'System: You are a helpful assistant.\nUser: Why is the sky blue?\nAssistant:',
+]
+
+
+def run_backend(model_name: str, backend: str, new_tokens: int) -> dict:
+    """Runs inside the child process."""
+    started = time.perf_counter()
+    from model_loader import ModelWrapper
+    wrapper = ModelWrapper.load_cached(model_name, backend=backend)
+    load_seconds = time.perf_counter() - started
+
+    outputs, first_token, decode = [], [], []
+    for prompt in PROMPTS:
+        started = time.perf_counter()
+        first = None
+        chunks = []
+        for chunk in wrapper.stream_response(prompt, max_new_tokens=new_tokens, do_sample=False):
+            if first is None:
+                first = time.perf_counter() - started
+            chunks.append(chunk)
+        total = time.perf_counter() - started
+        first_token.append(first or total)
+        decode.append(len(wrapper.tokenizer("".join(chunks))["input_ids"]) / max(1e-6, total - (first or 0)))
+        outputs.append("".join(chunks))
+
+    return {
+        'backend': backend,
+        'load_seconds': round(load_seconds, 2),
+        'first_token_ms': round(1000 * sum(first_token) / len(first_token), 1),
+        'tokens_per_sec': round(sum(decode) / len(decode), 2),
+        'outputs': outputs,
+    }
+
+
+def main(model_name: str, backends: list, new_tokens: int):
+    results = []
+    for backend in backends:
+        proc = subprocess.run(
+            [sys.executable, __file__, '--child', backend, '--model', model_name, '--new-tokens', str(new_tokens)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f'{backend}: failed\n{proc.stderr[-2000:]}')
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    reference = next((r['outputs'] for r in results if r['backend'] == 'torch'), None)
+    print(f'{model_name}, {len(PROMPTS)} prompts x up to {new_tokens} new tokens (greedy)')
+    print(f"{'backend':<8} {'load s':>7} {'first token ms':>15} {'tok/s':>8} {'same as torch':>14}")
+    for r in results:
+        same = '-' if reference is None else f"{sum(a == b for a, b in zip(reference, r['outputs']))}/{len(reference)}"
+        print(f"{r['backend']:<8} {r['load_seconds']:>7} {r['first_token_ms']:>15} {r['tokens_per_sec']:>8} {same:>14}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='Qwen/Qwen2.5-0.5B-Instruct')
+    parser.add_argument('--backends', default='torch,onnx')
+    parser.add_argument('--new-tokens', type=int, default=32)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(run_backend(args.model, args.child, args.new_tokens)))
+    else:
+        main(args.model, [b.strip() for b in args.backends.split(',') if b.strip()], args.new_tokens)
@@ -0,0 +1,111 @@
+"""Compare CPU quantization modes (fp32, int8, int4) of a model.
+
+Every mode runs in its own subprocess so RSS numbers are not mixed up.
+Reports load time, peak RSS, weight memory, greedy decode tokens/sec and
+how many generated tokens agree with the fp32 output (position by
+position, plus the share of prompts whose output is identical).
+
+    python scripts/bench_cpu_quantization.py --model Qwen/Qwen2.5-0.5B-Instruct
+    python scripts/bench_cpu_quantization.py --modes fp32,int8 --new-tokens 64
+
+Quantized checkpoints are cached in MODEL_QUANTIZED_DIR, so run it twice
+to see the cached load time.
+"""
+
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+PROMPTS = [
+    'System: You are a helpful assistant.\nUser: What is the capital of Nigeria?\nAssistant:',
+    'System: You are a helpful assistant.\nUser: Explain what a Python list comprehension is.\nAssistant:',
+    'System: You are a helpful assistant.\nUser: Give three tips for writing clear emails.\nAssistant:',
+    'System: You are a helpful assistant.\nUser: Why is the sky blue?\nAssistant:',
+]
+
+
+def run_mode(model_name: str, mode: str, new_tokens: int) -> dict:
+    """Runs inside the child process."""
+    import torch
+    from model_loader import ModelWrapper
+
+    torch.manual_seed(0)
+    started = time.perf_counter()
+    wrapper = ModelWrapper.load_cached(model_name, cpu_quantize=None if mode == 'fp32' else mode)
+    load_seconds = time.perf_counter() - started
+
+    outputs = []
+    generated = 0
+    decode_seconds = 0.0
+    for prompt in PROMPTS:
+        input_ids = wrapper.tokenizer(prompt, return_tensors='pt')['input_ids']
+        with torch.inference_mode():
+            wrapper.model.generate(input_ids, max_new_tokens=2, do_sample=False)  # warm up
+            started = time.perf_counter()
+            out = wrapper.model.generate(input_ids, max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False, pad_token_id=wrapper.tokenizer.pad_token_id)
+            decode_seconds += time.perf_counter() - started
+        ids = out[0, input_ids.shape[1]:].tolist()
+        generated += len(ids)
+        outputs.append(ids)
+
+    return {
+        'mode': mode,
+        'load_seconds': round(load_seconds, 2),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'weights_mb': round(wrapper.resident_bytes() / 2**20, 1),
+        'tokens_per_sec': round(generated / decode_seconds, 2),
+        'outputs': outputs,
+    }
+
+
+def agreement(reference: list, outputs: list) -> tuple:
+    matched = total = identical = 0
+    for ref, out in zip(reference, outputs):
+        total += len(ref)
+        matched += sum(1 for a, b in zip(ref, out) if a == b)
+        identical += ref == out
+    return matched / max(1, total), identical / max(1, len(reference))
+
+
+def main(model_name: str, modes: list, new_tokens: int):
+    results = []
+    for mode in modes:
+        proc = subprocess.run(
+            [sys.executable, __file__, '--child', mode, '--model', model_name, '--new-tokens', str(new_tokens)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f'{mode}: failed\n{proc.stderr[-2000:]}')
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    reference = next((r['outputs'] for r in results if r['mode'] == 'fp32'), None)
+    print(f'{model_name}, {len(PROMPTS)} prompts x {new_tokens} new tokens (greedy)')
+    print(f"{'mode':<6} {'load s':>7} {'peak RSS MB':>12} {'weights MB':>11} {'tok/s':>8} {'token agree':>12} {'identical':>10}")
+    for r in results:
+        if reference is not None:
+            tokens, prompts = agreement(reference, r['outputs'])
+            agree = f'{tokens:>11.1%} {prompts:>10.0%}'
+        else:
+            agree = f"{'-':>11} {'-':>10}"
+        print(f"{r['mode']:<6} {r['load_seconds']:>7} {r['peak_rss_mb']:>12} {r['weights_mb']:>11} {r['tokens_per_sec']:>8} {agree}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='Qwen/Qwen2.5-0.5B-Instruct')
+    parser.add_argument('--modes', default='fp32,int8,int4')
+    parser.add_argument('--new-tokens', type=int, default=32)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(run_mode(args.model, args.child, args.new_tokens)))
+    else:
+        main(args.model, [m.strip() for m in args.modes.split(',') if m.strip()], args.new_tokens)
@@ -0,0 +1,63 @@
+"""Benchmark the DuckDuckGo HTML result parser on the recorded fixtures.
+
+Prints the mean parse time per page for a full parse and for the early-stop
+parse the search service uses (default 5 results), and for BeautifulSoup
+when it is installed, as a reference for a full DOM build.
+
+    python scripts/bench_ddg_parser.py [--repeat 2000] [--num-results 5]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+from web_search import parse_duckduckgo_html  # noqa: E402
+
+
+def bench(fn, html: str, repeat: int) -> float:
+    fn(html)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(html)
+    return (time.perf_counter() - start) / repeat
+
+
+def soup_parse(html: str):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    return [
+        (a.get_text(' ', strip=True), a.get('href'))
+        for a in soup.select('div.result:not(.result--ad) a.result__a')
+    ]
+
+
+def main(repeat: int, num_results: int):
+    try:
+        import bs4  # noqa: F401
+        has_soup = True
+    except ImportError:
+        has_soup = False
+
+    for path in sorted((BACKEND / 'fixtures').glob('duckduckgo_*.html')):
+        html = path.read_text(encoding='utf-8')
+        found = len(parse_duckduckgo_html(html))
+        print(f'{path.name} ({len(html) / 1024:.1f} KiB, {found} results)')
+        full = bench(lambda h: parse_duckduckgo_html(h), html, repeat)
+        early = bench(lambda h: parse_duckduckgo_html(h, num_results), html, repeat)
+        print(f'  full parse:          {full * 1e6:9.1f} us/page')
+        print(f'  first {num_results} results:     {early * 1e6:9.1f} us/page')
+        if has_soup:
+            soup = bench(soup_parse, html, max(1, repeat // 10))
+            print(f'  BeautifulSoup (DOM): {soup * 1e6:9.1f} us/page')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--num-results', type=int, default=5)
+    args = parser.parse_args()
+    main(args.repeat, args.num_results)
@@ -0,0 +1,80 @@
+"""Compare plain decoding with draft-model and prompt-lookup assisted decoding.
+
+Builds the same RAG-style prompt as /chat (CHAT_SYSTEM_PROMPT plus
+`format_search_context` of the saved DuckDuckGo results in
+backend/fixtures) and reports greedy decode tokens/sec, acceptance rate,
+tokens per target forward pass and whether the output matches plain
+decoding.
+
+    python scripts/bench_speculative.py --model Qwen/Qwen2.5-1.5B-Instruct --draft Qwen/Qwen2.5-0.5B-Instruct
+    python scripts/bench_speculative.py --modes off,lookup --new-tokens 128
+
+Without --draft the "draft" mode is skipped.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+QUESTIONS = [
+    'What is Python used for?',
+    'Summarize what the sources say about learning Python.',
+    'Which websites offer Python tutorials?',
+]
+
+
+def build_prompts() -> list:
+    from main import CHAT_SYSTEM_PROMPT
+    from web_search import format_search_context, parse_duckduckgo_html
+
+    html = (BACKEND / 'fixtures' / 'duckduckgo_python_programming.html').read_text(encoding='utf-8')
+    context = format_search_context(parse_duckduckgo_html(html, num_results=5))
+    return [f"System: {CHAT_SYSTEM_PROMPT}\n\nWeb Context:\n{context}\n\nUser Question: {q}\n\nAnswer:" for q in QUESTIONS]
+
+
+def main(model_name: str, draft: str, modes: list, new_tokens: int):
+    if draft:
+        os.environ['SPECULATIVE_DRAFT_MODELS'] = f'{model_name}={draft}'
+    from model_loader import ModelWrapper
+    from speculative import speculation_stats
+
+    wrapper = ModelWrapper.load_cached(model_name)
+    prompts = build_prompts()
+    reference = None
+    print(f'{model_name}, {len(prompts)} RAG prompts x up to {new_tokens} new tokens (greedy)')
+    print(f"{'mode':<7} {'tok/s':>8} {'speedup':>8} {'accepted':>9} {'tok/step':>9} {'same output':>12}")
+    base_rate = None
+    for mode in modes:
+        if mode == 'draft' and not draft:
+            continue
+        wrapper.generate_response(prompts[0], max_new_tokens=4, do_sample=False, use_cache=False, speculative=mode)  # warm up
+        outputs, tokens, seconds = [], 0, 0.0
+        for prompt in prompts:
+            started = time.perf_counter()
+            text = wrapper.generate_response(prompt, max_new_tokens=new_tokens, do_sample=False, use_cache=False, speculative=mode)
+            seconds += time.perf_counter() - started
+            tokens += len(wrapper.tokenizer(text)['input_ids'])
+            outputs.append(text)
+        rate = tokens / seconds
+        base_rate = base_rate or (rate if mode == 'off' else None)
+        reference = reference if reference is not None else (outputs if mode == 'off' else None)
+        totals = next((m for m in speculation_stats.stats()['models'] if m['mode'] == mode), {})
+        speedup = f'{rate / base_rate:.2f}x' if base_rate else '-'
+        same = '-' if reference is None else f'{sum(a == b for a, b in zip(reference, outputs))}/{len(outputs)}'
+        accepted = totals.get('acceptance_rate')
+        print(f"{mode:<7} {rate:>8.1f} {speedup:>8} {accepted if accepted is not None else '-':>9} {totals.get('tokens_per_step') or '-':>9} {same:>12}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='Qwen/Qwen2.5-0.5B-Instruct')
+    parser.add_argument('--draft', default='', help='draft model of the same family for the "draft" mode')
+    parser.add_argument('--modes', default='off,lookup,draft')
+    parser.add_argument('--new-tokens', type=int, default=64)
+    args = parser.parse_args()
+    main(args.model, args.draft, [m.strip() for m in args.modes.split(',') if m.strip()], args.new_tokens)
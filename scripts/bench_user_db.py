@@ -0,0 +1,72 @@
+"""Login throughput of the user database storage engines by user count.
+
+Fills a throwaway database with N users per engine and times
+`authenticate_user` (a lookup plus the last_login write) for a sample of
+them. With the JSON engine every login rewrites the whole file; with
+SQLite it updates one row.
+
+    python scripts/bench_user_db.py
+    python scripts/bench_user_db.py --users 100,1000,10000 --logins 200
+"""
+
+import hashlib
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+from database import Database, JsonUserStore, SqliteUserStore
+
+PASSWORD = 'SecurePass123'
+
+
+def make_users(count: int):
+    password_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    now = datetime.now().isoformat()
+    return [
+        {'email': f'user{i}@example.com', 'username': f'user{i}', 'password_hash': password_hash,
+         'gender': 'not-specified', 'created_at': now, 'last_login': None, 'conversations': []}
+        for i in range(count)
+    ]
+
+
+def bench(engine: str, users: int, logins: int, directory: Path) -> float:
+    """Logins per second."""
+    if engine == 'json':
+        store = JsonUserStore(directory / f'users-{users}.json')
+        store.data = {'users': {u['email']: u for u in make_users(users)}}
+        store._save_database()
+    else:
+        store = SqliteUserStore(directory / f'users-{users}.db', import_from=None)
+        store.insert_many(make_users(users))
+    db = Database(store, flush_interval=0)  # write last_login on every login, as before batching
+    step = max(1, users // logins)
+    emails = [f'user{(i * step) % users}@example.com' for i in range(logins)]
+    started = time.perf_counter()
+    for email in emails:
+        assert db.authenticate_user(email, PASSWORD)['success']
+    elapsed = time.perf_counter() - started
+    db.close()
+    return logins / elapsed
+
+
+def main(user_counts, logins: int, engines):
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'users':>8} " + ' '.join(f'{engine + " logins/s":>18}' for engine in engines))
+        for users in user_counts:
+            rates = [bench(engine, users, logins, Path(tmp)) for engine in engines]
+            print(f'{users:>8} ' + ' '.join(f'{rate:>18.0f}' for rate in rates))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', default='100,1000,10000')
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--engines', default='json,sqlite')
+    args = parser.parse_args()
+    main([int(n) for n in args.users.split(',')], args.logins, [e.strip() for e in args.engines.split(',') if e.strip()])
@@ -0,0 +1,71 @@
+"""Pick SEMANTIC_CACHE_THRESHOLD for an embedding model from labelled question pairs.
+
+Scores pairs that mean the same thing (should hit) and pairs that do not
+(should miss) with the semantic cache's embedder, shows which of them the
+negation / word-order guard rejects, and prints the threshold with the
+fewest wrong hits (then the most right ones).
+
+    python scripts/calibrate_semantic_cache.py
+    python scripts/calibrate_semantic_cache.py --model sentence-transformers/all-mpnet-base-v2
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+from semantic_cache import SEMANTIC_CACHE_MODEL, SentenceEmbedder, conflicts
+
+SAME = [
+    ("what's sofai", "tell me about SofAi"),
+    ("what is python?", "what's python"),
+    ("how do I reverse a list in python", "python: reverse a list"),
+    ("what is the capital of France", "which city is France's capital"),
+    ("how tall is the eiffel tower", "what is the height of the eiffel tower"),
+    ("who wrote hamlet", "hamlet was written by whom"),
+    ("how do I make pancakes", "pancake recipe"),
+    ("what does HTTP stand for", "meaning of the HTTP acronym"),
+]
+DIFFERENT = [
+    ("how do I convert a list to a string in python", "how do I convert a string to a list in python"),
+    ("is it safe to eat raw chicken", "is it not safe to eat raw chicken"),
+    ("what is python", "what is java"),
+    ("how do I install numpy", "how do I uninstall numpy"),
+    ("who is the president of France", "who is the president of Germany"),
+    ("how to sort a list ascending", "how to sort a list descending"),
+    ("what is the capital of France", "what is the population of France"),
+    ("how do I make pancakes", "how do I make waffles"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=SEMANTIC_CACHE_MODEL)
+    args = parser.parse_args()
+
+    embedder = SentenceEmbedder(args.model)
+    if not embedder.load():
+        sys.exit(1)
+
+    scored = []
+    for label, pairs in (('same', SAME), ('different', DIFFERENT)):
+        for a, b in pairs:
+            score = float(embedder(a) @ embedder(b))
+            guarded = conflicts(a, b)
+            scored.append((label, score, guarded))
+            print(f'{label:9} {score:.3f} {"guard" if guarded else "     "}  {a!r} / {b!r}')
+
+    best = None
+    for threshold in [t / 100 for t in range(50, 100)]:
+        right = sum(1 for label, score, guarded in scored if label == 'same' and score >= threshold and not guarded)
+        wrong = sum(1 for label, score, guarded in scored if label == 'different' and score >= threshold and not guarded)
+        if best is None or (wrong, -right) < (best[1], -best[2]):
+            best = (threshold, wrong, right)
+    threshold, wrong, right = best
+    print(f'\nSEMANTIC_CACHE_THRESHOLD={threshold:.2f}: {right}/{len(SAME)} paraphrases hit, {wrong}/{len(DIFFERENT)} different questions hit')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""Copy users from backend/data/users.json into the SQLite user database.
+
+Users that already exist in SQLite are left alone, so it is safe to run
+again. The server also imports users.json by itself the first time it
+creates the SQLite file.
+
+    python scripts/migrate_users.py
+    python scripts/migrate_users.py --json old/users.json --sqlite backend/data/users.db
+"""
+
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+from database import DB_FILE, DB_SQLITE_FILE, migrate_json_to_sqlite
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', type=Path, default=DB_FILE)
+    parser.add_argument('--sqlite', type=Path, default=DB_SQLITE_FILE)
+    args = parser.parse_args()
+    if not args.json.exists():
+        sys.exit(f'{args.json} does not exist')
+    added = migrate_json_to_sqlite(args.json, args.sqlite)
+    print(f'Added {added} users from {args.json} to {args.sqlite}')